@@ -0,0 +1,234 @@
+import os
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+
+from media_stream import probe_audio_format, PCM_BYTES_PER_SECOND
+from cancellation import JobCancelled
+
+# Share of the container's memory (cgroup limit, or physical RAM) that jobs may use,
+# or an explicit budget in MB
+ADMISSION_MEMORY_FRACTION = float(os.getenv('ADMISSION_MEMORY_FRACTION', '0.75'))
+ADMISSION_MEMORY_MB = float(os.getenv('ADMISSION_MEMORY_MB', '0'))
+# Free disk space always left untouched, and where the scratch data lives
+ADMISSION_DISK_RESERVE_BYTES = int(float(os.getenv('ADMISSION_DISK_RESERVE_GB', '1')) * 1024 ** 3)
+ADMISSION_DISK_PATH = os.getenv('ADMISSION_DISK_PATH', '.')
+
+# pydub decodes the whole file: ffmpeg's WAV output is read into memory and then
+# copied into the AudioSegment, so the PCM briefly exists twice
+DECODE_MEMORY_FACTOR = 2.0
+# Interpreter, API client and chunk exports of one job, independent of its length
+BASE_JOB_MEMORY = 100 * 1024 * 1024
+# Decoded audio assumed when the file can't be probed: 48 kHz stereo 16-bit
+DEFAULT_SAMPLE_RATE = 48000
+DEFAULT_CHANNELS = 2
+SAMPLE_WIDTH = 2
+# Compressed audio assumed when a download's size isn't known: 192 kbit/s
+DEFAULT_DOWNLOAD_BYTES_PER_SECOND = 192 * 1000 // 8
+
+POLL_INTERVAL = 5
+
+
+def read_cgroup_memory_limit():
+    """Memory limit of the container in bytes, or None if there is none"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path, 'r') as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:  # cgroup v1 reports "no limit" as a huge number
+            return int(value)
+    return None
+
+
+def detect_memory_budget():
+    """Bytes of memory transcription jobs may use together"""
+    if ADMISSION_MEMORY_MB:
+        return int(ADMISSION_MEMORY_MB * 1024 * 1024)
+    limit = read_cgroup_memory_limit()
+    if limit is None:
+        try:
+            limit = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (ValueError, OSError, AttributeError):
+            limit = 4 * 1024 ** 3
+    return int(limit * ADMISSION_MEMORY_FRACTION)
+
+
+class JobEstimate:
+    """Peak memory and scratch disk a job needs, in bytes"""
+
+    def __init__(self, memory, disk, description=''):
+        self.memory = int(memory)
+        self.disk = int(disk)
+        self.description = description
+
+    def __repr__(self):
+        return (f"JobEstimate({self.description or 'job'}: {self.memory / (1024*1024):.0f} MB memory, "
+                f"{self.disk / (1024*1024):.0f} MB disk)")
+
+
+class AdmissionController:
+    """Admit transcription jobs only while their memory and disk estimates fit.
+
+    Jobs reserve their estimate for as long as they run (``admitted``) and wait
+    while the reservations of running jobs leave too little memory, or the free
+    disk space minus the running jobs' reservations is too small. A job that
+    could never fit, even with nothing else running, raises ValueError instead
+    of waiting forever.
+    """
+
+    def __init__(self, memory_budget=None, disk_path=ADMISSION_DISK_PATH,
+                 disk_reserve=ADMISSION_DISK_RESERVE_BYTES):
+        self.memory_budget = memory_budget or detect_memory_budget()
+        self.disk_path = disk_path
+        self.disk_reserve = disk_reserve
+        self.memory_reserved = 0
+        self.disk_reserved = 0
+        self.running = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def estimate_decode(duration, sample_rate=None, channels=None, disk=0, description=''):
+        """Estimate for transcribing a local file, which is decoded to PCM in memory as a whole"""
+        pcm_bytes = (duration or 0) * (sample_rate or DEFAULT_SAMPLE_RATE) * (channels or DEFAULT_CHANNELS) * SAMPLE_WIDTH
+        # Chunks are exported as MP3 next to it, far smaller than the PCM
+        return JobEstimate(BASE_JOB_MEMORY + pcm_bytes * DECODE_MEMORY_FACTOR,
+                           disk + pcm_bytes / 10, description)
+
+    @classmethod
+    def estimate_file(cls, file_path):
+        """Probe a local file and estimate transcribing it; returns (estimate, probed format)"""
+        info = probe_audio_format(file_path)
+        duration = info['duration']
+        if not duration:
+            # Unreadable header, assume a typical compressed bitrate
+            duration = os.path.getsize(file_path) / DEFAULT_DOWNLOAD_BYTES_PER_SECOND
+        estimate = cls.estimate_decode(duration, info['sample_rate'], info['channels'],
+                                       description=os.path.basename(file_path))
+        return estimate, info
+
+    @staticmethod
+    def estimate_stream(duration=None, download_size=None, chunk_seconds=None, description=''):
+        """Estimate for a URL job that is downloaded to disk and decoded chunk by chunk.
+
+        ``chunk_seconds`` defaults to the longest chunk the transcriber may plan.
+        """
+        if not download_size:
+            download_size = (duration or 0) * DEFAULT_DOWNLOAD_BYTES_PER_SECOND
+        if chunk_seconds is None:
+            from transcriber import MAX_CHUNK_DURATION_MS
+            chunk_seconds = MAX_CHUNK_DURATION_MS / 1000
+        # One chunk of PCM being collected plus the one being sent
+        memory = BASE_JOB_MEMORY + 2 * chunk_seconds * PCM_BYTES_PER_SECOND
+        return JobEstimate(memory, download_size, description)
+
+    def _disk_available(self):
+        try:
+            free = shutil.disk_usage(self.disk_path).free
+        except OSError:
+            return float('inf')
+        return free - self.disk_reserve - self.disk_reserved
+
+    def check(self, estimate):
+        """Raise ValueError if a job could never be admitted"""
+        if estimate.memory > self.memory_budget:
+            raise ValueError(
+                f"This file needs about {estimate.memory / 1024 ** 3:.1f} GB of memory to transcribe, "
+                f"more than the {self.memory_budget / 1024 ** 3:.1f} GB available. "
+                f"Please split it into shorter parts."
+            )
+        try:
+            usage = shutil.disk_usage(self.disk_path)
+        except OSError:
+            return
+        if estimate.disk > usage.total - self.disk_reserve:
+            raise ValueError(
+                f"This file needs about {estimate.disk / 1024 ** 3:.1f} GB of disk space, "
+                f"more than the server has."
+            )
+
+    def _fits(self, estimate):
+        if self.memory_reserved + estimate.memory > self.memory_budget:
+            return False
+        return estimate.disk <= self._disk_available()
+
+    def _wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def admit(self, estimate, timeout=None, cancel_token=None):
+        """Block until the job fits, then reserve its estimate; False if ``timeout`` expired first.
+
+        Raises JobCancelled as soon as ``cancel_token`` is cancelled while waiting.
+        """
+        self.check(estimate)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        unregister = cancel_token.on_cancel(self._wake) if cancel_token else (lambda: None)
+        with self._condition:
+            self.waiting += 1
+            try:
+                while not self._fits(estimate):
+                    if cancel_token and cancel_token.is_cancelled:
+                        raise JobCancelled()
+                    if self.running == 0:
+                        # Nothing will be released, only other processes or the sweeper can free disk
+                        raise ValueError(
+                            f"Not enough free disk space for this file "
+                            f"(needs about {estimate.disk / 1024 ** 3:.1f} GB). Please try again later."
+                        )
+                    remaining = deadline - time.monotonic() if deadline else POLL_INTERVAL
+                    if remaining <= 0:
+                        return False
+                    # Free disk space changes without a notification, so re-check periodically
+                    self._condition.wait(min(remaining, POLL_INTERVAL))
+                self.memory_reserved += estimate.memory
+                self.disk_reserved += estimate.disk
+                self.running += 1
+            finally:
+                self.waiting -= 1
+                unregister()
+        print(f"Admitted {estimate}")
+        return True
+
+    def release(self, estimate):
+        with self._condition:
+            self.memory_reserved -= estimate.memory
+            self.disk_reserved -= estimate.disk
+            self.running -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def admitted(self, estimate, timeout=None, cancel_token=None):
+        """Run the block with the job's estimate reserved; raises TimeoutError if it didn't fit in time"""
+        if not self.admit(estimate, timeout, cancel_token):
+            raise TimeoutError("The server is busy with other large files. Please try again in a few minutes.")
+        try:
+            yield estimate
+        finally:
+            self.release(estimate)
+
+    def snapshot(self):
+        """Reserved and available budget, for status displays"""
+        with self._condition:
+            return {
+                'memory_budget': self.memory_budget,
+                'memory_reserved': self.memory_reserved,
+                'disk_reserved': self.disk_reserved,
+                'disk_available': self._disk_available(),
+                'running': self.running,
+                'waiting': self.waiting,
+            }
+
+
+# Singleton instance
+_admission_controller = None
+
+def get_admission_controller():
+    """Get singleton instance of AdmissionController"""
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController()
+    return _admission_controller
@@ -4,12 +4,23 @@ import shutil
 import datetime
 import uuid
 import hashlib
+import zipfile
+import threading
+from urllib.parse import unquote
 from werkzeug.utils import secure_filename
-from linkedin_service import LinkedInService
-from google_drive_service import GoogleDriveService
-from youtube_service import YouTubeService
+from youtube_service import YouTubeService, TRANSCRIPT_SOURCES, TRANSCRIPT_SOURCE_AUTO, TRANSCRIPT_SOURCE_CAPTIONS, TRANSCRIPT_SOURCE_AUDIO
 from transcriber import get_media_processor
 from summarization_service import get_summarization_service
+from download_manager import get_download_manager
+from upload_service import get_upload_service, UploadError, UPLOAD_PART_SIZE
+from download_cache import get_download_cache
+from admission_control import get_admission_controller, AdmissionController
+from job_scheduler import FairShareGate, JobScheduler, load_user_shares
+from concurrency_control import AdaptiveLimiter, get_api_limiter
+from cancellation import CancellationToken, JobCancelled
+from request_hedging import get_hedge_budget, get_latency_tracker
+from temp_storage import (get_temp_storage, ArtifactClass, system_temp_class,
+                          MEDIA_MAX_AGE, MEDIA_QUOTA_BYTES, TRANSCRIPTS_MAX_AGE, COOKIES_MAX_AGE)
 import tempfile
 from dotenv import load_dotenv
 import asyncio
@@ -22,6 +33,8 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', os.urandom(24).hex())
 TEMP_DIR = 'temp_resources'
 TRANSCRIPTION_DIR = os.path.join(TEMP_DIR, 'transcriptions')
 COOKIES_DIR = os.path.join(TEMP_DIR, '.cookies')  # Hidden directory for security
+# Where nginx spools request bodies for /upload-spooled (must be on the same filesystem as TEMP_DIR)
+NGINX_UPLOAD_DIR = os.getenv('NGINX_UPLOAD_DIR', os.path.join(TEMP_DIR, '.nginx_upload'))
 os.makedirs(TEMP_DIR, exist_ok=True)
 os.makedirs(TRANSCRIPTION_DIR, exist_ok=True)
 os.makedirs(COOKIES_DIR, exist_ok=True)
@@ -33,6 +46,41 @@ ALLOWED_EXTENSIONS = {'mp3', 'mp4', 'mpeg', 'mpga', 'm4a', 'wav', 'webm', 'mkv',
 # Get singleton instances of services
 media_processor = get_media_processor()
 summarization_service = get_summarization_service()
+upload_service = get_upload_service()
+download_manager = get_download_manager()
+admission = get_admission_controller()
+# How long a request waits for memory and disk held by other jobs before giving up
+ADMISSION_WAIT_SECONDS = float(os.getenv('ADMISSION_WAIT_SECONDS', '600'))
+# Transcriptions run at once, shared fairly between clients (weights from whitelist.json). The limit
+# starts here and adapts to throughput, API errors and host load up to the maximum.
+WEB_MAX_PARALLEL_TRANSCRIPTIONS = int(os.getenv('WEB_MAX_PARALLEL_TRANSCRIPTIONS', '3'))
+WEB_MAX_PARALLEL_TRANSCRIPTIONS_LIMIT = int(os.getenv('WEB_MAX_PARALLEL_TRANSCRIPTIONS_LIMIT',
+                                                      str(max(3, 2 * (os.cpu_count() or 1)))))
+transcription_limiter = AdaptiveLimiter('Web transcriptions', WEB_MAX_PARALLEL_TRANSCRIPTIONS,
+                                        maximum=WEB_MAX_PARALLEL_TRANSCRIPTIONS_LIMIT)
+transcription_slots = FairShareGate(transcription_limiter, JobScheduler(shares=load_user_shares('whitelist.json')))
+
+# Running /transcribe requests by the job_id the page sent, so /jobs/<job_id>/cancel can stop them
+active_jobs = {}  # job_id -> (client, CancellationToken)
+active_jobs_lock = threading.Lock()
+
+# Everything the web app leaves on disk is swept by age and size
+temp_storage = get_temp_storage()
+temp_storage.register(ArtifactClass(
+    'media', TEMP_DIR, max_age=MEDIA_MAX_AGE, max_bytes=MEDIA_QUOTA_BYTES,
+    # Uploads and job directories; hidden directories and saved results are classes of their own
+    include=lambda name: not name.startswith('.') and name not in ('transcriptions', 'summaries')
+))
+temp_storage.register(ArtifactClass('transcriptions', TRANSCRIPTION_DIR, max_age=TRANSCRIPTS_MAX_AGE))
+temp_storage.register(ArtifactClass('summaries', os.path.join(TEMP_DIR, 'summaries'), max_age=TRANSCRIPTS_MAX_AGE))
+temp_storage.register(ArtifactClass('cookies', COOKIES_DIR, max_age=COOKIES_MAX_AGE, include=lambda name: True))
+temp_storage.register(ArtifactClass(
+    'upload sessions', upload_service.sessions_dir, max_age=2 * MEDIA_MAX_AGE,
+    include=lambda name: not name.startswith('index.json')
+))
+temp_storage.register(ArtifactClass('spooled uploads', NGINX_UPLOAD_DIR, max_age=MEDIA_MAX_AGE, include=lambda name: True))
+temp_storage.register(system_temp_class())
+temp_storage.add_maintenance(get_download_cache().evict)
 
 
 def allowed_file(filename):
@@ -40,6 +88,11 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def client_key():
+    """The client a request counts against for the fair share: its address as seen by nginx"""
+    return request.headers.get('X-Real-IP') or request.remote_addr
+
+
 def generate_timestamp():
     """Generate a timestamp string for filenames"""
     return datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -71,7 +124,7 @@ def save_transcription(transcription, original_filename, output_dir=None):
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', upload_part_size=UPLOAD_PART_SIZE)
 
 
 @app.route('/upload-file', methods=['POST'])
@@ -121,6 +174,206 @@ def upload_file():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/upload-spooled', methods=['POST', 'PUT'])
+def upload_spooled():
+    """Upload a file as a raw request body.
+
+    Behind nginx the body has already been written to disk and nginx passes its
+    path in ``X-Upload-File``; the file is hardlinked into the job directory
+    instead of being streamed and written a second time. Without nginx the body
+    is streamed straight to disk. The filename comes from ``X-File-Name``
+    (URL-encoded) or the ``filename`` query parameter.
+    """
+    filename = unquote(request.headers.get('X-File-Name', '')) or request.args.get('filename', '')
+    if not filename:
+        return jsonify({'error': 'No filename provided'}), 400
+
+    if not allowed_file(filename):
+        return jsonify({'error': f'Unsupported file format. Allowed formats: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
+
+    filename = secure_filename(filename)
+    spooled_path = request.headers.get('X-Upload-File')
+
+    try:
+        if spooled_path:
+            file_path = upload_service.adopt_spooled_file(spooled_path, filename, NGINX_UPLOAD_DIR)
+            content_hash = None
+        else:
+            file_path, content_hash = upload_service.receive_stream(
+                request.stream, filename, request.content_length
+            )
+
+        duration = media_processor.get_audio_duration(file_path)
+        relative_path = os.path.relpath(file_path, TEMP_DIR)
+
+        if content_hash:
+            upload_service.register_media(
+                content_hash,
+                file_path,
+                os.path.getsize(file_path),
+                round(duration, 2) if duration else None
+            )
+
+        return jsonify({
+            'success': True,
+            'filename': relative_path,
+            'video_path': file_path,
+            'content_hash': content_hash,
+            'duration': round(duration, 2) if duration else None
+        })
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        import traceback
+        print(f"Error processing spooled upload: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Start a resumable upload session"""
+    filename = request.json.get('filename')
+    size = request.json.get('size')
+
+    if not filename:
+        return jsonify({'error': 'No filename provided'}), 400
+
+    if not allowed_file(filename):
+        return jsonify({'error': f'Unsupported file format. Allowed formats: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
+
+    if not isinstance(size, int) or size > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'File too large. Maximum allowed size is 5GB.'}), 413
+
+    try:
+        return jsonify(upload_service.create_session(secure_filename(filename), size))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload_status(upload_id):
+    """Report which parts of an upload have been received, so clients can resume"""
+    try:
+        return jsonify(upload_service.get_status(upload_id))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_range(upload_id):
+    """Receive one part of a resumable upload as a byte range"""
+    try:
+        status = upload_service.write_range(
+            upload_id,
+            request.headers.get('Content-Range'),
+            request.stream
+        )
+        return jsonify({'success': True, 'received': len(status['received_parts']), 'total_parts': status['total_parts']})
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """Discard a resumable upload"""
+    try:
+        upload_service.abort(upload_id)
+        return jsonify({'success': True})
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Finalize a resumable upload once every part has arrived"""
+    expected_hash = (request.get_json(silent=True) or {}).get('content_hash')
+
+    try:
+        file_path, content_hash = upload_service.finalize(upload_id, expected_hash)
+
+        duration = media_processor.get_audio_duration(file_path)
+        relative_path = os.path.relpath(file_path, TEMP_DIR)
+
+        upload_service.register_media(
+            content_hash,
+            file_path,
+            os.path.getsize(file_path),
+            round(duration, 2) if duration else None
+        )
+
+        return jsonify({
+            'success': True,
+            'filename': relative_path,
+            'video_path': file_path,
+            'content_hash': content_hash,
+            'duration': round(duration, 2) if duration else None
+        })
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        import traceback
+        print(f"Error finalizing upload: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/uploads/lookup', methods=['POST'])
+def lookup_upload():
+    """Check whether a file with this content hash was already uploaded.
+
+    Only says where the server's copy is. If it was transcribed, the response
+    carries a challenge; the transcription is served by /uploads/lookup/proof
+    to clients that answer it with the file's bytes, not just its hash.
+    """
+    data = request.get_json(silent=True) or {}
+    content_hash = data.get('content_hash')
+    size = data.get('size')
+
+    if not isinstance(content_hash, str) or not content_hash or not isinstance(size, int):
+        return jsonify({'error': 'content_hash and size are required'}), 400
+
+    existing = upload_service.lookup(content_hash.lower(), size)
+    # Without the media file there is nothing to check a proof against
+    if not existing or not existing['file_path']:
+        return jsonify({'found': False})
+
+    print(f"Upload deduplicated by content hash {content_hash[:16]}...")
+    response = {
+        'found': True,
+        'content_hash': content_hash,
+        'filename': os.path.relpath(existing['file_path'], TEMP_DIR),
+        'duration': existing['duration'],
+        'challenge': None
+    }
+    if existing['transcription_path']:
+        challenge = upload_service.make_challenge(content_hash.lower(), size)
+        session['upload_challenge'] = challenge
+        response['challenge'] = {key: challenge[key] for key in ('offset', 'length', 'nonce')}
+
+    return jsonify(response)
+
+
+@app.route('/uploads/lookup/proof', methods=['POST'])
+def prove_upload():
+    """Serve the transcription of an already uploaded file once the client proved it has the file"""
+    proof = (request.get_json(silent=True) or {}).get('proof')
+
+    try:
+        existing = upload_service.verify_proof(session.pop('upload_challenge', None), proof)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+    if not existing['transcription_path']:
+        return jsonify({'transcription': None, 'transcription_path': None})
+    with open(existing['transcription_path'], 'r', encoding='utf-8') as f:
+        transcription = f.read()
+    return jsonify({
+        'transcription': transcription,
+        'transcription_path': os.path.relpath(existing['transcription_path'], TEMP_DIR)
+    })
+
+
 @app.route('/upload-youtube-cookies', methods=['POST'])
 def upload_youtube_cookies():
     """Securely handle YouTube cookies upload"""
@@ -161,9 +414,13 @@ def upload_youtube_cookies():
 def process_url():
     url = request.json.get('url')
     cookies_id = request.json.get('cookies_id')
+    transcript_source = request.json.get('transcript_source') or TRANSCRIPT_SOURCE_AUTO
     
     if not url:
         return jsonify({'error': 'No URL provided'}), 400
+
+    if transcript_source not in TRANSCRIPT_SOURCES:
+        return jsonify({'error': f'Invalid transcript source. Use one of: {", ".join(TRANSCRIPT_SOURCES)}'}), 400
     
     cookies_path = None
     if cookies_id and 'cookies_map' in session:
@@ -172,17 +429,55 @@ def process_url():
             cookies_path = None
     
     try:
-        temp_dir = tempfile.mkdtemp(dir=TEMP_DIR)
-        
-        if LinkedInService.is_linkedin_url(url):
-            video_path = LinkedInService.download_video(url)
-        elif GoogleDriveService.is_google_drive_url(url):
-            video_path = GoogleDriveService.download_file(url)
-        elif YouTubeService.is_youtube_url(url):
-            video_path = YouTubeService.download_video(url, cookies_path)
-        else:
+        # Existing YouTube captions make downloading and transcribing the audio unnecessary
+        if YouTubeService.is_youtube_url(url) and transcript_source != TRANSCRIPT_SOURCE_AUDIO:
+            captions = YouTubeService.fetch_captions(
+                url, cookies_path, any_language=transcript_source == TRANSCRIPT_SOURCE_CAPTIONS
+            )
+            if captions:
+                transcription_path = save_transcription(
+                    captions['text'],
+                    captions['title'] or YouTubeService.get_video_id(url) or 'youtube'
+                )
+                return jsonify({
+                    'success': True,
+                    'filename': None,
+                    'transcription': captions['text'],
+                    'transcription_path': transcription_path,
+                    'transcript_source': TRANSCRIPT_SOURCE_CAPTIONS,
+                    'captions_language': captions['language'],
+                    'captions_automatic': captions['is_automatic'],
+                    'duration': captions['duration']
+                })
+            if transcript_source == TRANSCRIPT_SOURCE_CAPTIONS:
+                return jsonify({'error': 'This video has no usable captions. Choose "Transcribe audio" instead.'}), 404
+
+        if not download_manager.get_source(url):
             return jsonify({'error': 'Unsupported URL format'}), 400
 
+        # Look up duration and size first so oversized media is rejected before downloading it
+        media_info = {}
+        try:
+            media_info = download_manager.probe(url, cookies_path)
+        except Exception as e:
+            print(f"Metadata lookup failed, downloading without it: {e}")
+        # Only the size checks answer 413; download errors are left to the 500 handler below
+        try:
+            download_manager.check_limits(media_info)
+            estimate = AdmissionController.estimate_stream(media_info.get('duration'), media_info.get('size'),
+                                                           description=url)
+            admission.check(estimate)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 413
+
+        # Each request gets its own directory; repeat requests are served from the download cache
+        temp_dir = download_manager.new_job_dir()
+        try:
+            with admission.admitted(estimate, timeout=ADMISSION_WAIT_SECONDS):
+                video_path = download_manager.download(url, temp_dir, cookies_path)
+        except TimeoutError as e:
+            return jsonify({'error': str(e)}), 503
+
         # Sanitize the filename - replace spaces and special characters
         original_filename = os.path.basename(video_path)
         safe_filename = ''.join(c for c in original_filename if c.isalnum() or c in '._-') 
@@ -206,7 +501,7 @@ def process_url():
             except Exception:
                 pass
 
-        duration = media_processor.get_audio_duration(new_path)
+        duration = media_info.get('duration') or media_processor.get_audio_duration(new_path)
         
         # Get the path relative to TEMP_DIR
         relative_path = os.path.relpath(new_path, TEMP_DIR)
@@ -215,6 +510,8 @@ def process_url():
             'success': True,
             'filename': relative_path,
             'video_path': new_path,
+            'title': media_info.get('title'),
+            'transcript_source': TRANSCRIPT_SOURCE_AUDIO,
             'duration': round(duration, 2) if duration else None
         })
     except Exception as e:
@@ -231,15 +528,68 @@ def process_url():
                 print(f"Warning: Could not delete cookies file: {e}")
 
 
+@app.route('/expand-playlist', methods=['POST'])
+def expand_playlist():
+    """List the videos of a YouTube playlist or channel so the client can transcribe them as a batch"""
+    url = request.json.get('url')
+    if not url or not YouTubeService.is_playlist_url(url):
+        return jsonify({'error': 'Not a YouTube playlist or channel URL'}), 400
+
+    try:
+        playlist = YouTubeService.expand_playlist(url)
+        if not playlist['entries']:
+            return jsonify({'error': 'This playlist has no videos that can be accessed'}), 404
+        return jsonify({'success': True, **playlist})
+    except Exception as e:
+        print(f"Error expanding playlist: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/transcriptions/archive', methods=['POST'])
+def archive_transcriptions():
+    """Bundle the transcriptions of a batch into one zip file"""
+    paths = request.json.get('paths') or []
+    name = secure_filename(request.json.get('name') or 'transcriptions') or 'transcriptions'
+
+    temp_root = os.path.realpath(TEMP_DIR)
+    files = []
+    for path in paths:
+        full_path = os.path.realpath(os.path.join(TEMP_DIR, path))
+        # Only transcriptions inside temp_resources can be archived
+        if not full_path.startswith(temp_root + os.sep) or not full_path.endswith('.txt'):
+            return jsonify({'error': f'Invalid transcription path: {path}'}), 400
+        if os.path.exists(full_path):
+            files.append(full_path)
+
+    if not files:
+        return jsonify({'error': 'No transcriptions to archive'}), 400
+
+    archive_path = os.path.join(TRANSCRIPTION_DIR, f"{name}_{generate_timestamp()}.zip")
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for number, full_path in enumerate(files, 1):
+            archive.write(full_path, f"{number:03d} - {os.path.basename(full_path)}")
+
+    return jsonify({
+        'success': True,
+        'archive_path': os.path.relpath(archive_path, TEMP_DIR),
+        'count': len(files)
+    })
+
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe_video():
     filename = request.json.get('file_path')  # This will now be just the filename
     prompt = request.json.get('prompt')  # Optional prompt parameter
     output_dir = request.json.get('output_dir')  # Optional output directory
+    job_id = request.json.get('job_id')  # Optional, lets the page cancel the request
     
     if not filename:
         return jsonify({'error': 'No file path provided'}), 400
     
+    cancel_token = CancellationToken()
+    if job_id:
+        with active_jobs_lock:
+            active_jobs[job_id] = (client_key(), cancel_token)
     try:
         # Construct the full path using the filename
         local_path = os.path.join(TEMP_DIR, filename)
@@ -254,7 +604,26 @@ def transcribe_video():
                     print(os.path.join(root, name))
             return jsonify({'error': f'File not found: {local_path}'}), 404
 
-        response = media_processor.transcribe_audio(local_path, prompt)
+        # Decoding holds the whole file's audio in memory, so wait until it fits next to running jobs
+        estimate, info = AdmissionController.estimate_file(local_path)
+        try:
+            admission.check(estimate)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 413
+        # Transcription errors (ValueError too) are left to the 500 handler below
+        try:
+            # Pin the file before waiting, then wait for this client's turn first, so one client's
+            # backlog can't hold all memory and workers
+            with temp_storage.pinned(local_path), \
+                    transcription_slots.slot(client_key(), duration=info['duration'], size=os.path.getsize(local_path),
+                                             timeout=ADMISSION_WAIT_SECONDS, cancel_token=cancel_token), \
+                    admission.admitted(estimate, timeout=ADMISSION_WAIT_SECONDS, cancel_token=cancel_token):
+                response = media_processor.transcribe_audio(local_path, prompt, cancel_token)
+        except JobCancelled:
+            print(f"Transcription of {local_path} cancelled")
+            return jsonify({'error': 'Transcription cancelled', 'cancelled': True}), 409
+        except TimeoutError as e:
+            return jsonify({'error': str(e)}), 503
         if not response:
             return jsonify({'error': 'Transcription failed'}), 500
             
@@ -262,19 +631,37 @@ def transcribe_video():
         
         # Save the transcription to a file
         transcription_path = save_transcription(transcription, local_path, output_dir)
+        upload_service.register_transcription(local_path, os.path.join(TEMP_DIR, transcription_path))
 
         duration = media_processor.get_audio_duration(local_path)
         
         return jsonify({
             'transcription': transcription,
             'transcription_path': transcription_path,
-            'duration': round(duration, 2) if duration else None
+            'duration': round(duration, 2) if duration else None,
+            'repairs': response.repairs.snapshot()
         })
     except Exception as e:
         import traceback
         print(f"Error during transcription: {str(e)}")
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
+    finally:
+        if job_id:
+            with active_jobs_lock:
+                active_jobs.pop(job_id, None)
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a running /transcribe request: requests in flight are aborted and its slot is freed"""
+    with active_jobs_lock:
+        job = active_jobs.get(job_id)
+    # Only the client that started a job may cancel it
+    if not job or job[0] != client_key():
+        return jsonify({'error': 'No such job'}), 404
+    job[1].cancel()
+    return jsonify({'success': True})
 
 
 @app.route('/summarize', methods=['POST'])
@@ -329,6 +716,18 @@ def summarize_transcription():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/metrics')
+def metrics():
+    """Current concurrency limits and why, request hedging, and the memory and disk reserved by running jobs"""
+    return jsonify({
+        'concurrency': [transcription_limiter.snapshot(), get_api_limiter().snapshot()],
+        'queued_transcriptions': len(transcription_slots.scheduler),
+        'hedging': get_hedge_budget().snapshot(),
+        'latency': get_latency_tracker().snapshot(),
+        'admission': admission.snapshot(),
+    })
+
+
 @app.route('/temp_resources/<path:filename>')
 def serve_temp_file(filename):
     # Split the path into directory and filename
@@ -346,4 +745,7 @@ def serve_temp_file(filename):
 
 
 if __name__ == '__main__':
+    # With the reloader only the child process serves requests (and pins files), so only it sweeps
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        temp_storage.start()
     app.run(port=8082, host='0.0.0.0', debug=True)
@@ -0,0 +1,70 @@
+import threading
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its CancellationToken has been cancelled"""
+
+    def __init__(self, message="The job was cancelled"):
+        super().__init__(message)
+
+
+class CancellationToken:
+    """Cancellation flag shared between a running job and whoever may cancel it.
+
+    The job checks the token at safe points (``raise_if_cancelled``) and waits
+    on it instead of sleeping (``wait``). Callbacks registered with
+    ``on_cancel`` run once when it is cancelled, to interrupt work that
+    doesn't poll: closing the connections of API requests in flight, killing
+    a decoder, or waking up a thread waiting for a slot.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the job; returns False if it was already cancelled"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Warning: Cancellation callback failed: {e}")
+        return True
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+    def wait(self, timeout):
+        """Sleep up to ``timeout`` seconds; returns True early if the job was cancelled"""
+        return self._event.wait(timeout)
+
+    def on_cancel(self, callback):
+        """Run ``callback`` when the token is cancelled (right away if it already is).
+
+        Returns a function that unregisters the callback, for when the work it
+        interrupts has finished.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
@@ -0,0 +1,217 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from admission_control import read_cgroup_memory_limit
+
+# How often a limiter reconsiders its limit from the throughput it measured
+ADJUST_INTERVAL_SECONDS = float(os.getenv('CONCURRENCY_ADJUST_SECONDS', '30'))
+# Throughput may wobble this much without counting as a drop
+THROUGHPUT_TOLERANCE = 0.05
+# Multiplicative decrease on errors or pressure, at most once per cooldown
+DECREASE_FACTOR = 0.5
+BACKOFF_COOLDOWN_SECONDS = 10
+# Back off when this share of the memory limit is in use, or the 1-minute load per core is above this
+MEMORY_PRESSURE_FRACTION = 0.9
+CPU_LOAD_PER_CORE_LIMIT = float(os.getenv('CPU_LOAD_PER_CORE_LIMIT', '1.5'))
+
+# Transcription API requests in flight across all jobs of the process
+API_CONCURRENCY_INITIAL = int(os.getenv('API_CONCURRENCY_INITIAL', '4'))
+API_CONCURRENCY_MAX = int(os.getenv('API_CONCURRENCY_MAX', '12'))
+
+
+def _memory_in_use():
+    """(bytes used, limit) for the container, or the machine without a cgroup limit; None if unknown"""
+    limit = read_cgroup_memory_limit()
+    if limit:
+        for path in ('/sys/fs/cgroup/memory.current', '/sys/fs/cgroup/memory/memory.usage_in_bytes'):
+            try:
+                with open(path, 'r') as f:
+                    return int(f.read().strip()), limit
+            except (OSError, ValueError):
+                continue
+    try:
+        meminfo = {}
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                meminfo[name] = int(value.split()[0]) * 1024
+        return meminfo['MemTotal'] - meminfo['MemAvailable'], meminfo['MemTotal']
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def system_pressure():
+    """Why the host can't take more work right now (memory or CPU), or None"""
+    memory = _memory_in_use()
+    if memory and memory[0] > memory[1] * MEMORY_PRESSURE_FRACTION:
+        return f"memory pressure ({memory[0] / memory[1]:.0%} in use)"
+    try:
+        load = os.getloadavg()[0]
+    except (OSError, AttributeError):
+        return None
+    cores = os.cpu_count() or 1
+    if load > cores * CPU_LOAD_PER_CORE_LIMIT:
+        return f"CPU saturated (load {load:.1f} on {cores} cores)"
+    return None
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that adapts to throughput, errors and host pressure (AIMD).
+
+    Work is done in slots (``slot()`` blocks while ``limit`` slots are taken,
+    or the caller checks ``try_acquire``). Callers report finished work with
+    ``record_success(work)`` and overload signals like 429s and timeouts with
+    ``record_failure(reason)``, which halves the limit right away. Every
+    ``ADJUST_INTERVAL_SECONDS`` the limit is reconsidered: it halves under
+    memory pressure or CPU saturation, drops back by one if throughput fell
+    after the last increase, and grows by one if every slot was busy and
+    throughput kept up. ``reason`` explains the last change.
+    """
+
+    def __init__(self, name, initial, minimum=1, maximum=None, interval=ADJUST_INTERVAL_SECONDS):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.interval = interval
+        self._limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self.reason = "initial limit"
+        self.throughput = None  # work per second in the last window
+        self._window_start = time.monotonic()
+        self._window_work = 0.0
+        self._window_errors = 0
+        self._window_peak = 0
+        self._last_increase = False
+        self._last_backoff = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def _set_limit(self, limit, reason):
+        """Change the limit (caller holds the condition)"""
+        limit = min(max(limit, self.minimum), self.maximum)
+        if int(limit) != int(self._limit):
+            print(f"{self.name} concurrency {int(self._limit)} -> {int(limit)}: {reason}")
+            self.reason = reason
+        self._limit = limit
+        self._condition.notify_all()
+
+    def _back_off(self, reason, now):
+        if now - self._last_backoff < BACKOFF_COOLDOWN_SECONDS:
+            return  # Requests sent before the last backoff are still reporting
+        self._last_backoff = now
+        self._last_increase = False
+        self._set_limit(self._limit * DECREASE_FACTOR, reason)
+
+    def try_acquire(self):
+        """Take a slot if one is free"""
+        with self._condition:
+            self._maybe_adjust()
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            self._window_peak = max(self._window_peak, self.in_flight)
+            return True
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait(self.interval)
+                self._maybe_adjust()
+            self.in_flight += 1
+            self._window_peak = max(self._window_peak, self.in_flight)
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record_success(self, work=1.0):
+        with self._condition:
+            self._window_work += work
+            self._maybe_adjust()
+
+    def record_failure(self, reason):
+        """An overload signal from downstream (rate limit, timeout): halve the limit"""
+        with self._condition:
+            self._window_errors += 1
+            self._back_off(reason, time.monotonic())
+
+    def _maybe_adjust(self):
+        """Reconsider the limit once per interval (caller holds the condition)"""
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.interval:
+            return
+        throughput = self._window_work / elapsed
+        previous = self.throughput
+        saturated = self._window_peak >= self.limit
+        errors = self._window_errors
+        self.throughput = throughput
+        self._window_start = now
+        self._window_work = 0.0
+        self._window_errors = 0
+        self._window_peak = self.in_flight
+
+        pressure = system_pressure()
+        if pressure:
+            self._back_off(pressure, now)
+        elif self._last_increase and previous and throughput < previous * (1 - THROUGHPUT_TOLERANCE):
+            # The extra slot didn't pay off
+            self._last_increase = False
+            self._set_limit(self._limit - 1, "throughput fell after the last increase")
+        elif saturated and not errors and (not previous or throughput >= previous * (1 - THROUGHPUT_TOLERANCE)):
+            self._last_increase = self.limit < self.maximum
+            self._set_limit(self._limit + 1, "all slots busy and throughput holding up")
+        else:
+            self._last_increase = False
+
+    def snapshot(self):
+        """Current limit and why, for /status and /metrics"""
+        with self._condition:
+            self._maybe_adjust()
+            return {
+                'name': self.name,
+                'limit': self.limit,
+                'minimum': self.minimum,
+                'maximum': self.maximum,
+                'in_flight': self.in_flight,
+                'reason': self.reason,
+                'throughput': self.throughput,
+            }
+
+
+def is_overload_error(error):
+    """Why an API error means we send too much (429, timeout), or None for other errors"""
+    status = getattr(error, 'status_code', None)
+    if status == 429:
+        return "rate limited by the API (429)"
+    if status in (502, 503, 504):
+        return f"API overloaded ({status})"
+    name = type(error).__name__
+    if 'Timeout' in name or isinstance(error, TimeoutError):
+        return "API request timed out"
+    return None
+
+
+# Singleton instance, shared by every job of the process
+_api_limiter = None
+
+def get_api_limiter():
+    """Get singleton AdaptiveLimiter for transcription API requests"""
+    global _api_limiter
+    if _api_limiter is None:
+        _api_limiter = AdaptiveLimiter('API requests', API_CONCURRENCY_INITIAL, maximum=API_CONCURRENCY_MAX)
+    return _api_limiter
@@ -0,0 +1,123 @@
+import os
+import gzip
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+class ContextStore:
+    """Per-user context (last transcription, last summary) with bounded memory.
+
+    Values are kept in an in-memory LRU tier limited by an approximate byte
+    budget, and written through to gzip-compressed JSON files so they survive
+    restarts and can be dropped from memory at any time. Entries expire a TTL
+    after they were last written; the files of expired entries are removed by
+    the temp storage sweeper, or when they are next read.
+
+    Supports the dict operations the bot uses: ``in``, ``[]``, ``get``,
+    ``[] =`` and ``pop``. Values must be JSON serializable.
+    """
+
+    def __init__(self, directory, ttl_seconds, max_memory_bytes):
+        self.directory = directory
+        self.ttl = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self._memory = OrderedDict()  # key -> (value, size, written_at)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def _remember(self, key, value, size, written_at):
+        """Put a value in the memory tier (caller holds the lock), evicting the least recently used"""
+        self._forget(key)
+        self._memory[key] = (value, size, written_at)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, (_, evicted_size, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def _forget(self, key):
+        entry = self._memory.pop(key, None)
+        if entry:
+            self._memory_bytes -= entry[1]
+
+    def __setitem__(self, key, value):
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._remember(key, value, len(data), time.time())
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                value, _, written_at = entry
+                if now - written_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    return value
+                self._forget(key)
+
+        path = self._path(key)
+        try:
+            written_at = os.path.getmtime(path)
+            if now - written_at >= self.ttl:
+                os.remove(path)
+                return default
+            with gzip.open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return default
+        except (OSError, EOFError) as e:
+            print(f"Warning: Could not read context {path}: {e}")
+            return default
+
+        value = json.loads(data.decode('utf-8'))
+        with self._lock:
+            self._remember(key, value, len(data), written_at)
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        # Checked on every text message, so this never decompresses anything
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[2] < self.ttl:
+                return True
+        try:
+            return now - os.path.getmtime(self._path(key)) < self.ttl
+        except OSError:
+            return False
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        with self._lock:
+            self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        return value
+
+    def memory_usage(self):
+        """(entries, bytes) currently held in memory"""
+        with self._lock:
+            return len(self._memory), self._memory_bytes
+
+
+_MISSING = object()
@@ -0,0 +1,62 @@
+import os
+import re
+import hashlib
+import tempfile
+from urllib.parse import urlparse, unquote
+
+from http_downloader import get_ranged_downloader
+from media_stream import probe_duration
+
+# File extensions that identify a plain HTTP(S) link as media we can transcribe
+DIRECT_MEDIA_EXTENSIONS = {'.mp3', '.mp4', '.mpeg', '.mpga', '.m4a', '.wav', '.webm', '.mkv', '.avi', '.mov', '.ogg', '.opus', '.flac'}
+
+
+class DirectMediaService:
+    @staticmethod
+    def is_direct_media_url(url):
+        """Check if the given string is an http(s) link straight to a media file"""
+        try:
+            parsed = urlparse(url)
+            if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+                return False
+            _, ext = os.path.splitext(unquote(parsed.path))
+            return ext.lower() in DIRECT_MEDIA_EXTENSIONS
+        except Exception:
+            return False
+
+    @staticmethod
+    def get_media_id(url):
+        """Stable id for a direct media URL, used as its download cache key"""
+        return hashlib.sha256(url.encode()).hexdigest()[:24]
+
+    @staticmethod
+    def probe(url):
+        """Size and duration of a media link, reading only its headers"""
+        probe = get_ranged_downloader().probe(url)
+        if probe['content_type'].startswith('text/html'):
+            raise ValueError("The link points to a web page, not to a media file")
+        return {
+            'title': probe['filename'],
+            'duration': probe_duration(probe['url']),
+            'size': probe['size'],
+            'is_live': False,
+        }
+
+    @staticmethod
+    def download_file(url, output_dir=None, progress_hook=None):
+        """Download a media file over HTTP(S) with parallel ranged requests"""
+        print(f"Downloading media from {urlparse(url).netloc}...")
+
+        try:
+            downloader = get_ranged_downloader()
+            probe = downloader.probe(url)
+            if probe['content_type'].startswith('text/html'):
+                raise ValueError("The link points to a web page, not to a media file")
+
+            name = probe['filename'] or os.path.basename(unquote(urlparse(url).path))
+            name = re.sub(r'[^\w\-. ]', '_', name).strip() or 'media'
+            output_dir = output_dir or tempfile.mkdtemp(dir='temp_resources')
+            return downloader.download(url, os.path.join(output_dir, name), progress_hook, probe)
+        except Exception as e:
+            print(f"Error downloading media: {e}")
+            raise ValueError(f"Failed to download media file: {str(e)}")
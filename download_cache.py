@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import errno
+import shutil
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; cross-process locking is skipped there
+    fcntl = None
+
+
+CACHE_DIR = os.getenv('DOWNLOAD_CACHE_DIR', os.path.join('temp_resources', '.download_cache'))
+CACHE_TTL_SECONDS = float(os.getenv('DOWNLOAD_CACHE_TTL_HOURS', '24')) * 3600
+CACHE_MAX_BYTES = int(float(os.getenv('DOWNLOAD_CACHE_MAX_GB', '20')) * 1024 ** 3)
+
+
+# ioctl for a copy-on-write clone of a whole file (Linux, on btrfs, XFS and similar)
+FICLONE = 0x40049409
+
+
+def _reflink(source, destination):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def link_or_copy(source, destination):
+    """Hardlink ``source`` to ``destination``; where that's impossible try a reflink, then copy"""
+    try:
+        os.link(source, destination)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EROFS):
+            raise
+        try:
+            _reflink(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+    return destination
+
+
+class DownloadCache:
+    """On-disk cache of downloaded media keyed by (source, id, format).
+
+    Each entry is a directory holding the media file and a ``meta.json`` with its
+    size and access times. Entries expire after a TTL, and the least recently used
+    ones are evicted once the cache grows beyond its size budget. Callers never
+    get the cached file itself but a hardlink in their own directory, so they can
+    move or delete it freely and eviction never pulls a file from under a job.
+
+    Concurrent requests for the same key share one download: they serialize on a
+    per-key lock (a thread lock plus an ``flock`` so the web app and the bot,
+    which share ``temp_resources``, also cooperate) and the followers find the
+    entry the leader just stored.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl_seconds=CACHE_TTL_SECONDS, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(source, media_id, fmt):
+        return hashlib.sha256(f"{source}:{media_id}:{fmt}".encode()).hexdigest()[:32]
+
+    def _thread_lock(self, key):
+        with self._locks_guard:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def _lock_key(self, key, blocking=True):
+        """Acquire the per-key lock; returns a release callable, or None if busy and not blocking"""
+        thread_lock = self._thread_lock(key)
+        if not thread_lock.acquire(blocking):
+            return None
+
+        lock_file = None
+        if fcntl:
+            lock_file = open(os.path.join(self.cache_dir, f"{key}.lock"), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                thread_lock.release()
+                return None
+
+        def release():
+            if lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            thread_lock.release()
+        return release
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _read_meta(self, key):
+        try:
+            with open(os.path.join(self._entry_dir(key), 'meta.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_meta(self, key, meta):
+        meta_path = os.path.join(self._entry_dir(key), 'meta.json')
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _valid_entry(self, key, now):
+        meta = self._read_meta(key)
+        if not meta:
+            return None
+        path = os.path.join(self._entry_dir(key), meta['filename'])
+        if now - meta['created'] > self.ttl_seconds or not os.path.exists(path):
+            return None
+        return meta, path
+
+    def fetch(self, source, media_id, fmt, download, dest_dir):
+        """Return a path in ``dest_dir`` to the media, downloading it only on a cache miss.
+
+        ``download(output_dir)`` must download the media into ``output_dir`` and
+        return the file path.
+        """
+        key = self.make_key(source, media_id, fmt)
+        release = self._lock_key(key)
+        try:
+            now = time.time()
+            entry = self._valid_entry(key, now)
+            if entry:
+                meta, cached_path = entry
+                meta['last_access'] = now
+                meta['hits'] = meta.get('hits', 0) + 1
+                self._write_meta(key, meta)
+                print(f"Download cache hit for {source}:{media_id} ({meta['size'] / (1024*1024):.1f} MB)")
+            else:
+                entry_dir = self._entry_dir(key)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                # A failed download leaves its partial files here, so the next attempt resumes them
+                staging_dir = os.path.join(self.cache_dir, f".staging_{key}")
+                os.makedirs(staging_dir, exist_ok=True)
+                downloaded = download(staging_dir)
+                os.makedirs(entry_dir)
+                filename = os.path.basename(downloaded)
+                cached_path = os.path.join(entry_dir, filename)
+                os.replace(downloaded, cached_path)
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+                self._write_meta(key, {
+                    'source': source,
+                    'media_id': media_id,
+                    'format': fmt,
+                    'filename': filename,
+                    'size': os.path.getsize(cached_path),
+                    'created': now,
+                    'last_access': now,
+                    'hits': 0,
+                })
+                print(f"Cached download for {source}:{media_id}")
+
+            os.makedirs(dest_dir, exist_ok=True)
+            result = link_or_copy(cached_path, os.path.join(dest_dir, os.path.basename(cached_path)))
+        finally:
+            release()
+
+        self.evict(keep=key)
+        return result
+
+    def evict(self, keep=None):
+        """Drop expired entries, then least recently used ones until under the size budget"""
+        now = time.time()
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if key.startswith('.staging_'):
+                self._evict_staging(key[len('.staging_'):], now)
+                continue
+            if key.startswith('.') or key.endswith('.lock') or key == keep:
+                continue
+            meta = self._read_meta(key)
+            if meta is None:
+                # Leftover from an interrupted download, only remove it if nobody is working on it
+                if os.path.isdir(self._entry_dir(key)):
+                    entries.append((0, key, 0))
+                continue
+            entries.append((meta.get('last_access', 0), key, meta.get('size', 0)))
+
+        total = sum(size for _, _, size in entries)
+        keep_meta = self._read_meta(keep) if keep else None
+        if keep_meta:
+            total += keep_meta.get('size', 0)
+
+        for last_access, key, size in sorted(entries):
+            expired = now - last_access > self.ttl_seconds
+            if not expired and total <= self.max_bytes:
+                continue
+            release = self._lock_key(key, blocking=False)
+            if not release:
+                continue  # in use, try again next time
+            try:
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                total -= size
+                print(f"Evicted download cache entry {key} ({size / (1024*1024):.1f} MB)")
+            finally:
+                release()
+
+    def _evict_staging(self, key, now):
+        """Drop partial downloads nobody has resumed within the TTL"""
+        staging_dir = os.path.join(self.cache_dir, f".staging_{key}")
+        try:
+            if now - os.path.getmtime(staging_dir) <= self.ttl_seconds:
+                return
+        except OSError:
+            return
+        release = self._lock_key(key, blocking=False)
+        if release:
+            try:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            finally:
+                release()
+
+
+# Singleton instance
+_download_cache = None
+
+def get_download_cache():
+    """Get singleton instance of DownloadCache"""
+    global _download_cache
+    if _download_cache is None:
+        _download_cache = DownloadCache()
+    return _download_cache
@@ -0,0 +1,253 @@
+import os
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+
+from youtube_service import YouTubeService
+from google_drive_service import GoogleDriveService
+from linkedin_service import LinkedInService
+from direct_media_service import DirectMediaService
+from download_policy import get_audio_download_policy
+from download_cache import get_download_cache
+
+DOWNLOAD_ROOT = 'temp_resources'
+
+# Concurrent downloads across all sources, and per source
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '4'))
+SOURCE_DOWNLOAD_LIMITS = {
+    'youtube': int(os.getenv('MAX_YOUTUBE_DOWNLOADS', '2')),
+    'linkedin': int(os.getenv('MAX_LINKEDIN_DOWNLOADS', '2')),
+    'gdrive': int(os.getenv('MAX_GDRIVE_DOWNLOADS', '2')),
+    'http': int(os.getenv('MAX_HTTP_DOWNLOADS', '2')),
+}
+
+# Total download bandwidth in megabits per second, 0 for unlimited. Keeping it
+# below the link capacity leaves room for uploading chunks to the API.
+DOWNLOAD_BANDWIDTH_MBPS = float(os.getenv('DOWNLOAD_BANDWIDTH_MBPS', '0'))
+
+# URL jobs larger than this are rejected before anything is downloaded
+MAX_MEDIA_DURATION_HOURS = float(os.getenv('MAX_MEDIA_DURATION_HOURS', '10'))
+MAX_DOWNLOAD_SIZE_GB = float(os.getenv('MAX_DOWNLOAD_SIZE_GB', '5'))
+
+SOURCE_NAMES = {
+    'youtube': 'YouTube',
+    'linkedin': 'LinkedIn',
+    'gdrive': 'Google Drive',
+    'http': 'the web',
+}
+
+
+class BandwidthLimiter:
+    """Token bucket shared by all downloads; ``consume`` blocks until the bytes fit the rate"""
+
+    def __init__(self, bytes_per_second, burst_seconds=1.0):
+        self.rate = bytes_per_second
+        self.capacity = bytes_per_second * burst_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            # Debt is paid back by sleeping; later callers queue up behind it
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class DownloadManager:
+    """Entry point for every URL download.
+
+    Each job downloads into its own directory, so concurrent jobs never see each
+    other's files. Downloads take a slot from a per-source and a global
+    semaphore, share an optional bandwidth limit, and report progress through
+    yt-dlp style hooks; active downloads are listed by ``active_downloads()``.
+    Cache hits skip all of that and return immediately.
+    """
+
+    def __init__(self, root=DOWNLOAD_ROOT, max_concurrent=MAX_CONCURRENT_DOWNLOADS,
+                 source_limits=None, bandwidth_mbps=DOWNLOAD_BANDWIDTH_MBPS):
+        self.root = root
+        self.cache = get_download_cache()
+        self._global_slots = threading.BoundedSemaphore(max_concurrent)
+        self._source_slots = {
+            source: threading.BoundedSemaphore(limit)
+            for source, limit in (source_limits or SOURCE_DOWNLOAD_LIMITS).items()
+        }
+        self.limiter = BandwidthLimiter(bandwidth_mbps * 1000 * 1000 / 8) if bandwidth_mbps > 0 else None
+        self._active = {}
+        self._active_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def new_job_dir(self):
+        """Create a private directory for one job's downloads (next to the cache, so files can be hardlinked)"""
+        return tempfile.mkdtemp(dir=self.root, prefix='job_')
+
+    @staticmethod
+    def get_source(url):
+        """Short name of the source a URL belongs to, or None if unsupported"""
+        if YouTubeService.is_youtube_url(url):
+            return 'youtube'
+        if GoogleDriveService.is_google_drive_url(url):
+            return 'gdrive'
+        if LinkedInService.is_linkedin_url(url):
+            return 'linkedin'
+        if DirectMediaService.is_direct_media_url(url):
+            return 'http'
+        return None
+
+    @staticmethod
+    def source_name(url):
+        return SOURCE_NAMES.get(DownloadManager.get_source(url), "Unknown")
+
+    def probe(self, url, cookies_path=None):
+        """Cheap metadata lookup before downloading: yt-dlp metadata or a range probe.
+
+        Returns a dict with 'source', 'title', 'duration' and 'size'; fields the
+        source doesn't report are None.
+        """
+        source = self.get_source(url)
+        if source == 'youtube':
+            info = YouTubeService.probe(url, cookies_path)
+        elif source == 'linkedin':
+            info = LinkedInService.probe(url)
+        elif source == 'gdrive':
+            info = GoogleDriveService.probe(url)
+        elif source == 'http':
+            info = DirectMediaService.probe(url)
+        else:
+            raise ValueError("Unsupported URL type")
+        info['source'] = source
+        return info
+
+    @staticmethod
+    def check_limits(info):
+        """Raise ValueError if probed media is too long or too large to accept"""
+        if info.get('is_live'):
+            raise ValueError("Live streams can't be transcribed until they have ended")
+        duration = info.get('duration')
+        if duration and duration > MAX_MEDIA_DURATION_HOURS * 3600:
+            raise ValueError(
+                f"Media is too long ({duration / 3600:.1f} hours). "
+                f"The limit is {MAX_MEDIA_DURATION_HOURS:g} hours."
+            )
+        size = info.get('size')
+        if size and size > MAX_DOWNLOAD_SIZE_GB * 1024 ** 3:
+            raise ValueError(
+                f"Media is too large ({size / 1024 ** 3:.1f} GB). "
+                f"The limit is {MAX_DOWNLOAD_SIZE_GB:g} GB."
+            )
+
+    def _resolve(self, url, cookies_path, hook):
+        """Return (source, media id, format, download(output_dir)) for a URL"""
+        source = self.get_source(url)
+        fmt = get_audio_download_policy().format_selector()
+        if source == 'youtube':
+            media_id = YouTubeService.get_video_id(url)
+            if cookies_path and os.path.exists(cookies_path):
+                # Media fetched with someone's cookies is only shared with the same cookies
+                with open(cookies_path, 'rb') as f:
+                    fmt += ':' + hashlib.sha256(f.read()).hexdigest()[:16]
+            download = lambda output_dir: YouTubeService.download_video(url, cookies_path, output_dir, [hook])
+        elif source == 'gdrive':
+            media_id, fmt = GoogleDriveService.get_file_id(url), 'original'
+            if not media_id:
+                raise ValueError("Invalid Google Drive URL")
+            download = lambda output_dir: GoogleDriveService.download_file(
+                f"https://drive.google.com/file/d/{media_id}/view", output_dir, hook
+            )
+        elif source == 'linkedin':
+            media_id = LinkedInService.get_post_id(url)
+            download = lambda output_dir: LinkedInService.download_video(url, output_dir, [hook])
+        elif source == 'http':
+            media_id, fmt = DirectMediaService.get_media_id(url), 'original'
+            download = lambda output_dir: DirectMediaService.download_file(url, output_dir, hook)
+        else:
+            raise ValueError("Unsupported URL type")
+        return source, media_id, fmt, download
+
+    def _progress_hook(self, download_id, callback, cancel_token=None):
+        """Wrap a caller's hook: record progress, apply the bandwidth limit and stop cancelled downloads"""
+        last_bytes = {}
+
+        def hook(status):
+            # Raising from the hook aborts yt-dlp and the ranged downloader alike
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            downloaded = status.get('downloaded_bytes') or 0
+            name = status.get('tmpfilename') or status.get('filename')
+            delta = downloaded - last_bytes.get(name, 0)
+            last_bytes[name] = downloaded
+            with self._active_lock:
+                entry = self._active.get(download_id)
+                if entry:
+                    entry['downloaded'] = sum(last_bytes.values())
+                    entry['total'] = status.get('total_bytes') or status.get('total_bytes_estimate') or entry['total']
+            if callback:
+                callback(status)
+            # Hooks run inside the downloaders' read loops, so sleeping here throttles them
+            if self.limiter and delta > 0 and status.get('status') == 'downloading':
+                self.limiter.consume(delta)
+
+        return hook
+
+    def download(self, url, dest_dir, cookies_path=None, progress_hook=None, cancel_token=None):
+        """Download a supported media URL into ``dest_dir`` (normally from ``new_job_dir``) and return the path.
+
+        Cancelling ``cancel_token`` raises JobCancelled at the next progress
+        report, which frees the download's slots and bandwidth share.
+        """
+        download_id = uuid.uuid4().hex
+        hook = self._progress_hook(download_id, progress_hook, cancel_token)
+        source, media_id, fmt, download = self._resolve(url, cookies_path, hook)
+
+        def limited(output_dir):
+            # Only real downloads wait for a slot, cache hits never get here
+            with self._source_slots[source], self._global_slots:
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                with self._active_lock:
+                    self._active[download_id] = {
+                        'url': url,
+                        'source': source,
+                        'downloaded': 0,
+                        'total': None,
+                        'started': time.time(),
+                    }
+                try:
+                    return download(output_dir)
+                finally:
+                    with self._active_lock:
+                        self._active.pop(download_id, None)
+
+        if not media_id:
+            # No stable id to key on, download straight into the job directory
+            return limited(dest_dir)
+
+        return self.cache.fetch(source, media_id, fmt, limited, dest_dir)
+
+    def active_downloads(self):
+        """Snapshot of running downloads: url, source, downloaded/total bytes and speed"""
+        now = time.time()
+        with self._active_lock:
+            snapshot = [dict(entry) for entry in self._active.values()]
+        for entry in snapshot:
+            entry['speed'] = entry['downloaded'] / max(now - entry['started'], 0.001)
+        return snapshot
+
+
+# Singleton instance
+_download_manager = None
+
+def get_download_manager():
+    """Get singleton instance of DownloadManager"""
+    global _download_manager
+    if _download_manager is None:
+        _download_manager = DownloadManager()
+    return _download_manager
@@ -0,0 +1,100 @@
+import os
+
+# Containers the transcription API accepts directly, in order of preference.
+# Files in these containers are kept in their native codec; anything else is
+# decoded by the transcriber when it splits the audio into chunks.
+API_AUDIO_EXTENSIONS = ['m4a', 'webm', 'mp3', 'mp4', 'mpeg', 'mpga', 'wav']
+
+# Speech stays intelligible well below music bitrates; 48 kbps AAC/Opus is plenty
+MIN_AUDIO_BITRATE_KBPS = 48
+
+
+class AudioDownloadPolicy:
+    """Format selection shared by every yt-dlp based source.
+
+    Picks the smallest audio-only format that still meets a bitrate floor,
+    preferring containers the transcription API accepts so no re-encoding
+    post-processor is needed. Sources that only publish muxed video fall back
+    to the smallest format that carries audio.
+    """
+
+    def __init__(self, min_abr=MIN_AUDIO_BITRATE_KBPS, accepted_extensions=None):
+        self.min_abr = min_abr
+        self.accepted_extensions = accepted_extensions or API_AUDIO_EXTENSIONS
+
+    def format_selector(self):
+        """Build the yt-dlp format selector string"""
+        # '>=?' also lets through formats that don't report a bitrate
+        quality_floor = f'[abr>=?{self.min_abr}]'
+        selectors = [f'worstaudio{quality_floor}[ext={ext}]' for ext in self.accepted_extensions]
+        selectors += [
+            f'worstaudio{quality_floor}',  # audio-only in a container we'll have to decode
+            'bestaudio',                   # nothing meets the floor, take the best we can get
+            'worst[acodec!=none]',         # muxed-only sources: smallest file that has audio
+            'worst',
+        ]
+        return '/'.join(selectors)
+
+    def ydl_options(self, output_template, **overrides):
+        """yt-dlp options for an audio-only download without transcoding"""
+        options = {
+            'format': self.format_selector(),
+            'outtmpl': output_template,
+            'quiet': False,
+            'no_warnings': False,
+            'progress': True,
+        }
+        options.update(overrides)
+        return options
+
+    def probe(self, url, **overrides):
+        """Look up a URL's metadata without downloading it.
+
+        Returns a dict with 'title', 'duration', 'size' (of the format this
+        policy would download, None if the site doesn't say), 'format_id',
+        'ext' and 'is_live'.
+        """
+        import yt_dlp
+
+        options = {
+            'format': self.format_selector(),
+            'skip_download': True,
+            'quiet': True,
+            'no_warnings': True,
+        }
+        options.update(overrides)
+        with yt_dlp.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=False)
+
+        selected = info.get('requested_formats') or [info]
+        sizes = [f.get('filesize') or f.get('filesize_approx') for f in selected]
+        return {
+            'title': info.get('title'),
+            'duration': info.get('duration'),
+            'size': sum(sizes) if all(sizes) else None,
+            'format_id': info.get('format_id'),
+            'ext': info.get('ext'),
+            'is_live': bool(info.get('is_live')),
+        }
+
+    @staticmethod
+    def downloaded_path(ydl, info):
+        """Return the path of the file yt-dlp produced for ``info``"""
+        for download in info.get('requested_downloads') or []:
+            if download.get('filepath') and os.path.exists(download['filepath']):
+                return download['filepath']
+        path = ydl.prepare_filename(info)
+        if os.path.exists(path):
+            return path
+        raise Exception("No file downloaded")
+
+
+# Shared default policy
+_audio_download_policy = None
+
+def get_audio_download_policy():
+    """Get the shared AudioDownloadPolicy instance"""
+    global _audio_download_policy
+    if _audio_download_policy is None:
+        _audio_download_policy = AudioDownloadPolicy()
+    return _audio_download_policy
@@ -31,30 +31,53 @@ class GoogleDriveService:
             return None
 
     @staticmethod
-    def download_file(url):
+    def _direct_url(file_id):
+        # confirm=t skips the "can't scan this file for viruses" page of large files
+        return f"https://drive.usercontent.google.com/download?id={file_id}&export=download&confirm=t"
+
+    @staticmethod
+    def probe(url):
+        """Name, size and duration of a shared Drive file, reading only its headers.
+
+        Files Drive won't serve directly (quota or permission pages) return what
+        little is known, so the download itself can still try gdown.
+        """
+        from http_downloader import get_ranged_downloader
+        from media_stream import probe_duration
+        
+        file_id = GoogleDriveService.get_file_id(url)
+        if not file_id:
+            raise ValueError("Invalid Google Drive URL")
+        
+        info = {'title': None, 'duration': None, 'size': None, 'is_live': False}
+        try:
+            probe = get_ranged_downloader().probe(GoogleDriveService._direct_url(file_id))
+        except Exception as e:
+            print(f"Could not probe Google Drive file: {e}")
+            return info
+        if not probe['content_type'].startswith('text/html'):
+            info.update(title=probe['filename'], size=probe['size'], duration=probe_duration(probe['url']))
+        return info
+
+    @staticmethod
+    def download_file(url, output_dir=None, progress_hook=None):
         """Download a video file from Google Drive public link"""
         print("Downloading from Google Drive...")
         
         try:
-            import gdown
-            
             # Get file ID from URL
             file_id = GoogleDriveService.get_file_id(url)
             if not file_id:
                 raise ValueError("Invalid Google Drive URL")
             
-            # Create temporary file with .mp4 extension
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
-            output = temp_file.name
-            temp_file.close()
-            
-            # Construct the download URL
-            download_url = f"https://drive.google.com/uc?id={file_id}"
+            # Download into a directory of our own inside temp_resources, where cleanup can find it
+            output_dir = output_dir or tempfile.mkdtemp(dir='temp_resources')
+            output = os.path.join(output_dir, f"{file_id}.mp4")
             
             print(f"Downloading file to: {output}")
             
-            # Download the file with progress bar
-            gdown.download(download_url, output, quiet=False)
+            output = GoogleDriveService._download_ranged(file_id, output, progress_hook) or \
+                GoogleDriveService._download_gdown(file_id, output)
             
             # Verify the download
             if os.path.getsize(output) == 0:
@@ -71,3 +94,39 @@ class GoogleDriveService:
                 "2. The link is in format: drive.google.com/file/d/FILE_ID/view\n"
                 "3. The file is a video file (mp4 or webm)"
             )
+
+    @staticmethod
+    def _download_ranged(file_id, output, progress_hook=None):
+        """Fetch the file directly with parallel range requests; returns None when Drive won't serve it that way"""
+        from http_downloader import get_ranged_downloader
+        
+        download_url = GoogleDriveService._direct_url(file_id)
+        downloader = get_ranged_downloader()
+        try:
+            probe = downloader.probe(download_url)
+        except Exception as e:
+            print(f"Direct Drive download unavailable ({e}), falling back to gdown")
+            return None
+        
+        if probe['content_type'].startswith('text/html'):
+            # Quota, permission or confirmation page instead of the file
+            print("Drive returned a web page instead of the file, falling back to gdown")
+            return None
+        
+        # Keep the real extension when Drive tells us the file name
+        _, ext = os.path.splitext(probe['filename'] or '')
+        if ext:
+            output = os.path.splitext(output)[0] + ext.lower()
+        return downloader.download(download_url, output, progress_hook, probe)
+
+    @staticmethod
+    def _download_gdown(file_id, output):
+        """Single-stream download through gdown, which handles Drive's interstitial pages"""
+        import gdown
+        
+        # Construct the download URL
+        download_url = f"https://drive.google.com/uc?id={file_id}"
+        
+        # Download the file with progress bar
+        gdown.download(download_url, output, quiet=False)
+        return output
@@ -0,0 +1,309 @@
+import os
+import re
+import json
+import time
+import socket
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from urllib.parse import urlparse, urljoin, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Byte ranges fetched per request, and how many requests run at once
+RANGE_PART_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CONNECTIONS = int(os.getenv('HTTP_DOWNLOAD_CONNECTIONS', '8'))
+
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 1.0
+READ_BLOCK_SIZE = 1024 * 1024
+REQUEST_TIMEOUT = (10, 60)  # connect, read
+MAX_REDIRECTS = 10
+
+USER_AGENT = 'Mozilla/5.0 (compatible; transcribe-video)'
+
+
+def ensure_public_url(url):
+    """Raise ValueError unless ``url`` is http(s) and its host resolves only to publicly routable addresses.
+
+    Links come from users, so without this they could make the server fetch
+    loopback, private-network or link-local services (cloud metadata, other
+    containers such as the Bot API server).
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError("Only http(s) links can be downloaded")
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise ValueError(f"Could not resolve {parsed.hostname}: {e}")
+    for address in addresses:
+        # Scoped IPv6 addresses carry a %interface suffix
+        if not ipaddress.ip_address(address[4][0].split('%')[0]).is_global:
+            raise ValueError("The link points to a private or internal address")
+
+
+class RangedDownloader:
+    """Fetch a file over several pooled HTTP connections, one byte range per request.
+
+    The target is preallocated and every range is written in place, so parts can
+    finish in any order. Completed parts are recorded in a ``.part.json`` sidecar
+    next to the ``.part`` file: a failed range is retried with backoff from the
+    last byte it received, and a later call for the same output resumes where
+    the previous one stopped. Servers without range support get a single
+    streamed request.
+
+    ``progress_hook`` receives yt-dlp style status dicts; ``contiguous_bytes`` is
+    the length of the prefix that is complete, which is what readers tailing the
+    ``.part`` file may consume.
+    """
+
+    def __init__(self, connections=DOWNLOAD_CONNECTIONS, part_size=RANGE_PART_SIZE):
+        self.connections = connections
+        self.part_size = part_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = USER_AGENT
+
+    def probe(self, url):
+        """Resolve redirects and find out the size, range support and name of a download.
+
+        Returns a dict with 'url', 'size' (None if unknown), 'accepts_ranges',
+        'filename' and 'content_type'. Redirects are followed one at a time so
+        every hop is checked with ensure_public_url before it is requested; the
+        downloads then use the final 'url' without following any further ones.
+        """
+        # A one-byte range request answers every question at once and, unlike
+        # HEAD, is handled the same way as the real download by every server
+        for _ in range(MAX_REDIRECTS + 1):
+            ensure_public_url(url)
+            response = self.session.get(url, headers={'Range': 'bytes=0-0'}, stream=True,
+                                        allow_redirects=False, timeout=REQUEST_TIMEOUT)
+            if not response.is_redirect:
+                break
+            url = urljoin(url, response.headers['Location'])
+            response.close()
+        else:
+            raise ValueError(f"More than {MAX_REDIRECTS} redirects")
+        try:
+            response.raise_for_status()
+            size = None
+            accepts_ranges = False
+            if response.status_code == 206:
+                match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+                if match:
+                    size = int(match.group(1))
+                    accepts_ranges = True
+            elif response.headers.get('Content-Length'):
+                size = int(response.headers['Content-Length'])
+
+            return {
+                'url': response.url,
+                'size': size,
+                'accepts_ranges': accepts_ranges,
+                'filename': self._filename_from_response(response),
+                'content_type': response.headers.get('Content-Type', '').split(';')[0].strip().lower(),
+            }
+        finally:
+            response.close()
+
+    @staticmethod
+    def _filename_from_response(response):
+        disposition = response.headers.get('Content-Disposition', '')
+        match = re.search(r"filename\*=UTF-8''([^;]+)", disposition, re.IGNORECASE)
+        if match:
+            return os.path.basename(unquote(match.group(1)))
+        match = re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE)
+        if match:
+            return os.path.basename(match.group(1))
+        return os.path.basename(unquote(urlparse(response.url).path)) or None
+
+    def download(self, url, output_path, progress_hook=None, probe=None):
+        """Download ``url`` to ``output_path`` and return the path"""
+        probe = probe or self.probe(url)
+        part_path = output_path + '.part'
+        if probe['accepts_ranges'] and probe['size']:
+            self._download_ranges(probe['url'], probe['size'], part_path, progress_hook)
+        else:
+            self._download_stream(probe['url'], part_path, progress_hook)
+
+        os.replace(part_path, output_path)
+        if progress_hook:
+            progress_hook({'status': 'finished', 'filename': output_path,
+                           'total_bytes': os.path.getsize(output_path)})
+        return output_path
+
+    def _load_state(self, state_path, size):
+        """Completed part indexes from a previous attempt at the same download"""
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('size') == size and state.get('part_size') == self.part_size:
+                return set(state.get('done', []))
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        return set()
+
+    def _save_state(self, state_path, url, size, done):
+        with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'size': size, 'part_size': self.part_size, 'done': sorted(done)}, f)
+        os.replace(state_path + '.tmp', state_path)
+
+    def _download_ranges(self, url, size, part_path, progress_hook):
+        state_path = part_path + '.json'
+        total_parts = max(1, -(-size // self.part_size))
+        done = self._load_state(state_path, size) if os.path.exists(part_path) else set()
+        if done:
+            print(f"Resuming download: {len(done)}/{total_parts} parts already present")
+
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                if hasattr(os, 'posix_fallocate'):
+                    try:
+                        os.posix_fallocate(fd, 0, size)
+                    except OSError:
+                        os.ftruncate(fd, size)
+                else:
+                    os.ftruncate(fd, size)
+
+            lock = threading.Lock()
+            start = time.time()
+            received = [min(size, len(done) * self.part_size)]
+
+            def report(new_bytes=0):
+                # Hooks may block (bandwidth limiting), so they are called outside the lock
+                with lock:
+                    received[0] += new_bytes
+                    contiguous = 0
+                    while contiguous in done:
+                        contiguous += 1
+                    status = {
+                        'status': 'downloading',
+                        'tmpfilename': part_path,
+                        'downloaded_bytes': min(size, received[0]),
+                        'contiguous_bytes': min(size, contiguous * self.part_size),
+                        'total_bytes': size,
+                    }
+                if progress_hook:
+                    progress_hook(status)
+
+            stop = threading.Event()
+
+            def fetch_part(index):
+                if stop.is_set():
+                    return
+                self._fetch_range(url, fd, index * self.part_size,
+                                  min(size, (index + 1) * self.part_size) - 1, report, stop)
+                with lock:
+                    done.add(index)
+                    self._save_state(state_path, url, size, done)
+                report()
+
+            report()
+            # Parts are queued in order so the beginning of the file completes first
+            pending = [i for i in range(total_parts) if i not in done]
+            workers = max(1, min(self.connections, len(pending)))
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = [executor.submit(fetch_part, i) for i in pending]
+                wait(futures, return_when=FIRST_EXCEPTION)
+                for future in futures:
+                    if future.done() and future.exception():
+                        raise future.exception()
+            finally:
+                # A range that gave up stops the others, rather than downloading the rest of the file for nothing
+                stop.set()
+                executor.shutdown(wait=True, cancel_futures=True)
+
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        elapsed = max(time.time() - start, 0.001)
+        print(f"Downloaded {size / (1024*1024):.1f} MB over {workers} connections "
+              f"in {elapsed:.1f}s ({size / (1024*1024) / elapsed:.1f} MB/s)")
+        os.remove(state_path)
+
+    def _fetch_range(self, url, fd, start, end, on_bytes=None, stop=None):
+        """Write bytes ``start``-``end`` at their offset, retrying from the last byte received.
+
+        Gives up as soon as ``stop`` is set, because another range failed.
+        """
+        position = start
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                headers = {'Range': f'bytes={position}-{end}'}
+                with self.session.get(url, headers=headers, stream=True, allow_redirects=False,
+                                      timeout=REQUEST_TIMEOUT) as response:
+                    if response.status_code != 206:
+                        response.raise_for_status()
+                        raise IOError(f"Server ignored range request (status {response.status_code})")
+                    for block in response.iter_content(READ_BLOCK_SIZE):
+                        if stop is not None and stop.is_set():
+                            raise IOError("Download stopped")
+                        os.pwrite(fd, block, position)
+                        position += len(block)
+                        if on_bytes:
+                            on_bytes(len(block))
+                if position > end:
+                    return
+                raise IOError(f"Connection closed at byte {position} of range {start}-{end}")
+            except (requests.RequestException, IOError) as e:
+                if attempt == MAX_RETRIES or (stop is not None and stop.is_set()):
+                    raise
+                delay = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                print(f"Range {start}-{end} failed at byte {position} ({e}), retrying in {delay:.0f}s")
+                if stop is not None:
+                    if stop.wait(delay):
+                        raise
+                else:
+                    time.sleep(delay)
+
+    def _download_stream(self, url, part_path, progress_hook):
+        """Single-connection download for servers without range support"""
+        for attempt in range(1, MAX_RETRIES + 1):
+            downloaded = 0
+            try:
+                with self.session.get(url, stream=True, allow_redirects=False, timeout=REQUEST_TIMEOUT) as response:
+                    response.raise_for_status()
+                    if response.is_redirect:
+                        raise IOError(f"Unexpected redirect (status {response.status_code})")
+                    total = int(response.headers.get('Content-Length') or 0) or None
+                    with open(part_path, 'wb') as f:
+                        for block in response.iter_content(READ_BLOCK_SIZE):
+                            f.write(block)
+                            downloaded += len(block)
+                            if progress_hook:
+                                f.flush()
+                                progress_hook({
+                                    'status': 'downloading',
+                                    'tmpfilename': part_path,
+                                    'downloaded_bytes': downloaded,
+                                    'contiguous_bytes': downloaded,
+                                    'total_bytes': total,
+                                })
+                if total and downloaded < total:
+                    raise IOError(f"Connection closed after {downloaded} of {total} bytes")
+                return
+            except (requests.RequestException, IOError) as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                print(f"Download failed after {downloaded} bytes ({e}), retrying in {delay:.0f}s")
+                time.sleep(delay)
+
+
+# Singleton instance, shares its connection pool between downloads
+_ranged_downloader = None
+
+def get_ranged_downloader():
+    """Get singleton instance of RangedDownloader"""
+    global _ranged_downloader
+    if _ranged_downloader is None:
+        _ranged_downloader = RangedDownloader()
+    return _ranged_downloader
@@ -0,0 +1,338 @@
+import os
+import json
+import math
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+from cancellation import JobCancelled
+
+# Processing time per second of audio; starts at roughly 10x realtime and is
+# learned from finished jobs whose duration was known
+INITIAL_SECONDS_PER_AUDIO_SECOND = 0.1
+RATE_SMOOTHING = 0.2
+# Fixed cost of every job (download setup, probing, API round trips)
+JOB_OVERHEAD_SECONDS = 15
+# Audio length assumed when only the file size, or nothing, is known
+ASSUMED_BYTES_PER_AUDIO_SECOND = 24000
+DEFAULT_AUDIO_SECONDS = 10 * 60
+
+# Expected seconds of work forgiven per second spent waiting. With 1.0 a job that
+# has waited as long as its own expected run time goes ahead of any new job.
+SCHEDULER_AGING_FACTOR = float(os.getenv('SCHEDULER_AGING_FACTOR', '1.0'))
+
+# How often callers waiting in a FairShareGate look for a slot freed by a raised limit
+GATE_POLL_SECONDS = 5
+# Expected seconds of work a user with weight 1 is credited per round-robin turn
+FAIR_SHARE_QUANTUM_SECONDS = JOB_OVERHEAD_SECONDS
+
+
+class UserShare:
+    """A user's relative weight and concurrency cap (0 = only the global limit)"""
+
+    def __init__(self, weight=1.0, max_parallel=0):
+        self.weight = max(float(weight), 0.01)
+        self.max_parallel = int(max_parallel)
+
+
+def load_user_shares(path='whitelist.json'):
+    """Read the optional ``user_shares`` section of the whitelist file.
+
+    Keys are Telegram user IDs, or client addresses for the web app, plus an
+    optional ``default`` entry; values are ``{"weight": 2, "max_parallel": 1}``.
+    """
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Warning: Could not read user shares from {path}: {e}")
+        return {}
+    shares = {}
+    for user, settings in (data.get('user_shares') or {}).items():
+        shares[str(user)] = UserShare(settings.get('weight', 1.0), settings.get('max_parallel', 0))
+    return shares
+
+
+class ScheduledJob:
+    """A queued or running job with what the scheduler knows about it"""
+
+    def __init__(self, job, user, audio_seconds, duration_known, seq):
+        self.job = job
+        self.user = user
+        self.audio_seconds = audio_seconds
+        self.duration_known = duration_known
+        self.seq = seq
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.expected = None
+
+
+class JobScheduler:
+    """Per-user fair-share queue, shortest expected job first within each user.
+
+    Each job's expected processing time comes from its audio duration (probed
+    before queueing, or guessed from its size) times a processing rate learned
+    from finished jobs. Users get their own sub-queues which are served by
+    deficit round-robin: every turn credits a user ``weight`` quanta of
+    expected processing time and a job starts once its user's credit covers
+    its cost, so a user who queued twenty files gets the same share of the
+    workers as one who queued a single file. Within a user's queue the job
+    with the lowest expected time minus the credit it earned by waiting goes
+    first, so short jobs overtake long ones but a long job's priority keeps
+    rising until it runs. Users may also be capped to a number of running jobs.
+    """
+
+    def __init__(self, aging_factor=SCHEDULER_AGING_FACTOR, shares=None):
+        self.aging_factor = aging_factor
+        self.seconds_per_audio_second = INITIAL_SECONDS_PER_AUDIO_SECOND
+        self.shares = shares or {}
+        self._queued = {}  # user -> [ScheduledJob]
+        self._order = []  # users with queued jobs, in round-robin order
+        self._turn = 0
+        self._deficit = {}
+        self._running = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._queued.values())
+
+    def share_for(self, user):
+        return self.shares.get(str(user)) or self.shares.get('default') or UserShare()
+
+    def expected_seconds(self, audio_seconds):
+        return JOB_OVERHEAD_SECONDS + audio_seconds * self.seconds_per_audio_second
+
+    def _score(self, entry, now):
+        return self.expected_seconds(entry.audio_seconds) - self.aging_factor * (now - entry.enqueued_at)
+
+    def push(self, job, duration=None, size=None, user=None):
+        """Queue a job for ``user``; ``duration`` (seconds of audio) or ``size`` (bytes) set its expected cost"""
+        if duration:
+            audio_seconds = duration
+        elif size:
+            audio_seconds = size / ASSUMED_BYTES_PER_AUDIO_SECOND
+        else:
+            audio_seconds = DEFAULT_AUDIO_SECONDS
+        with self._lock:
+            if user not in self._queued:
+                self._queued[user] = []
+                self._order.append(user)
+                self._deficit[user] = 0.0
+            self._queued[user].append(ScheduledJob(job, user, audio_seconds, bool(duration), next(self._seq)))
+
+    def _running_counts(self):
+        counts = {}
+        for entry in self._running.values():
+            counts[entry.user] = counts.get(entry.user, 0) + 1
+        return counts
+
+    def _pick(self, queued, order, turn, deficit, running_counts, eligible, now):
+        """One deficit round-robin decision over the given state (caller holds the lock).
+
+        Returns (entry, next turn) and charges the entry's cost to its user, or
+        (None, turn) if no user has a job that may start. Instead of crediting
+        one quantum per turn until someone can afford their next job, the
+        rounds that would take are computed and credited at once.
+        """
+        best = None
+        visited = []
+        for offset in range(len(order)):
+            index = (turn + offset) % len(order)
+            user = order[index]
+            share = self.share_for(user)
+            if share.max_parallel and running_counts.get(user, 0) >= share.max_parallel:
+                continue
+            candidates = [entry for entry in queued[user] if eligible is None or eligible(entry.job)]
+            if not candidates:
+                continue
+            entry = min(candidates, key=lambda e: (self._score(e, now), e.seq))
+            cost = self.expected_seconds(entry.audio_seconds)
+            quantum = FAIR_SHARE_QUANTUM_SECONDS * share.weight
+            rounds = max(0, math.ceil((cost - deficit[user]) / quantum))
+            visited.append((user, quantum))
+            if best is None or rounds < best[0]:
+                best = (rounds, index, entry, cost)
+                if rounds == 0:
+                    break
+        if best is None:
+            return None, turn
+
+        rounds, index, entry, cost = best
+        if rounds:
+            for user, quantum in visited:
+                deficit[user] += rounds * quantum
+        deficit[entry.user] -= cost
+        queued[entry.user].remove(entry)
+        if not queued[entry.user]:
+            # Idle users don't bank credit
+            del queued[entry.user]
+            del deficit[entry.user]
+            order.pop(index)
+            return entry, index % len(order) if order else 0
+        # The user keeps the turn while its credit lasts
+        return entry, index if deficit[entry.user] > 0 else (index + 1) % len(order)
+
+    def pop(self, eligible=None):
+        """Take the next job by fair share and expected cost that ``eligible(job)`` accepts, or None"""
+        now = time.time()
+        with self._lock:
+            entry, self._turn = self._pick(self._queued, self._order, self._turn, self._deficit,
+                                           self._running_counts(), eligible, now)
+            if entry is None:
+                return None
+            entry.started_at = now
+            entry.expected = self.expected_seconds(entry.audio_seconds)
+            self._running[id(entry.job)] = entry
+            return entry.job
+
+    def remove(self, job):
+        """Drop a queued job that will no longer run; False if it isn't queued"""
+        with self._lock:
+            for user, entries in self._queued.items():
+                for entry in entries:
+                    if entry.job is job:
+                        entries.remove(entry)
+                        if not entries:
+                            index = self._order.index(user)
+                            del self._queued[user]
+                            del self._deficit[user]
+                            self._order.pop(index)
+                            if index < self._turn:
+                                self._turn -= 1
+                            if self._turn >= len(self._order):
+                                self._turn = 0
+                        return True
+            return False
+
+    def finish(self, job, learn=True):
+        """Record that a popped job is done; ``learn`` updates the processing rate from its run time.
+
+        Pass ``learn=False`` for jobs that failed or skipped the transcription
+        (e.g. used existing captions), their run time says nothing about it.
+        """
+        with self._lock:
+            entry = self._running.pop(id(job), None)
+            if not learn or not entry or not entry.duration_known or entry.audio_seconds < 60:
+                return
+            elapsed = time.time() - entry.started_at
+            observed = max(0.0, elapsed - JOB_OVERHEAD_SECONDS) / entry.audio_seconds
+            self.seconds_per_audio_second += RATE_SMOOTHING * (observed - self.seconds_per_audio_second)
+
+    def snapshot(self, slots):
+        """Queued jobs in the order they would start, as dicts with 'job', 'position', 'expected' and 'eta'.
+
+        ``eta`` is the estimated number of seconds until the job starts, simulating
+        ``slots`` workers that are busy with the running jobs' remaining time and
+        the fair-share decisions the scheduler would make.
+        """
+        now = time.time()
+        slots = max(1, slots)
+        with self._lock:
+            queued = {user: list(entries) for user, entries in self._queued.items()}
+            order = list(self._order)
+            deficit = dict(self._deficit)
+            turn = self._turn
+            # (time the worker frees up, user whose job holds it)
+            workers = sorted(
+                (max(0.0, entry.started_at + entry.expected - now), entry.user) for entry in self._running.values()
+            )[:slots]
+            workers += [(0.0, None)] * (slots - len(workers))
+
+            result = []
+            clock = 0.0
+            while order:
+                workers.sort(key=lambda w: w[0])
+                # Jobs that ended by now no longer count against their user's cap
+                clock = max(clock, workers[0][0])
+                running_counts = {}
+                for free_at, user in workers:
+                    if free_at > clock and user is not None:
+                        running_counts[user] = running_counts.get(user, 0) + 1
+                entry, turn = self._pick(queued, order, turn, deficit, running_counts, None, now)
+                if entry is None:
+                    # Every remaining user is at its cap; wait for the next worker to free up
+                    later = [free_at for free_at, _ in workers if free_at > clock]
+                    if not later:
+                        break
+                    clock = min(later)
+                    continue
+                expected = self.expected_seconds(entry.audio_seconds)
+                worker = next(i for i, (free_at, _) in enumerate(workers) if free_at <= clock)
+                workers[worker] = (clock + expected, entry.user)
+                result.append({'job': entry.job, 'position': len(result) + 1, 'expected': expected, 'eta': clock})
+            return result
+
+
+class FairShareGate:
+    """Fair-share slots for request handlers that transcribe synchronously.
+
+    ``slot(user, ...)`` queues the caller in a JobScheduler and blocks until
+    the scheduler picks it for a slot of ``limiter`` (a
+    ``concurrency_control.AdaptiveLimiter``), so the web app shares its
+    capacity between clients the same way the bot's queue does.
+    """
+
+    def __init__(self, limiter, scheduler=None):
+        self.limiter = limiter
+        self.scheduler = scheduler or JobScheduler()
+        self._granted = set()
+        self._condition = threading.Condition()
+
+    def _dispatch(self):
+        """Hand free slots to the next tickets (caller holds the condition)"""
+        while len(self.scheduler) and self.limiter.try_acquire():
+            ticket = self.scheduler.pop()
+            if ticket is None:
+                self.limiter.release()
+                break
+            self._granted.add(ticket)
+        self._condition.notify_all()
+
+    def _wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, user, duration=None, size=None, timeout=None, cancel_token=None):
+        """Run the block in a worker slot; raises TimeoutError if none was granted within ``timeout``.
+
+        Raises JobCancelled, leaving the queue at once, if ``cancel_token`` is cancelled while waiting.
+        """
+        ticket = object()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        unregister = cancel_token.on_cancel(self._wake) if cancel_token else None
+        try:
+            with self._condition:
+                self.scheduler.push(ticket, duration, size, user=user)
+                self._dispatch()
+                while ticket not in self._granted:
+                    if cancel_token and cancel_token.is_cancelled and self.scheduler.remove(ticket):
+                        raise JobCancelled()
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        if self.scheduler.remove(ticket):
+                            raise TimeoutError("The server is busy with other transcriptions. Please try again in a few minutes.")
+                        break  # Granted while timing out
+                    self._condition.wait(min(remaining, GATE_POLL_SECONDS) if remaining is not None else GATE_POLL_SECONDS)
+                    # The limiter may have raised its limit
+                    self._dispatch()
+                self._granted.discard(ticket)
+        finally:
+            if unregister:
+                unregister()
+        learn = False
+        try:
+            yield
+            learn = True
+        finally:
+            self.scheduler.finish(ticket, learn=learn)
+            self.limiter.release()
+            if learn and duration:
+                self.limiter.record_success(duration)
+            with self._condition:
+                self._dispatch()
@@ -1,8 +1,11 @@
 import os
+import re
 import tempfile
 from urllib.parse import urlparse
 import yt_dlp
 
+from download_policy import get_audio_download_policy
+
 
 class LinkedInService:
     @staticmethod
@@ -15,32 +18,41 @@ class LinkedInService:
         return 'linkedin.com' in parsed.netloc and any(path in parsed.path for path in valid_paths)
 
     @staticmethod
-    def download_video(url):
+    def get_post_id(url):
+        """Extract the numeric activity/post ID from a LinkedIn URL"""
+        for pattern in (r'activity[-:](\d+)', r'urn:li:ugcPost:(\d+)', r'ugcPost-(\d+)'):
+            match = re.search(pattern, url)
+            if match:
+                return match.group(1)
+        return None
+
+    @staticmethod
+    def probe(url):
+        """Metadata of the video download_video would fetch, without downloading it"""
+        try:
+            return get_audio_download_policy().probe(url)
+        except Exception as e:
+            raise ValueError(f"Failed to look up LinkedIn video: {str(e)}")
+
+    @staticmethod
+    def download_video(url, output_dir=None, progress_hooks=None):
         """Download LinkedIn video using yt-dlp and return path to downloaded file"""
         print("Downloading LinkedIn video...")
         
-        # Use temp_resources directory directly
-        output_template = os.path.join('temp_resources', '%(title)s.%(ext)s')
+        # Download into a directory of our own so concurrent jobs never see each other's files
+        temp_dir = output_dir or tempfile.mkdtemp(dir='temp_resources')
+        output_template = os.path.join(temp_dir, '%(title)s.%(ext)s')
         
         try:
-            # Download video using yt-dlp
-            ydl_opts = {
-                'format': 'mp4',
-                'outtmpl': output_template,
-                'quiet': True,
-                'no_warnings': True,
-                'progress': True
-            }
+            # Prefer an audio-only stream; LinkedIn often only has muxed mp4, then take the smallest one
+            policy = get_audio_download_policy()
+            ydl_opts = policy.ydl_options(output_template, quiet=True, no_warnings=True)
+            if progress_hooks:
+                ydl_opts['progress_hooks'] = progress_hooks
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            
-            # Find the downloaded file
-            files = [f for f in os.listdir('temp_resources') if f.endswith('.mp4')]
-            if not files:
-                raise Exception("No file downloaded")
-            
-            return os.path.join('temp_resources', files[-1])
+                info = ydl.extract_info(url, download=True)
+                return policy.downloaded_path(ydl, info)
         except Exception as e:
             print(f"Error downloading video: {e}")
             raise ValueError(f"Failed to download LinkedIn video: {str(e)}")
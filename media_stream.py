@@ -0,0 +1,242 @@
+import json
+import time
+import threading
+import subprocess
+
+# Raw PCM the streaming decoder produces: 16 kHz mono signed 16-bit, what Whisper uses internally
+PCM_SAMPLE_RATE = 16000
+PCM_SAMPLE_WIDTH = 2
+PCM_CHANNELS = 1
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH * PCM_CHANNELS
+
+FEED_BLOCK_SIZE = 1024 * 1024
+POLL_INTERVAL = 0.2
+
+
+def probe_duration(source, timeout=30):
+    """Read the duration in seconds from a file's or URL's container header with ffprobe, or None"""
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', source],
+            capture_output=True, text=True, timeout=timeout
+        )
+        return float(result.stdout.strip())
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+def probe_audio_format(source, timeout=30):
+    """Duration, sample rate and channel count of a file's first audio stream from ffprobe.
+
+    Returns a dict with 'duration', 'sample_rate' and 'channels'; values
+    ffprobe can't determine are None.
+    """
+    info = {'duration': None, 'sample_rate': None, 'channels': None}
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+             '-show_entries', 'format=duration:stream=sample_rate,channels', '-of', 'json', source],
+            capture_output=True, text=True, timeout=timeout
+        )
+        data = json.loads(result.stdout or '{}')
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return info
+    streams = data.get('streams') or [{}]
+    for key, value in (('duration', (data.get('format') or {}).get('duration')),
+                       ('sample_rate', streams[0].get('sample_rate')),
+                       ('channels', streams[0].get('channels'))):
+        try:
+            info[key] = float(value) if key == 'duration' else int(value)
+        except (TypeError, ValueError):
+            pass
+    return info
+
+
+class GrowingFile:
+    """A media file that is still being written by a downloader.
+
+    The downloader runs in a background thread via ``start(download)``.
+    ``progress_hook`` is a yt-dlp style hook: as soon as it reports the file the
+    download is being written to, readers can start tailing it. Downloaders that
+    write out of order (ranged downloads into a preallocated file) also report
+    ``contiguous_bytes``, and readers stay within that prefix. Downloaders that
+    don't report progress only expose the file once they have finished.
+    """
+
+    def __init__(self):
+        self.partial_path = None
+        self.final_path = None
+        self.error = None
+        self.duration = None
+        self.readable_bytes = None  # None: everything written so far is readable
+        self.finished = threading.Event()
+        self._path_known = threading.Event()
+
+    def progress_hook(self, status):
+        if status.get('status') != 'downloading':
+            return
+        if 'contiguous_bytes' in status:
+            self.readable_bytes = status['contiguous_bytes']
+        if not self.partial_path:
+            self.partial_path = status.get('tmpfilename') or status.get('filename')
+            info = status.get('info_dict') or {}
+            self.duration = info.get('duration') or self.duration
+            self._path_known.set()
+
+    def start(self, download):
+        """Run ``download()`` (returning the final file path) in a background thread"""
+        def run():
+            try:
+                self.final_path = download()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.finished.set()
+                self._path_known.set()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def wait(self):
+        """Wait for the download to finish; returns the final path or raises its error"""
+        self.finished.wait()
+        if self.error:
+            raise self.error
+        return self.final_path
+
+    def open(self):
+        """Open the file for reading as early as possible, or None if the download failed"""
+        while True:
+            self._path_known.wait()
+            if self.partial_path and not self.finished.is_set():
+                try:
+                    # The open handle keeps working when the downloader renames the file
+                    return open(self.partial_path, 'rb')
+                except FileNotFoundError:
+                    time.sleep(POLL_INTERVAL)
+                    continue
+            self.finished.wait()
+            if self.error or not self.final_path:
+                return None
+            return open(self.final_path, 'rb')
+
+
+class PcmStream:
+    """Decode a (possibly still growing) media file to raw PCM with ffmpeg.
+
+    Bytes are fed to ffmpeg over a pipe as they land on disk, so audio can be
+    consumed while the download is in progress. Containers that can't be decoded
+    from a pipe (e.g. MP4 with the index at the end) make the streaming decoder
+    fail; the stream then waits for the download and decodes the complete file,
+    skipping the samples it already returned.
+    """
+
+    def __init__(self, source: GrowingFile):
+        self.source = source
+        self.position = 0  # PCM bytes returned so far
+        self._from_file = False
+        self._closed = False
+        self._process = self._spawn('pipe:0', stdin=subprocess.PIPE)
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+
+    @property
+    def expected_duration(self):
+        """Duration reported by the downloader, if it has reported one yet"""
+        return self.source.duration
+
+    @staticmethod
+    def _spawn(input_path, stdin=subprocess.DEVNULL):
+        return subprocess.Popen(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+             '-i', input_path, '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+             '-ac', str(PCM_CHANNELS), '-ar', str(PCM_SAMPLE_RATE), 'pipe:1'],
+            stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+
+    def _feed(self):
+        """Tail the growing file into ffmpeg's stdin until the download is done"""
+        stdin = self._process.stdin
+        try:
+            f = self.source.open()
+            if f is None:
+                return
+            with f:
+                offset = 0
+                while True:
+                    limit = self.source.readable_bytes
+                    if limit is None or self.source.finished.is_set():
+                        data = f.read(FEED_BLOCK_SIZE)
+                    else:
+                        data = f.read(min(FEED_BLOCK_SIZE, limit - offset)) if limit > offset else b''
+                    offset += len(data)
+                    if data:
+                        stdin.write(data)
+                    elif self.source.finished.is_set():
+                        # Drain whatever was written between the last read and the finish
+                        data = f.read()
+                        if not data:
+                            break
+                        stdin.write(data)
+                    else:
+                        time.sleep(POLL_INTERVAL)
+        except (BrokenPipeError, ValueError, OSError):
+            pass  # decoder gave up; read() falls back to the complete file
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def _read_exact(self, size):
+        buffer = bytearray()
+        while len(buffer) < size:
+            data = self._process.stdout.read(size - len(buffer))
+            if not data:
+                break
+            buffer.extend(data)
+        return bytes(buffer)
+
+    def _fall_back_to_file(self):
+        """Restart decoding from the finished download, resuming at the current position"""
+        print(f"Streaming decode failed after {self.position / PCM_BYTES_PER_SECOND:.1f}s, decoding the downloaded file")
+        path = self.source.wait()
+        self._from_file = True
+        self._process = self._spawn(path)
+        skipped = 0
+        while skipped < self.position:
+            data = self._process.stdout.read(min(FEED_BLOCK_SIZE, self.position - skipped))
+            if not data:
+                break
+            skipped += len(data)
+
+    def read(self, size):
+        """Read up to ``size`` bytes of PCM; a short read means the audio has ended"""
+        data = self._read_exact(size)
+        if len(data) < size:
+            return_code = self._process.wait()
+            self._feeder.join()
+            if self.source.error:
+                raise self.source.error
+            if return_code != 0:
+                if self._closed:
+                    raise ValueError("The audio stream was closed")
+                if self._from_file:
+                    raise ValueError(f"Could not decode audio (ffmpeg exited with {return_code})")
+                # Keep what the streaming decoder produced and continue from the file
+                self.position += len(data)
+                self._fall_back_to_file()
+                return data + self.read(size - len(data))
+        self.position += len(data)
+        return data
+
+    def close(self):
+        """Stop decoding; may be called from another thread to interrupt a read"""
+        self._closed = True
+        if self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        if self._process.stdout:
+            self._process.stdout.close()
@@ -0,0 +1,85 @@
+import os
+import re
+from collections import Counter, namedtuple
+
+# Phrases are compared as word n-grams through a rolling hash
+NGRAM_WORDS = 4
+# Repetition density is measured over this many consecutive n-grams (roughly half a minute of speech)
+WINDOW_NGRAMS = 60
+# Share of the n-grams in a window that repeat another one in it, above which the window is a loop;
+# ordinary speech stays well below 0.2
+REPETITION_DENSITY = float(os.getenv('REPETITION_DENSITY', '0.5'))
+
+_HASH_BASE = 1_000_003
+_HASH_MODULUS = (1 << 61) - 1
+
+RepetitionLoop = namedtuple('RepetitionLoop', ['start_char', 'end_char', 'density', 'phrase'])
+
+
+def _normalize(word):
+    return re.sub(r'[^\w]', '', word.lower())
+
+
+def _ngram_hashes(tokens, n):
+    """Rolling polynomial hash of every ``n`` consecutive tokens"""
+    if len(tokens) < n:
+        return []
+    token_hashes = [hash(token) % _HASH_MODULUS for token in tokens]
+    top = pow(_HASH_BASE, n - 1, _HASH_MODULUS)
+    current = 0
+    for token_hash in token_hashes[:n]:
+        current = (current * _HASH_BASE + token_hash) % _HASH_MODULUS
+    hashes = [current]
+    for i in range(n, len(token_hashes)):
+        current = (current - token_hashes[i - n] * top) % _HASH_MODULUS
+        current = (current * _HASH_BASE + token_hashes[i]) % _HASH_MODULUS
+        hashes.append(current)
+    return hashes
+
+
+def find_repetition_loops(text, n=NGRAM_WORDS, window=WINDOW_NGRAMS, threshold=REPETITION_DENSITY):
+    """Spans of ``text`` where the model got stuck repeating itself, as RepetitionLoop tuples in text order.
+
+    Slides a window of ``window`` word n-grams over the text, keeping counts of
+    their hashes; a window where more than ``threshold`` of the n-grams repeat
+    one seen elsewhere in it is flagged. Overlapping flagged windows are merged
+    into one loop. ``phrase`` is the most repeated n-gram of the loop. Linear
+    in the length of the text, so it can run on every chunk.
+    """
+    words = list(re.finditer(r'\S+', text))
+    hashes = _ngram_hashes([_normalize(word.group()) for word in words], n)
+    if len(hashes) < window:
+        return []
+
+    counts = Counter(hashes[:window])
+    spans = []  # [first n-gram, last n-gram, highest density]
+    for start in range(len(hashes) - window + 1):
+        if start:
+            leaving = hashes[start - 1]
+            counts[leaving] -= 1
+            if not counts[leaving]:
+                del counts[leaving]
+            counts[hashes[start + window - 1]] += 1
+        density = 1 - len(counts) / window
+        if density < threshold:
+            continue
+        end = start + window - 1
+        if spans and start <= spans[-1][1] + 1:
+            spans[-1][1] = end
+            spans[-1][2] = max(spans[-1][2], density)
+        else:
+            spans.append([start, end, density])
+
+    loops = []
+    for first, last, density in spans:
+        # Flagged windows reach into the text around the loop; keep only the repeated part
+        span_counts = Counter(hashes[first:last + 1])
+        while span_counts[hashes[first]] == 1:
+            first += 1
+        while span_counts[hashes[last]] == 1:
+            last -= 1
+        most_common = span_counts.most_common(1)[0][0]
+        at = hashes.index(most_common, first)
+        phrase = ' '.join(word.group() for word in words[at:at + n])
+        loops.append(RepetitionLoop(words[first].start(), words[last + n - 1].end(), density, phrase))
+    return loops
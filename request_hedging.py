@@ -0,0 +1,139 @@
+import os
+import threading
+from collections import deque
+
+# Hedging sends a duplicate of a chunk request that is slower than usual; it costs API spend, so it's opt-in
+HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', 'false').lower() in ('1', 'true', 'yes')
+# A request is a straggler once it has taken longer than this percentile of recent requests
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+# Duplicates may add at most this share of the audio sent, and bank at most this many seconds of audio
+HEDGE_BUDGET_FRACTION = float(os.getenv('HEDGE_BUDGET_FRACTION', '0.05'))
+HEDGE_BUDGET_BURST_SECONDS = 20 * 60
+# Never hedge earlier than this, however fast recent requests were
+MIN_HEDGE_DELAY_SECONDS = 10
+
+LATENCY_HISTORY = 200
+MIN_LATENCY_SAMPLES = 20
+# Latency model assumed until enough requests were seen: fixed cost plus time per second of audio
+DEFAULT_REQUEST_OVERHEAD_SECONDS = 5.0
+DEFAULT_SECONDS_PER_AUDIO_SECOND = 0.1
+
+
+class LatencyTracker:
+    """Recent transcription request latencies and how they scale with the length of the audio sent"""
+
+    def __init__(self, history=LATENCY_HISTORY):
+        self._samples = deque(maxlen=history)  # (audio_seconds, latency)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+    def record(self, audio_seconds, latency):
+        if audio_seconds <= 0:
+            return
+        with self._lock:
+            self._samples.append((audio_seconds, latency))
+
+    def percentile(self, percentile, audio_seconds):
+        """Latency a request for ``audio_seconds`` of audio stays under with this percentile, or None"""
+        with self._lock:
+            if len(self._samples) < MIN_LATENCY_SAMPLES:
+                return None
+            ratios = sorted(latency / seconds for seconds, latency in self._samples)
+        index = min(len(ratios) - 1, int(len(ratios) * percentile / 100))
+        return ratios[index] * audio_seconds
+
+    def model(self):
+        """(overhead, seconds per audio second) of a linear fit latency = overhead + rate * audio_seconds.
+
+        Falls back to the defaults until MIN_LATENCY_SAMPLES requests were seen,
+        and to the default overhead when all requests had about the same length.
+        """
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return DEFAULT_REQUEST_OVERHEAD_SECONDS, DEFAULT_SECONDS_PER_AUDIO_SECOND
+        n = len(samples)
+        mean_x = sum(x for x, _ in samples) / n
+        mean_y = sum(y for _, y in samples) / n
+        variance = sum((x - mean_x) ** 2 for x, _ in samples)
+        if variance < (0.1 * mean_x) ** 2 * n:
+            overhead = min(DEFAULT_REQUEST_OVERHEAD_SECONDS, mean_y)
+            return overhead, max(0.0, (mean_y - overhead) / mean_x)
+        rate = sum((x - mean_x) * (y - mean_y) for x, y in samples) / variance
+        rate = max(rate, 0.0)
+        return max(0.0, mean_y - rate * mean_x), rate
+
+    def snapshot(self):
+        with self._lock:
+            samples = list(self._samples)
+        overhead, rate = self.model()
+        return {
+            'samples': len(samples),
+            'model_overhead_seconds': round(overhead, 2),
+            'model_seconds_per_audio_second': round(rate, 4),
+        }
+
+
+class HedgeBudget:
+    """Token bucket for duplicate requests, filled by a fraction of the audio sent normally"""
+
+    def __init__(self, fraction=HEDGE_BUDGET_FRACTION, burst_seconds=HEDGE_BUDGET_BURST_SECONDS):
+        self.fraction = fraction
+        self.burst_seconds = burst_seconds
+        self.credit = 0.0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedged_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self, audio_seconds):
+        """Credit a request sent normally"""
+        with self._lock:
+            self.credit = min(self.burst_seconds, self.credit + audio_seconds * self.fraction)
+
+    def try_spend(self, audio_seconds):
+        """Take the credit for a duplicate of ``audio_seconds``; False if the budget doesn't cover it"""
+        with self._lock:
+            if self.credit < audio_seconds:
+                return False
+            self.credit -= audio_seconds
+            self.hedges += 1
+            self.hedged_seconds += audio_seconds
+            return True
+
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enabled': HEDGE_REQUESTS,
+                'percentile': HEDGE_PERCENTILE,
+                'credit_seconds': round(self.credit, 1),
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'hedged_seconds': round(self.hedged_seconds, 1),
+            }
+
+
+# Singleton instances, shared by every job of the process
+_latency_tracker = None
+_hedge_budget = None
+
+def get_latency_tracker():
+    """Get singleton LatencyTracker for transcription requests"""
+    global _latency_tracker
+    if _latency_tracker is None:
+        _latency_tracker = LatencyTracker()
+    return _latency_tracker
+
+def get_hedge_budget():
+    """Get singleton HedgeBudget for duplicate transcription requests"""
+    global _hedge_budget
+    if _hedge_budget is None:
+        _hedge_budget = HedgeBudget()
+    return _hedge_budget
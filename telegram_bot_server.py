@@ -3,11 +3,15 @@ import tempfile
 import logging
 import asyncio
 import json
-from typing import Dict, Set, Optional
-from dataclasses import dataclass
+import re
+import uuid
+import zipfile
+from typing import Dict, List, Set, Optional
+from dataclasses import dataclass, field
 import time
-from queue import Queue
 import threading
+from contextlib import contextmanager
+import httpx
 from dotenv import load_dotenv
 
 from telegram import Update
@@ -15,10 +19,20 @@ from telegram.ext import Application, CommandHandler, MessageHandler, ContextTyp
 
 # Import our services and transcription functions
 from transcriber import get_media_processor
-from youtube_service import YouTubeService
+from youtube_service import YouTubeService, TRANSCRIPT_SOURCE_AUTO, TRANSCRIPT_SOURCE_CAPTIONS, TRANSCRIPT_SOURCE_AUDIO
 from google_drive_service import GoogleDriveService
 from linkedin_service import LinkedInService
+from direct_media_service import DirectMediaService
 from summarization_service import SummarizationService
+from download_manager import get_download_manager
+from download_cache import link_or_copy
+from media_stream import GrowingFile, PcmStream
+from context_store import ContextStore
+from admission_control import get_admission_controller, AdmissionController
+from job_scheduler import JobScheduler, load_user_shares
+from concurrency_control import AdaptiveLimiter, get_api_limiter
+from cancellation import CancellationToken, JobCancelled
+from temp_storage import get_temp_storage, ArtifactClass, system_temp_class, MEDIA_MAX_AGE, COOKIES_MAX_AGE
 
 load_dotenv()
 
@@ -31,7 +45,11 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 CONFIG = {
-    'max_parallel_tasks': 3,
+    # Tasks run at once: starts here and adapts to throughput, API errors and host load within the bounds
+    'max_parallel_tasks': int(os.getenv('MAX_PARALLEL_TASKS', '3')),
+    'max_parallel_tasks_limit': int(os.getenv('MAX_PARALLEL_TASKS_LIMIT', str(max(3, 2 * (os.cpu_count() or 1))))),
+    'max_parallel_batch_items': 2,  # Videos of one playlist transcribed at the same time
+    'max_parallel_downloads': int(os.getenv('MAX_TELEGRAM_DOWNLOADS', '2')),  # Uploads fetched from Telegram at once
     'telegram_token': os.getenv('TELEGRAM_BOT_TOKEN'),
     'telegram_api_url': os.getenv('TELEGRAM_BOT_API_URL'),
     'telegram_api_data_dir': os.getenv('TELEGRAM_API_DATA_DIR', '/var/lib/telegram-bot-api'),
@@ -39,6 +57,10 @@ CONFIG = {
     'whitelist_file': 'whitelist.json',
     'temp_dir': 'temp_files',
     'cookies_dir': 'temp_files/.cookies',
+    # Last transcription and summary per user: kept on disk, a bounded share in memory
+    'context_dir': 'temp_files/.context',
+    'context_ttl_hours': float(os.getenv('CONTEXT_TTL_HOURS', '72')),
+    'context_memory_mb': float(os.getenv('CONTEXT_MEMORY_MB', '64')),
     'supported_formats': {'.mp3', '.mp4', '.mpeg', '.mpga', '.m4a', '.wav', '.webm', '.mkv', '.avi', '.mov'}
 }
 
@@ -50,21 +72,82 @@ ALL_USERS = -1
 @dataclass
 class TranscriptionTask:
     chat_id: int
-    file_path: str
+    file_path: Optional[str]
+    # Who submitted the task, for the per-user fair share
+    user_id: Optional[int] = None
     is_url: bool = False
     prompt: Optional[str] = None
     task_id: Optional[str] = None
     cookies_path: Optional[str] = None
+    transcript_source: str = TRANSCRIPT_SOURCE_AUTO
+    # Known before downloading for URL tasks (from the metadata probe)
+    title: Optional[str] = None
+    duration: Optional[float] = None
+    size: Optional[int] = None
+    # Set for the items of a playlist or channel batch
+    batch_id: Optional[str] = None
+    batch_index: int = 0
+    # Telegram uploads are queued by reference; the worker fetches them into file_path
+    file_id: Optional[str] = None
+    file_name: Optional[str] = None
+    # False for uploads read in place from the Bot API server's volume, which must not be deleted
+    owns_file: bool = True
+
+    # Set once the audio has been transcribed, so the scheduler can learn from the run time
+    transcribed_audio: bool = False
+    # What repairing failed chunks and repetition loops cost, for the completion message
+    repairs: Optional[str] = None
+    # /cancel <task_id> stops the task whether it is queued or running
+    cancel_token: CancellationToken = field(default_factory=CancellationToken)
+
+    @property
+    def display_name(self) -> str:
+        return self.title or self.file_name or self.file_path or "file"
+
+    @property
+    def owner(self) -> int:
+        return self.user_id or self.chat_id
+
+@dataclass
+class TranscriptionBatch:
+    """A playlist or channel expanded into one task per video"""
+    batch_id: str
+    chat_id: int
+    title: str
+    total: int
+    max_parallel: int
+    results: List[dict] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def add_result(self, task: TranscriptionTask, transcription: Optional[str], error: Optional[str]) -> int:
+        """Record an item's outcome; returns how many items are finished"""
+        with self.lock:
+            self.results.append({
+                'index': task.batch_index,
+                'title': task.title or task.file_path,
+                'url': task.file_path,
+                'transcription': transcription,
+                'error': error,
+            })
+            return len(self.results)
 
 class TranscriptionQueue:
     def __init__(self, bot_instance):
-        self.queue = Queue()
+        # Queued tasks, shared fairly between users and shortest expected job first within each
+        self.scheduler = JobScheduler(shares=load_user_shares(CONFIG['whitelist_file']))
+        self.batches: Dict[str, TranscriptionBatch] = {}
+        self._batch_active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._download_slots = threading.BoundedSemaphore(CONFIG['max_parallel_downloads'])
+        self.downloading = 0
         self.active_tasks = {}
-        self.max_tasks = CONFIG['max_parallel_tasks']
+        self.job_limiter = AdaptiveLimiter('Tasks', CONFIG['max_parallel_tasks'],
+                                           maximum=CONFIG['max_parallel_tasks_limit'])
         self.bot = bot_instance
         self.processing_thread = None
         self._stop_flag = threading.Event()
         self.media_processor = get_media_processor()
+        self.admission = get_admission_controller()
 
     def start(self):
         """Start the processing thread"""
@@ -78,101 +161,141 @@ class TranscriptionQueue:
         if self.processing_thread:
             self.processing_thread.join()
 
-    def add_task(self, task: TranscriptionTask):
-        """Add a task to the queue"""
-        self.queue.put(task)
+    def add_task(self, task: TranscriptionTask) -> str:
+        """Add a task to the queue; returns its id for /cancel"""
+        task.task_id = task.task_id or uuid.uuid4().hex[:6]
+        self.scheduler.push(task, task.duration, task.size, user=task.owner)
+        return task.task_id
+
+    def add_batch(self, batch: TranscriptionBatch, tasks: List[TranscriptionTask]):
+        """Queue all items of a batch; at most batch.max_parallel of them run at once"""
+        with self._lock:
+            self.batches[batch.batch_id] = batch
+            self._batch_active[batch.batch_id] = 0
+        for task in tasks:
+            task.task_id = task.task_id or uuid.uuid4().hex[:6]
+            self.scheduler.push(task, task.duration, task.size, user=task.owner)
+
+    def pending_count(self) -> int:
+        return len(self.scheduler)
+
+    def user_tasks(self, chat_id: int) -> List[TranscriptionTask]:
+        """The chat's running tasks, then its queued ones in expected start order"""
+        running = [task for _, task in list(self.active_tasks.values()) if task.chat_id == chat_id]
+        queued = [entry['job'] for entry in self.queue_positions() if entry['job'].chat_id == chat_id]
+        return [task for task in running + queued if not task.cancel_token.is_cancelled]
+
+    def cancel(self, chat_id: int, job_id: str) -> List[TranscriptionTask]:
+        """Cancel the chat's tasks matching a task id, a batch id or "all"; returns the cancelled tasks.
+
+        Queued tasks leave the queue right away. Running ones stop at their next
+        check: requests in flight are aborted and the worker slot is freed as soon
+        as the task's thread has cleaned up. Queued playlist items are only
+        marked, so the batch still reports them and sends its archive.
+        """
+        cancelled = []
+        for task in self.user_tasks(chat_id):
+            if job_id != 'all' and job_id not in (task.task_id, task.batch_id):
+                continue
+            task.cancel_token.cancel()
+            if not task.batch_id:
+                self.scheduler.remove(task)
+            cancelled.append(task)
+        return cancelled
+
+    def queue_positions(self):
+        """Queued tasks in expected start order with their position and ETA in seconds"""
+        return self.scheduler.snapshot(self.job_limiter.limit)
+
+    def _next_task(self) -> Optional[TranscriptionTask]:
+        """Take the next task by fair share and expected cost whose batch (if any) is below its concurrency cap"""
+        with self._lock:
+            task = self.scheduler.pop(eligible=lambda task: not task.batch_id or
+                                      self._batch_active[task.batch_id] < self.batches[task.batch_id].max_parallel)
+            if task and task.batch_id:
+                self._batch_active[task.batch_id] += 1
+            return task
 
     def _process_queue(self):
         """Main processing loop"""
         while not self._stop_flag.is_set():
             try:
                 # Process tasks if slots are available
-                while len(self.active_tasks) < self.max_tasks and not self.queue.empty():
-                    task = self.queue.get()
+                while len(self.scheduler) and self.job_limiter.try_acquire():
+                    task = self._next_task()
+                    if task is None:
+                        self.job_limiter.release()
+                        break
                     thread = threading.Thread(
                         target=self._process_task,
                         args=(task,)
                     )
                     thread.daemon = True
                     thread.start()
-                    self.active_tasks[id(thread)] = thread
+                    self.active_tasks[id(thread)] = (thread, task)
 
                 # Clean up completed tasks
                 for task_id in list(self.active_tasks.keys()):
-                    if not self.active_tasks[task_id].is_alive():
-                        self.active_tasks[task_id].join()
+                    thread, task = self.active_tasks[task_id]
+                    if not thread.is_alive():
+                        thread.join()
                         del self.active_tasks[task_id]
+                        self.scheduler.finish(task, learn=task.transcribed_audio)
+                        self.job_limiter.release()
+                        if task.transcribed_audio:
+                            self.job_limiter.record_success(task.duration or 0)
 
                 time.sleep(1)
             except Exception as e:
                 logger.error(f"Error in processing loop: {e}")
 
+    def _notify(self, task: TranscriptionTask, text: str):
+        """Send a progress message for a task; batch items only report when they finish"""
+        if task.batch_id:
+            logger.info(f"Batch {task.batch_id} item {task.batch_index + 1}: {text}")
+        else:
+            asyncio.run(self.bot.send_message(task.chat_id, text))
+
+    def _get_transcription(self, task: TranscriptionTask):
+        """Transcribe a task from captions or its media; returns (transcription, duration)"""
+        # Existing YouTube captions make downloading and transcribing the audio unnecessary
+        if (task.is_url and task.transcript_source != TRANSCRIPT_SOURCE_AUDIO
+                and YouTubeService.is_youtube_url(task.file_path)):
+            captions = YouTubeService.fetch_captions(
+                task.file_path, task.cookies_path,
+                any_language=task.transcript_source == TRANSCRIPT_SOURCE_CAPTIONS
+            )
+            if captions:
+                kind = "auto-generated" if captions['is_automatic'] else "uploaded"
+                self._notify(
+                    task,
+                    f"📜 Using {kind} YouTube captions ({captions['language']}), no audio download needed."
+                )
+                return captions['text'], captions['duration']
+            elif task.transcript_source == TRANSCRIPT_SOURCE_CAPTIONS:
+                raise ValueError("This video has no usable captions. Use --audio to transcribe the audio instead.")
+
+        return self._transcribe_media(task)
+
     def _process_task(self, task: TranscriptionTask):
         """Process a single transcription task"""
+        if task.batch_id:
+            self._process_batch_item(task)
+            return
+
         try:
+            task.cancel_token.raise_if_cancelled()
             # Send initial status
             status_msg = "🎬 Starting transcription..."
             if task.is_url:
                 status_msg = "🔗 Processing URL..."
             asyncio.run(self.bot.send_message(task.chat_id, status_msg))
 
-            if task.is_url:
-                # Identify the source
-                source_name = "Unknown"
-                if YouTubeService.is_youtube_url(task.file_path):
-                    source_name = "YouTube"
-                elif GoogleDriveService.is_google_drive_url(task.file_path):
-                    source_name = "Google Drive"
-                elif LinkedInService.is_linkedin_url(task.file_path):
-                    source_name = "LinkedIn"
-                
-                asyncio.run(self.bot.send_message(
-                    task.chat_id, 
-                    f"📥 Downloading from {source_name}..."
-                ))
-                
-                if YouTubeService.is_youtube_url(task.file_path):
-                    # Download YouTube video
-                    file_path = YouTubeService.download_video(task.file_path, task.cookies_path)
-                elif GoogleDriveService.is_google_drive_url(task.file_path):
-                    # Download from Google Drive
-                    file_id = GoogleDriveService.get_file_id(task.file_path)
-                    if not file_id:
-                        raise ValueError("Invalid Google Drive URL")
-                    file_path = GoogleDriveService.download_file(f"https://drive.google.com/file/d/{file_id}/view")
-                elif LinkedInService.is_linkedin_url(task.file_path):
-                    # Download from LinkedIn
-                    file_path = LinkedInService.download_video(task.file_path)
-                else:
-                    raise ValueError("Unsupported URL type")
-                
-                asyncio.run(self.bot.send_message(
-                    task.chat_id, 
-                    "✅ Download completed!"
-                ))
-            else:
-                file_path = task.file_path
+            transcription, duration = self._get_transcription(task)
 
-            # Get audio duration
-            duration = self.media_processor.get_audio_duration(file_path)
-            duration_str = ""
             if duration:
                 minutes = int(duration // 60)
                 seconds = int(duration % 60)
-                duration_str = f" (Duration: {minutes}m {seconds}s)"
-            
-            asyncio.run(self.bot.send_message(
-                task.chat_id, 
-                f"🎤 Transcribing audio{duration_str}..."
-            ))
-
-            # Perform transcription
-            response = self.media_processor.transcribe_audio(file_path, task.prompt)
-            transcription = response.text if response else None
-
-            # Cleanup downloaded file if it was from URL
-            if task.is_url:
-                self.media_processor.cleanup_temp_files(file_path)
 
             if transcription:
                 asyncio.run(self.bot.send_message(
@@ -201,6 +324,8 @@ class TranscriptionQueue:
                 caption += f"• Characters: {char_count:,}\n"
                 if duration:
                     caption += f"• Duration: {minutes}m {seconds}s"
+                if task.repairs:
+                    caption += f"\n• Repairs: {task.repairs}"
                 caption += f"\n\n💡 Use /summary to summarize this transcription!"
                 
                 asyncio.run(self.bot.send_file(
@@ -220,6 +345,9 @@ class TranscriptionQueue:
                     "❌ Transcription failed. Please try again."
                 ))
 
+        except JobCancelled:
+            logger.info(f"Task {task.task_id} cancelled")
+            asyncio.run(self.bot.send_message(task.chat_id, f"🛑 Cancelled {task.display_name}."))
         except Exception as e:
             logger.error(f"Error processing task: {e}")
             error_msg = f"❌ Error during transcription:\n{str(e)}"
@@ -235,18 +363,228 @@ class TranscriptionQueue:
                 error_msg
             ))
 
+    def _transcribe_media(self, task: TranscriptionTask):
+        """Download the task's media if needed and transcribe it; returns (transcription, duration)"""
+        if task.is_url:
+            return self._transcribe_url(task)
+
+        if not task.file_path:
+            self._fetch_upload(task)
+        file_path = task.file_path
+
+        try:
+            task.cancel_token.raise_if_cancelled()
+            # Get audio duration
+            estimate, audio_format = AdmissionController.estimate_file(file_path)
+            duration = audio_format['duration'] or self.media_processor.get_audio_duration(file_path)
+            duration_str = ""
+            if duration:
+                minutes = int(duration // 60)
+                seconds = int(duration % 60)
+                duration_str = f" (Duration: {minutes}m {seconds}s)"
+            
+            with self._admitted(task, estimate):
+                self._notify(task, f"🎤 Transcribing audio{duration_str}...")
+
+                # Perform transcription
+                with self.bot.temp_storage.pinned(file_path):
+                    response = self.media_processor.transcribe_audio(file_path, task.prompt, task.cancel_token)
+                task.transcribed_audio = True
+                task.repairs = response.repairs.summary() if response else None
+                task.duration = duration
+        finally:
+            if task.owns_file:
+                self.media_processor.cleanup_temp_files(file_path)
+        return (response.text if response else None), duration
+
+    @contextmanager
+    def _admitted(self, task: TranscriptionTask, estimate):
+        """Hold the task until its memory and disk estimate fits next to the running tasks"""
+        if not self.admission.admit(estimate, timeout=0):
+            self._notify(task, "⏳ Waiting for other large files to finish...")
+            self.admission.admit(estimate, cancel_token=task.cancel_token)
+        try:
+            yield
+        finally:
+            self.admission.release(estimate)
+
+    def _fetch_upload(self, task: TranscriptionTask):
+        """Fetch a queued Telegram upload, holding one of the download slots"""
+        if not CONFIG['telegram_api_url']:
+            self._notify(task, "📥 Downloading file...")
+        with self._download_slots:
+            with self._lock:
+                self.downloading += 1
+            try:
+                task.file_path, task.owns_file = self.bot.fetch_telegram_file(task.file_id, task.file_name)
+            except Exception as e:
+                logger.error(f"Error downloading file {task.file_id} ({task.size} bytes): {e}")
+                raise ValueError(f"Could not download the file: {e}")
+            finally:
+                with self._lock:
+                    self.downloading -= 1
+        logger.info(f"File ready: {task.file_path}")
+
+    def _transcribe_url(self, task: TranscriptionTask):
+        """Transcribe a URL while it downloads: chunks are sent as soon as their audio has arrived"""
+        download_manager = get_download_manager()
+        source_name = download_manager.source_name(task.file_path)
+        download_manager.check_limits({'duration': task.duration, 'size': task.size})
+        estimate = AdmissionController.estimate_stream(task.duration, task.size, description=task.file_path)
+        
+        with self._admitted(task, estimate):
+            return self._stream_url(task, download_manager, source_name)
+
+    def _stream_url(self, task: TranscriptionTask, download_manager, source_name: str):
+        """Download the task's URL into a job directory and transcribe the audio as it arrives"""
+        duration_str = ""
+        if task.duration:
+            minutes, seconds = divmod(int(task.duration), 60)
+            duration_str = f" (Duration: {minutes}m {seconds}s)"
+        
+        self._notify(
+            task,
+            f"📥 Downloading from {source_name}...\n"
+            f"🎤 Transcribing audio{duration_str} as soon as the first audio arrives."
+        )
+        
+        job_dir = download_manager.new_job_dir()
+        download = GrowingFile()
+        download.duration = task.duration
+        download.start(lambda: download_manager.download(
+            task.file_path, job_dir, task.cookies_path, download.progress_hook, task.cancel_token
+        ))
+        pcm_stream = PcmStream(download)
+        
+        def cleanup():
+            try:
+                # Don't pull the directory from under a download that is still running
+                download.finished.wait()
+                # Cleanup the job directory (the cached copy stays)
+                self.media_processor.cleanup_temp_files(job_dir)
+            finally:
+                self.bot.temp_storage.unpin(job_dir)
+
+        # The web app's sweeper shares the volume; the pin's marker keeps it off the job directory
+        self.bot.temp_storage.pin(job_dir)
+        try:
+            response, duration = self.media_processor.transcribe_pcm_stream(pcm_stream, task.prompt, task.cancel_token)
+            task.transcribed_audio = True
+            task.duration = duration
+            task.repairs = response.repairs.summary() if response else None
+            return (response.text if response else None), duration
+        finally:
+            pcm_stream.close()
+            if task.cancel_token.is_cancelled:
+                # The download stops at its next progress report; free the worker now and clean up after it
+                threading.Thread(target=cleanup, daemon=True).start()
+            else:
+                cleanup()
+
+    def _process_batch_item(self, task: TranscriptionTask):
+        """Transcribe one video of a batch, report it, and send the archive after the last one.
+
+        The worker owns the batch's bookkeeping: it frees the item's slot in the
+        batch's concurrency cap, and the last item removes the batch.
+        """
+        batch = self.batches[task.batch_id]
+        transcription = error = None
+        try:
+            task.cancel_token.raise_if_cancelled()
+            transcription, _ = self._get_transcription(task)
+            if not transcription:
+                error = "Transcription is empty"
+        except JobCancelled:
+            error = "Cancelled"
+        except Exception as e:
+            logger.error(f"Error processing batch item {task.file_path}: {e}")
+            error = str(e)
+
+        with self._lock:
+            self._batch_active[batch.batch_id] -= 1
+        finished = batch.add_result(task, transcription, error)
+        status = "✅" if not error else f"❌ {error}\n"
+        asyncio.run(self.bot.send_message(
+            task.chat_id,
+            f"{status} [{finished}/{batch.total}] {task.title or task.file_path}"
+        ))
+
+        if finished == batch.total:
+            try:
+                self._send_batch_archive(batch)
+            except Exception as e:
+                logger.error(f"Error sending batch archive: {e}")
+                asyncio.run(self.bot.send_message(task.chat_id, f"❌ Could not create the archive: {e}"))
+            finally:
+                with self._lock:
+                    self.batches.pop(batch.batch_id, None)
+                    self._batch_active.pop(batch.batch_id, None)
+
+    def _send_batch_archive(self, batch: TranscriptionBatch):
+        """Zip every transcription of a finished batch, with an index of what failed, and send it"""
+        results = sorted(batch.results, key=lambda result: result['index'])
+        succeeded = [result for result in results if result['transcription']]
+
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
+        temp_file.close()
+        try:
+            index_lines = [f"{batch.title}", ""]
+            with zipfile.ZipFile(temp_file.name, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                for result in results:
+                    number = f"{result['index'] + 1:03d}"
+                    if result['transcription']:
+                        safe_title = re.sub(r'[^\w\-. ]', '_', result['title'])[:80].strip()
+                        archive.writestr(f"{number} - {safe_title}.txt", result['transcription'])
+                        index_lines.append(f"{number}. {result['title']} ({result['url']})")
+                    else:
+                        index_lines.append(f"{number}. FAILED: {result['title']} ({result['url']}): {result['error']}")
+                archive.writestr("index.txt", "\n".join(index_lines) + "\n")
+
+            caption = f"📦 {batch.title}\n\n"
+            caption += f"• Transcribed: {len(succeeded)}/{batch.total}\n"
+            caption += f"• Words: {sum(len(r['transcription'].split()) for r in succeeded):,}"
+            asyncio.run(self.bot.send_file(batch.chat_id, temp_file.name, caption))
+        finally:
+            os.unlink(temp_file.name)
+
 class TranscriptionBot:
     def __init__(self):
         self.whitelist: Set[int] = self.load_whitelist()
         self.queue = TranscriptionQueue(self)
         self.user_cookies: Dict[int, str] = {}  # Store user cookies paths
-        self.user_transcriptions: Dict[int, str] = {}  # Store last transcription per user
-        self.user_summaries: Dict[int, Dict[str, any]] = {}  # Store last summary per user for iterative refinement
+        context_ttl = CONFIG['context_ttl_hours'] * 3600
+        context_memory = int(CONFIG['context_memory_mb'] * 1024 * 1024)
+        # Last transcription per user
+        self.user_transcriptions = ContextStore(
+            os.path.join(CONFIG['context_dir'], 'transcriptions'), context_ttl, context_memory
+        )
+        # Last summary per user for iterative refinement
+        self.user_summaries = ContextStore(
+            os.path.join(CONFIG['context_dir'], 'summaries'), context_ttl, context_memory // 4
+        )
         self.summarization_service = SummarizationService()
+        # One pooled client for direct Bot API calls in local mode, shared by all handlers
+        self.api_client = httpx.Client(
+            timeout=300.0,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5)
+        ) if CONFIG['telegram_api_url'] else None
         
         # Create temp directory if it doesn't exist
         os.makedirs(CONFIG['temp_dir'], exist_ok=True)
 
+        # Downloads, cookies and stored context are swept by age and size instead of per-file timers
+        self.temp_storage = get_temp_storage()
+        self.temp_storage.register(ArtifactClass('uploads', CONFIG['temp_dir'], max_age=MEDIA_MAX_AGE))
+        self.temp_storage.register(ArtifactClass(
+            'cookies', CONFIG['cookies_dir'], max_age=COOKIES_MAX_AGE,
+            include=lambda name: True, on_remove=self._forget_cookies
+        ))
+        for store in (self.user_transcriptions, self.user_summaries):
+            self.temp_storage.register(ArtifactClass(
+                'context', store.directory, max_age=context_ttl, include=lambda name: True
+            ))
+        self.temp_storage.register(system_temp_class())
+
     def load_whitelist(self) -> Set[int]:
         """Load whitelisted user IDs from JSON file"""
         try:
@@ -277,6 +615,60 @@ class TranscriptionBot:
             builder = builder.write_timeout(300.0)
         return builder
 
+    def _local_file_path(self, file_id: str) -> str:
+        """Path of an uploaded file in the Bot API server's volume, as mounted in this container"""
+        base_url = CONFIG['telegram_api_url'].rstrip('/')
+        resp = self.api_client.post(f"{base_url}{CONFIG['telegram_token']}/getFile", json={"file_id": file_id})
+        resp.raise_for_status()
+        file_info = resp.json()
+        
+        if not file_info.get('ok'):
+            raise Exception(f"Failed to get file info: {file_info}")
+        
+        actual_file_path = file_info['result']['file_path']
+        logger.info(f"File path from API: {actual_file_path}")
+        
+        # Map the container path to the volume mount
+        if not actual_file_path.startswith(CONFIG['telegram_api_data_dir']):
+            raise Exception(f"Unexpected file path format: {actual_file_path}")
+        volume_path = actual_file_path.replace(
+            CONFIG['telegram_api_data_dir'],
+            CONFIG['telegram_api_mount_path'],
+            1
+        )
+        if not os.path.exists(volume_path):
+            logger.error(f"File not found in volume: {volume_path}")
+            raise Exception(f"File not found in shared volume: {volume_path}")
+        return volume_path
+
+    def fetch_telegram_file(self, file_id: str, file_name: str):
+        """Make an uploaded file available to the transcriber; returns (path, owns_file).
+
+        Called from queue workers. In local mode the Bot API server has already
+        written the file to the shared volume, so it's read there in place. If
+        the bot can't read it there, it is hardlinked or cloned into temp_dir,
+        with a plain copy as the last resort. In standard mode the file is
+        downloaded into temp_dir.
+        """
+        file_path = os.path.join(CONFIG['temp_dir'], f"{file_id}_{file_name}")
+        
+        if CONFIG['telegram_api_url']:
+            volume_path = self._local_file_path(file_id)
+            if os.access(volume_path, os.R_OK):
+                logger.info(f"Reading file in place: {volume_path}")
+                return volume_path, False
+            link_or_copy(volume_path, file_path)
+            logger.info(f"File linked from volume: {volume_path} to {file_path}")
+            return file_path, True
+        
+        asyncio.run(self._download_telegram_file(file_id, file_path))
+        return file_path, True
+
+    async def _download_telegram_file(self, file_id: str, file_path: str):
+        async with self._get_application_builder().build() as app:
+            file = await app.bot.get_file(file_id)
+            await file.download_to_drive(file_path)
+
     async def send_message(self, chat_id: int, text: str):
         """Send a message to the user"""
         async with self._get_application_builder().build() as app:
@@ -334,6 +726,16 @@ class TranscriptionBot:
         prompt = None
         args = context.args[:] if context.args else []
         
+        # --captions / --audio force the YouTube transcript source
+        transcript_source = TRANSCRIPT_SOURCE_AUTO
+        prompt_start = args.index("--prompt") if "--prompt" in args else len(args)
+        if "--captions" in args[:prompt_start]:
+            transcript_source = TRANSCRIPT_SOURCE_CAPTIONS
+        elif "--audio" in args[:prompt_start]:
+            transcript_source = TRANSCRIPT_SOURCE_AUDIO
+        args = [arg for i, arg in enumerate(args)
+                if i >= prompt_start or arg not in ("--captions", "--audio")]
+        
         if args and "--prompt" in args:
             prompt_index = args.index("--prompt")
             if prompt_index < len(args) - 1:
@@ -347,43 +749,82 @@ class TranscriptionBot:
             url = args[0]
             source_type = ""
             
+            if YouTubeService.is_playlist_url(url):
+                await self.queue_playlist(update, url, prompt, transcript_source)
+                return
+            
             if YouTubeService.is_youtube_url(url):
                 source_type = "YouTube"
             elif GoogleDriveService.is_google_drive_url(url):
                 source_type = "Google Drive"
             elif LinkedInService.is_linkedin_url(url):
                 source_type = "LinkedIn"
+            elif DirectMediaService.is_direct_media_url(url):
+                source_type = "media link"
                 
             if source_type:
-                prompt_info = f" with custom prompt" if prompt else ""
-                await update.message.reply_text(
-                    f"Added {source_type} video to transcription queue{prompt_info}. "
-                    "You will be notified when it's ready."
-                )
                 # Check if user has uploaded cookies for YouTube
                 cookies_path = None
                 if source_type == "YouTube" and update.effective_user.id in self.user_cookies:
                     cookies_path = self.user_cookies[update.effective_user.id]
                 
-                self.queue.add_task(TranscriptionTask(
+                # Look up duration and size before queueing, so oversized media is rejected right away
+                media_info = {}
+                try:
+                    media_info = await asyncio.to_thread(get_download_manager().probe, url, cookies_path)
+                except Exception as e:
+                    logger.warning(f"Metadata lookup failed for {url}, queueing without it: {e}")
+                # Videos with captions are never downloaded, their limits are checked if the audio is needed
+                may_use_captions = source_type == "YouTube" and transcript_source != TRANSCRIPT_SOURCE_AUDIO
+                try:
+                    if may_use_captions:
+                        get_download_manager().check_limits({'is_live': media_info.get('is_live')})
+                    else:
+                        get_download_manager().check_limits(media_info)
+                        get_admission_controller().check(AdmissionController.estimate_stream(
+                            media_info.get('duration'), media_info.get('size')
+                        ))
+                except ValueError as e:
+                    await update.message.reply_text(f"❌ {e}")
+                    return
+                
+                prompt_info = f" with custom prompt" if prompt else ""
+                media_details = ""
+                if media_info.get('title'):
+                    media_details += f" \"{media_info['title']}\""
+                if media_info.get('duration'):
+                    minutes, seconds = divmod(int(media_info['duration']), 60)
+                    media_details += f" ({minutes}m {seconds}s)"
+                task_id = self.queue.add_task(TranscriptionTask(
                     chat_id=update.effective_chat.id,
+                    user_id=update.effective_user.id,
                     file_path=url,
                     is_url=True,
                     prompt=prompt,
-                    cookies_path=cookies_path
+                    cookies_path=cookies_path,
+                    transcript_source=transcript_source,
+                    title=media_info.get('title'),
+                    duration=media_info.get('duration'),
+                    size=media_info.get('size')
                 ))
+                
+                await update.message.reply_text(
+                    f"Added {source_type}{media_details} to transcription queue{prompt_info}. "
+                    "You will be notified when it's ready.\n"
+                    f"Send /cancel {task_id} to stop it."
+                )
                 return
             else:
                 await update.message.reply_text(
                     "Please provide either a YouTube URL, a LinkedIn URL, a Google Drive URL, "
-                    "or attach an audio/video file."
+                    "a direct link to a media file, or attach an audio/video file."
                 )
                 return
 
         # Check if there's a file attachment
         if not update.message.document:
             await update.message.reply_text(
-                "Please provide either a YouTube/LinkedIn/Google Drive URL or attach an audio/video file.\n"
+                "Please provide either a YouTube/LinkedIn/Google Drive URL, a direct media link or attach an audio/video file.\n"
                 "You can also add a custom prompt with: /transcribe [URL] --prompt \"Your custom prompt\""
             )
             return
@@ -420,25 +861,22 @@ class TranscriptionBot:
             )
             return
 
-        # Download the file
-        file = await context.bot.get_file(update.message.document.file_id)
-        file_path = os.path.join(
-            CONFIG['temp_dir'],
-            f"{update.message.document.file_id}_{update.message.document.file_name}"
-        )
-        await file.download_to_drive(file_path)
-
-        # Add to queue
+        # Queue a reference to the file, a worker downloads it
         prompt_info = " with custom prompt" if prompt else ""
-        self.queue.add_task(TranscriptionTask(
+        task_id = self.queue.add_task(TranscriptionTask(
             chat_id=update.effective_chat.id,
-            file_path=file_path,
-            prompt=prompt
+            user_id=update.effective_user.id,
+            file_path=None,
+            prompt=prompt,
+            file_id=update.message.document.file_id,
+            file_name=update.message.document.file_name,
+            size=update.message.document.file_size
         ))
 
         await update.message.reply_text(
             f"File added to transcription queue{prompt_info}. "
-            "You will be notified when it's ready."
+            "You will be notified when it's ready.\n"
+            f"Send /cancel {task_id} to stop it."
         )
 
     async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -499,81 +937,21 @@ class TranscriptionBot:
             )
             return
 
-        # Download the file
-        try:
-            await update.message.reply_text("📥 Downloading file...")
-            file = await context.bot.get_file(update.message.document.file_id)
-            file_path = os.path.join(
-                CONFIG['temp_dir'],
-                f"{update.message.document.file_id}_{update.message.document.file_name}"
-            )
-            
-            # For local API, download differently
-            if CONFIG['telegram_api_url']:
-                # In local mode, files are stored on the filesystem
-                # We need to copy them from the telegram-bot-api container
-                try:
-                    import httpx
-                    
-                    # Get file info to get the actual path
-                    base_url = CONFIG['telegram_api_url'].rstrip('/')
-                    file_info_url = f"{base_url}{CONFIG['telegram_token']}/getFile"
-                    file_data = {"file_id": update.message.document.file_id}
-                    
-                    async with httpx.AsyncClient(timeout=300.0) as client:
-                        resp = await client.post(file_info_url, json=file_data)
-                        resp.raise_for_status()
-                        file_info = resp.json()
-                        
-                        if not file_info.get('ok'):
-                            raise Exception(f"Failed to get file info: {file_info}")
-                        
-                        # Get the actual file path
-                        actual_file_path = file_info['result']['file_path']
-                        logger.info(f"File path from API: {actual_file_path}")
-                        
-                        # Map the container path to the volume mount
-                        if actual_file_path.startswith(CONFIG['telegram_api_data_dir']):
-                            volume_path = actual_file_path.replace(
-                                CONFIG['telegram_api_data_dir'], 
-                                CONFIG['telegram_api_mount_path']
-                            )
-                            
-                            # Check if file exists in the volume
-                            if os.path.exists(volume_path):
-                                import shutil
-                                shutil.copy2(volume_path, file_path)
-                                logger.info(f"File copied from volume: {volume_path} to {file_path}")
-                            else:
-                                logger.error(f"File not found in volume: {volume_path}")
-                                raise Exception(f"File not found in shared volume: {volume_path}")
-                        else:
-                            raise Exception(f"Unexpected file path format: {actual_file_path}")
-                            
-                except Exception as e:
-                    logger.error(f"Failed to download file: {e}")
-                    raise
-            else:
-                await file.download_to_drive(file_path)
-                
-        except Exception as e:
-            logger.error(f"Error downloading document: {e}")
-            await update.message.reply_text(
-                f"❌ Error downloading file: {str(e)}\n\n"
-                "Please try using a YouTube/Google Drive URL instead."
-            )
-            return
-
-        # Add to queue
-        self.queue.add_task(TranscriptionTask(
+        # Queue a reference to the file, a worker downloads it
+        task_id = self.queue.add_task(TranscriptionTask(
             chat_id=update.effective_chat.id,
-            file_path=file_path,
-            prompt=None
+            user_id=update.effective_user.id,
+            file_path=None,
+            prompt=None,
+            file_id=update.message.document.file_id,
+            file_name=update.message.document.file_name,
+            size=update.message.document.file_size
         ))
 
         await update.message.reply_text(
             "File added to transcription queue. "
-            "You will be notified when it's ready."
+            "You will be notified when it's ready.\n"
+            f"Send /cancel {task_id} to stop it."
         )
     
     async def handle_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -627,6 +1005,13 @@ class TranscriptionBot:
             )
             return
         
+        # Telegram reports the duration of audio and video, enough to reject files that could never fit
+        try:
+            get_admission_controller().check(AdmissionController.estimate_decode(file_obj.duration))
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
+        
         # Check if we're using local API
         if CONFIG['telegram_api_url']:
             # With local API, we can handle much larger files
@@ -648,90 +1033,23 @@ class TranscriptionBot:
             )
             return
 
-        # Download the file
-        try:
-            await update.message.reply_text("📥 Downloading file...")
-            logger.info(f"Getting file info for: {file_obj.file_id}")
-            file = await context.bot.get_file(file_obj.file_id)
-            logger.info(f"File path from API: {file.file_path}")
-            
-            file_path = os.path.join(
-                CONFIG['temp_dir'],
-                file_name
-            )
-            logger.info(f"Downloading to: {file_path}")
-            
-            # For local API, download differently
-            if CONFIG['telegram_api_url']:
-                # In local mode, files are stored on the filesystem
-                # We need to copy them from the telegram-bot-api container
-                try:
-                    import httpx
-                    
-                    # Get file info to get the actual path
-                    base_url = CONFIG['telegram_api_url'].rstrip('/')
-                    file_info_url = f"{base_url}{CONFIG['telegram_token']}/getFile"
-                    file_data = {"file_id": file_obj.file_id}
-                    
-                    async with httpx.AsyncClient(timeout=300.0) as client:
-                        resp = await client.post(file_info_url, json=file_data)
-                        resp.raise_for_status()
-                        file_info = resp.json()
-                        
-                        if not file_info.get('ok'):
-                            raise Exception(f"Failed to get file info: {file_info}")
-                        
-                        # Get the actual file path
-                        actual_file_path = file_info['result']['file_path']
-                        logger.info(f"File path from API: {actual_file_path}")
-                        
-                        # Map the container path to the volume mount
-                        if actual_file_path.startswith(CONFIG['telegram_api_data_dir']):
-                            volume_path = actual_file_path.replace(
-                                CONFIG['telegram_api_data_dir'], 
-                                CONFIG['telegram_api_mount_path']
-                            )
-                            
-                            # Check if file exists in the volume
-                            if os.path.exists(volume_path):
-                                import shutil
-                                shutil.copy2(volume_path, file_path)
-                                logger.info(f"File copied from volume: {volume_path} to {file_path}")
-                            else:
-                                logger.error(f"File not found in volume: {volume_path}")
-                                raise Exception(f"File not found in shared volume: {volume_path}")
-                        else:
-                            raise Exception(f"Unexpected file path format: {actual_file_path}")
-                            
-                except Exception as e:
-                    logger.error(f"Failed to download file: {e}")
-                    raise
-            else:
-                # Standard API download
-                await file.download_to_drive(file_path)
-            
-            logger.info(f"Download completed: {file_path}")
-        except Exception as e:
-            logger.error(f"Error downloading file: {e}")
-            logger.error(f"File ID: {file_obj.file_id}")
-            logger.error(f"File size: {file_obj.file_size}")
-            await update.message.reply_text(
-                f"❌ Error downloading file: {str(e)}\n\n"
-                "Please try uploading a smaller file or using a YouTube/Google Drive URL."
-            )
-            return
-
-        # Add to queue
-        self.queue.add_task(TranscriptionTask(
+        # Queue a reference to the file, a worker downloads it
+        task_id = self.queue.add_task(TranscriptionTask(
             chat_id=update.effective_chat.id,
-            file_path=file_path,
-            prompt=prompt
+            user_id=update.effective_user.id,
+            file_path=None,
+            prompt=prompt,
+            file_id=file_obj.file_id,
+            file_name=file_name,
+            size=file_obj.file_size,
+            duration=file_obj.duration
         ))
 
         prompt_info = " with custom prompt" if prompt else ""
         await update.message.reply_text(
             f"Media file added to transcription queue{prompt_info}. "
-            "You will be notified when it's ready."
+            "You will be notified when it's ready.\n"
+            f"Send /cancel {task_id} to stop it."
         )
     
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -742,7 +1060,7 @@ class TranscriptionBot:
             )
             return
         
-        queue_size = self.queue.queue.qsize()
+        queue_size = self.queue.pending_count()
         active_tasks = len(self.queue.active_tasks)
         
         status_msg = "📊 **Transcription Queue Status**\n\n"
@@ -750,14 +1068,119 @@ class TranscriptionBot:
         if queue_size == 0 and active_tasks == 0:
             status_msg += "✅ Queue is empty - ready for new tasks!"
         else:
-            status_msg += f"🔄 Active tasks: {active_tasks}/{self.queue.max_tasks}\n"
+            job_limit = self.queue.job_limiter.snapshot()
+            api_limit = get_api_limiter().snapshot()
+            status_msg += f"🔄 Active tasks: {active_tasks}/{job_limit['limit']} ({job_limit['reason']})\n"
+            status_msg += f"⚡ API requests: {api_limit['in_flight']}/{api_limit['limit']} ({api_limit['reason']})\n"
             status_msg += f"⏳ Queued tasks: {queue_size}\n\n"
             
+            if self.queue.downloading:
+                status_msg += f"📥 Fetching uploaded files: {self.queue.downloading}/{CONFIG['max_parallel_downloads']}\n"
+            admission = self.queue.admission.snapshot()
+            status_msg += (
+                f"🧠 Memory reserved: {admission['memory_reserved'] / 1024 ** 3:.1f}"
+                f"/{admission['memory_budget'] / 1024 ** 3:.1f} GB\n"
+            )
+            if admission['waiting']:
+                status_msg += f"⏳ Waiting for memory or disk: {admission['waiting']}\n"
             if active_tasks > 0:
                 status_msg += "💭 Currently processing transcriptions..."
+            
+            # The user's own queued jobs, in the order they are expected to start
+            running = [task for _, task in list(self.queue.active_tasks.values())
+                       if task.chat_id == update.effective_chat.id and not task.cancel_token.is_cancelled]
+            if running:
+                status_msg += "\n\n▶️ Your running files:"
+                for task in running:
+                    status_msg += f"\n{task.task_id} {task.display_name}"
+
+            own_jobs = [entry for entry in self.queue.queue_positions()
+                        if entry['job'].chat_id == update.effective_chat.id]
+            if own_jobs:
+                status_msg += "\n\n📋 Your queued files:"
+                for entry in own_jobs[:10]:
+                    status_msg += (
+                        f"\n#{entry['position']} {entry['job'].task_id} {entry['job'].display_name} "
+                        f"- starts in ~{self._format_eta(entry['eta'])}"
+                    )
+                if len(own_jobs) > 10:
+                    status_msg += f"\n...and {len(own_jobs) - 10} more"
+            if running or own_jobs:
+                status_msg += "\n\nSend /cancel <job> to stop one."
+        
+        for batch in list(self.queue.batches.values()):
+            if batch.chat_id == update.effective_chat.id:
+                status_msg += f"\n\n📚 {batch.title}: {len(batch.results)}/{batch.total} videos done"
+        
+        downloads = get_download_manager().active_downloads()
+        if downloads:
+            status_msg += f"\n\n📥 Downloads in progress: {len(downloads)}"
+            for download in downloads:
+                progress = f"{download['downloaded'] / (1024*1024):.0f} MB"
+                if download['total']:
+                    progress += f" / {download['total'] / (1024*1024):.0f} MB"
+                status_msg += f"\n• {progress} at {download['speed'] / (1024*1024):.1f} MB/s"
         
         await update.message.reply_text(status_msg)
     
+    @staticmethod
+    def _format_eta(seconds: float) -> str:
+        if seconds < 60:
+            return "1 min"
+        minutes = int(seconds // 60)
+        if minutes < 60:
+            return f"{minutes} min"
+        return f"{minutes // 60}h {minutes % 60}m"
+
+    async def queue_playlist(self, update: Update, url: str, prompt: Optional[str], transcript_source: str):
+        """Expand a playlist or channel and queue its videos as one batch"""
+        cookies_path = self.user_cookies.get(update.effective_user.id)
+        await update.message.reply_text("📚 Reading playlist...")
+        try:
+            playlist = await asyncio.to_thread(YouTubeService.expand_playlist, url, cookies_path)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
+
+        entries = playlist['entries']
+        if not entries:
+            await update.message.reply_text("❌ This playlist has no videos I can access.")
+            return
+
+        batch = TranscriptionBatch(
+            batch_id=uuid.uuid4().hex[:8],
+            chat_id=update.effective_chat.id,
+            title=playlist['title'],
+            total=len(entries),
+            max_parallel=CONFIG['max_parallel_batch_items']
+        )
+        tasks = [
+            TranscriptionTask(
+                chat_id=update.effective_chat.id,
+                user_id=update.effective_user.id,
+                file_path=entry['url'],
+                is_url=True,
+                prompt=prompt,
+                cookies_path=cookies_path,
+                transcript_source=transcript_source,
+                title=entry['title'],
+                duration=entry['duration'],
+                batch_id=batch.batch_id,
+                batch_index=index
+            )
+            for index, entry in enumerate(entries)
+        ]
+        self.queue.add_batch(batch, tasks)
+
+        total_duration = sum(entry['duration'] or 0 for entry in entries)
+        duration_info = f" ({int(total_duration // 3600)}h {int(total_duration % 3600 // 60)}m)" if total_duration else ""
+        await update.message.reply_text(
+            f"📚 Added \"{batch.title}\": {batch.total} videos{duration_info}.\n"
+            f"Up to {batch.max_parallel} videos are transcribed at a time. You'll get a message "
+            "as each one finishes and a zip archive with all transcriptions at the end.\n"
+            f"Send /cancel {batch.batch_id} to stop the remaining videos."
+        )
+
     async def setcookies_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /setcookies command for YouTube authentication"""
         if not self.check_whitelist(update.effective_user.id):
@@ -827,10 +1250,7 @@ class TranscriptionBot:
                 "The cookies will be automatically deleted after 24 hours.\n"
                 "Use /removecookies to delete them manually."
             )
-            
-            # Schedule deletion after 24 hours
-            # In production, you'd want to use a proper scheduler
-            threading.Timer(24 * 3600, lambda: self._delete_user_cookies(user_id)).start()
+            # The temp storage sweeper deletes them after 24 hours
             
         except Exception as e:
             logger.error(f"Error saving cookies: {e}")
@@ -840,6 +1260,13 @@ class TranscriptionBot:
         finally:
             context.user_data['expecting_cookies'] = False
     
+    def _forget_cookies(self, cookies_path: str):
+        """Drop references to a cookies file the temp storage sweeper has deleted"""
+        for user_id, path in list(self.user_cookies.items()):
+            if path == cookies_path:
+                self.user_cookies.pop(user_id, None)
+                logger.info(f"Cookies expired for user {user_id}")
+
     def _delete_user_cookies(self, user_id: int):
         """Delete user's cookies file"""
         if user_id in self.user_cookies:
@@ -871,10 +1298,34 @@ class TranscriptionBot:
             )
     
     async def cancel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /cancel command"""
+        """Handle /cancel command: /cancel <job id|all> stops transcriptions, plain /cancel a pending step"""
+        if context.args:
+            if not self.check_whitelist(update.effective_user.id):
+                await update.message.reply_text(
+                    "Sorry, you are not authorized to use this bot."
+                )
+                return
+            job_id = context.args[0].lower()
+            cancelled = self.queue.cancel(update.effective_chat.id, job_id)
+            if cancelled:
+                names = "\n".join(f"• {task.display_name}" for task in cancelled[:10])
+                more = f"\n…and {len(cancelled) - 10} more" if len(cancelled) > 10 else ""
+                await update.message.reply_text(f"🛑 Cancelling {len(cancelled)} job(s):\n{names}{more}")
+            else:
+                await update.message.reply_text(f"No queued or running job {job_id}. Use /status to see your jobs.")
+            return
+
         if context.user_data.get('expecting_cookies'):
             context.user_data['expecting_cookies'] = False
             await update.message.reply_text("Cancelled cookie upload.")
+            return
+
+        tasks = self.queue.user_tasks(update.effective_chat.id)
+        if tasks:
+            jobs = "\n".join(f"• {task.task_id} - {task.display_name}" for task in tasks[:10])
+            await update.message.reply_text(
+                f"Your jobs:\n{jobs}\n\nSend /cancel <job> to stop one, or /cancel all."
+            )
         else:
             await update.message.reply_text("Nothing to cancel.")
     
@@ -897,7 +1348,7 @@ class TranscriptionBot:
 • `/status` - Check queue status
 • `/setcookies` - Upload YouTube cookies for restricted videos
 • `/removecookies` - Delete your stored cookies
-• `/cancel` - Cancel current operation
+• `/cancel [job|all]` - Cancel a transcription (ids are shown in `/status`) or the current operation
 
 **How to Transcribe:**
 1️⃣ **Direct Upload:** Send a file with `/transcribe` or just send the file
@@ -908,8 +1359,19 @@ class TranscriptionBot:
    - YouTube videos (with cookie support!)
    - LinkedIn posts
    - Google Drive files
+   - Direct links to media files
    - No size limit! 🎉
 
+3️⃣ **Playlists & Channels:** Send `/transcribe [playlist or channel URL]`
+   - Every video is transcribed, a few at a time
+   - You get a message per video and a zip with all transcriptions
+
+**YouTube Captions:**
+📜 If a video already has captions, they are used instead of transcribing the audio
+   - `--captions` - only use captions, fail if there are none
+   - `--audio` - always transcribe the audio
+   - Example: `/ts https://youtube.com/watch?v=... --audio`
+
 **YouTube Authentication:**
 🍪 Use `/setcookies` to upload cookies for:
    - Age-restricted videos
@@ -998,11 +1460,11 @@ Need more help? Check the project documentation!"""
                 # If it's a refinement request (no new transcription), use it as feedback
                 if has_previous_summary and user_id in self.user_transcriptions:
                     custom_prompt = transcription_text
-                    transcription_text = self.user_transcriptions[user_id]
+                    transcription_text = await asyncio.to_thread(self.user_transcriptions.get, user_id)
         
         # If no inline text, check if we have a stored transcription
         if transcription_text is None and user_id in self.user_transcriptions:
-            transcription_text = self.user_transcriptions[user_id]
+            transcription_text = await asyncio.to_thread(self.user_transcriptions.get, user_id)
         
         # If still no transcription, prompt user to provide one
         if transcription_text is None:
@@ -1161,7 +1623,7 @@ Need more help? Check the project documentation!"""
                 transcription_text = f.read()
             
             # Store in user context
-            self.user_transcriptions[update.effective_user.id] = transcription_text
+            await asyncio.to_thread(self.user_transcriptions.__setitem__, update.effective_user.id, transcription_text)
             
             # Get stored parameters
             language = context.user_data.get('summary_language', 'en')
@@ -1213,11 +1675,15 @@ Need more help? Check the project documentation!"""
             return
         
         # Process as refinement request
+        transcription_text = await asyncio.to_thread(self.user_transcriptions.get, user_id)
+        previous_summary = await asyncio.to_thread(self.user_summaries.get, user_id)
+        if transcription_text is None or previous_summary is None:
+            return
         await self._process_summarization(
             update,
             context,
-            self.user_transcriptions[user_id],
-            language=self.user_summaries[user_id].get('language', 'en'),
+            transcription_text,
+            language=previous_summary.get('language', 'en'),
             custom_prompt=message_text,  # Use the message as feedback
             is_refinement=True
         )
@@ -1276,6 +1742,7 @@ def main():
     # Start queue processing
     bot.queue.start()
     logger.info("Queue processing started")
+    bot.temp_storage.start()
 
     # Create application and add handlers
     builder = Application.builder().token(CONFIG['telegram_token'])
@@ -1338,6 +1805,9 @@ def main():
         # Cleanup
         logger.info("Stopping bot...")
         bot.queue.stop()
+        bot.temp_storage.stop()
+        if bot.api_client:
+            bot.api_client.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
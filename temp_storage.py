@@ -0,0 +1,308 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# How often the sweeper runs, and the disk budget for everything it manages
+SWEEP_INTERVAL_SECONDS = float(os.getenv('TEMP_SWEEP_INTERVAL_MINUTES', '10')) * 60
+TEMP_DISK_QUOTA_BYTES = int(float(os.getenv('TEMP_DISK_QUOTA_GB', '50')) * 1024 ** 3)
+
+HOUR = 3600
+
+# Limits for the artifact classes the web app and the bot register
+MEDIA_MAX_AGE = float(os.getenv('TEMP_MEDIA_MAX_AGE_HOURS', '6')) * HOUR
+MEDIA_QUOTA_BYTES = int(float(os.getenv('TEMP_MEDIA_QUOTA_GB', '20')) * 1024 ** 3)
+TRANSCRIPTS_MAX_AGE = float(os.getenv('TRANSCRIPTS_MAX_AGE_DAYS', '30')) * 24 * HOUR
+COOKIES_MAX_AGE = 24 * HOUR
+
+# Pins are also marked on disk next to the pinned path, so the web app and the bot, separate processes
+# sharing the volume, respect each other's. The owner refreshes its markers every heartbeat; a marker
+# older than PIN_STALE_SECONDS was left by a process that died.
+PIN_MARKER_SUFFIX = '.inuse'
+PIN_HEARTBEAT_SECONDS = 60
+PIN_STALE_SECONDS = 5 * 60
+
+
+class ArtifactClass:
+    """One kind of temporary data: the entries directly inside ``directory``.
+
+    Entries (files or whole directories) older than ``max_age`` seconds are
+    removed, and the oldest ones go first while the class uses more than
+    ``max_bytes``. 0 disables either limit. ``include(name)`` selects the
+    entries that belong to the class when a directory is shared, and
+    ``on_remove(path)`` is called after an entry has been deleted.
+    """
+
+    def __init__(self, name, directory, max_age=0, max_bytes=0, include=None, on_remove=None):
+        self.name = name
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.include = include or (lambda entry_name: not entry_name.startswith('.'))
+        self.on_remove = on_remove
+
+
+def _marker_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}{PIN_MARKER_SUFFIX}")
+
+
+def _is_marker(name):
+    return name.startswith('.') and name.endswith(PIN_MARKER_SUFFIX)
+
+
+def _marker_is_fresh(marker, now):
+    try:
+        return now - os.stat(marker).st_mtime < PIN_STALE_SECONDS
+    except OSError:
+        return False
+
+
+def _marked_in_use(path):
+    """Whether any process pinned ``path`` or something inside it, going by the markers on disk"""
+    now = time.time()
+    if _marker_is_fresh(_marker_path(path), now):
+        return True
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, files in os.walk(path):
+            if any(_is_marker(name) and _marker_is_fresh(os.path.join(root, name), now) for name in files):
+                return True
+    return False
+
+
+def _entry_stats(path):
+    """(size in bytes, newest modification time) of a file or a directory tree"""
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        return 0, 0
+    if not os.path.isdir(path) or os.path.islink(path):
+        return stat.st_size, stat.st_mtime
+    size, newest = 0, stat.st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs:
+            try:
+                newest = max(newest, os.lstat(os.path.join(root, name)).st_mtime)
+            except OSError:
+                pass
+        for name in files:
+            try:
+                child = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += child.st_size
+            newest = max(newest, child.st_mtime)
+    return size, newest
+
+
+class TempStorage:
+    """Background garbage collector for every kind of temporary data a process creates.
+
+    Each sweep removes expired entries per artifact class, then enforces the
+    per-class quotas and finally the global quota, deleting the least recently
+    modified entries first. Paths that a running job uses are pinned with
+    ``pinned(path)``; a pinned path and any directory containing it are never
+    deleted, also by the sweeper of another process, which sees the pin's
+    marker file. Extra maintenance callables (like the download cache's own
+    eviction) run at the end of each sweep.
+    """
+
+    def __init__(self, max_total_bytes=TEMP_DISK_QUOTA_BYTES, interval=SWEEP_INTERVAL_SECONDS):
+        self.max_total_bytes = max_total_bytes
+        self.interval = interval
+        self.classes = []
+        self.maintenance = []
+        self._pins = {}
+        self._lock = threading.Lock()
+        self._stop_flag = threading.Event()
+        self._thread = None
+        self._heartbeat_thread = None
+
+    def register(self, artifact_class):
+        os.makedirs(artifact_class.directory, exist_ok=True)
+        self.classes.append(artifact_class)
+
+    def add_maintenance(self, func):
+        self.maintenance.append(func)
+
+    def pin(self, path):
+        """Keep ``path`` (and the directories above it) from being swept until ``unpin(path)``"""
+        path = os.path.realpath(path)
+        with self._lock:
+            self._pins[path] = self._pins.get(path, 0) + 1
+            if self._pins[path] == 1:
+                self._touch_marker(path)
+            if not self._heartbeat_thread:
+                self._heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+                self._heartbeat_thread.start()
+        return path
+
+    def unpin(self, path):
+        path = os.path.realpath(path)
+        with self._lock:
+            self._pins[path] -= 1
+            if not self._pins[path]:
+                del self._pins[path]
+                try:
+                    os.unlink(_marker_path(path))
+                except OSError:
+                    pass
+
+    @contextmanager
+    def pinned(self, path):
+        """Keep ``path`` (and the directories above it) from being swept while the block runs"""
+        path = self.pin(path)
+        try:
+            yield path
+        finally:
+            self.unpin(path)
+
+    @staticmethod
+    def _touch_marker(path):
+        try:
+            with open(_marker_path(path), 'a'):
+                pass
+            os.utime(_marker_path(path))
+        except OSError:
+            pass  # read-only location (e.g. the Bot API volume): only this process knows the pin
+
+    def _heartbeat(self):
+        """Keep the markers of this process's pins fresh, so other sweepers don't take them for stale"""
+        while True:
+            time.sleep(PIN_HEARTBEAT_SECONDS)
+            with self._lock:
+                for path in self._pins:
+                    self._touch_marker(path)
+
+    def _is_pinned(self, path):
+        path = os.path.realpath(path)
+        with self._lock:
+            if any(pin == path or pin.startswith(path + os.sep) for pin in self._pins):
+                return True
+        return _marked_in_use(path)
+
+    def _entries(self, artifact_class):
+        """Entries of a class as (path, size, last modified)"""
+        try:
+            names = os.listdir(artifact_class.directory)
+        except FileNotFoundError:
+            return []
+        entries = []
+        now = time.time()
+        for name in names:
+            if _is_marker(name):
+                # Markers belong to the entry they pin; drop the ones a dead process left behind
+                if not _marker_is_fresh(os.path.join(artifact_class.directory, name), now):
+                    try:
+                        os.unlink(os.path.join(artifact_class.directory, name))
+                    except OSError:
+                        pass
+                continue
+            if not artifact_class.include(name):
+                continue
+            path = os.path.join(artifact_class.directory, name)
+            size, modified = _entry_stats(path)
+            entries.append((path, size, modified))
+        return entries
+
+    def _remove(self, artifact_class, path, reason):
+        if self._is_pinned(path):
+            return False
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: Could not remove {path}: {e}")
+            return False
+        print(f"Removed {artifact_class.name} {path} ({reason})")
+        if artifact_class.on_remove:
+            artifact_class.on_remove(path)
+        return True
+
+    def sweep(self):
+        """Run one collection pass; returns the bytes still in use per class"""
+        now = time.time()
+        remaining = []  # (modified, size, path, class) of everything kept
+        usage = {}
+        for artifact_class in self.classes:
+            kept = []
+            for path, size, modified in self._entries(artifact_class):
+                if artifact_class.max_age and now - modified > artifact_class.max_age:
+                    if self._remove(artifact_class, path, "expired"):
+                        continue
+                kept.append((modified, size, path, artifact_class))
+
+            kept.sort()
+            used = sum(size for _, size, _, _ in kept)
+            if artifact_class.max_bytes:
+                for entry in list(kept):
+                    if used <= artifact_class.max_bytes:
+                        break
+                    if self._remove(artifact_class, entry[2], "over class quota"):
+                        kept.remove(entry)
+                        used -= entry[1]
+            usage[artifact_class.name] = usage.get(artifact_class.name, 0) + used
+            remaining.extend(kept)
+
+        if self.max_total_bytes:
+            total = sum(size for _, size, _, _ in remaining)
+            for modified, size, path, artifact_class in sorted(remaining):
+                if total <= self.max_total_bytes:
+                    break
+                if self._remove(artifact_class, path, "over disk quota"):
+                    total -= size
+                    usage[artifact_class.name] -= size
+
+        for func in self.maintenance:
+            try:
+                func()
+            except Exception as e:
+                print(f"Warning: Temp storage maintenance failed: {e}")
+        return usage
+
+    def start(self):
+        """Sweep now and then every ``interval`` seconds in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_flag.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_flag.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop_flag.is_set():
+            try:
+                usage = self.sweep()
+                print(f"Temp storage: {', '.join(f'{name} {used / (1024*1024):.0f} MB' for name, used in usage.items())}")
+            except Exception as e:
+                print(f"Error in temp storage sweep: {e}")
+            self._stop_flag.wait(self.interval)
+
+
+def system_temp_class(max_age=24 * HOUR):
+    """Scratch files our tempfile.NamedTemporaryFile calls leave in the system temp dir after a crash"""
+    return ArtifactClass(
+        'scratch', tempfile.gettempdir(), max_age=max_age,
+        include=lambda name: name.startswith('tmp') and name.endswith(('.mp3', '.txt', '.zip'))
+    )
+
+
+# Singleton instance, shared so any module can pin the paths it works on
+_temp_storage = None
+
+def get_temp_storage():
+    """Get singleton instance of TempStorage"""
+    global _temp_storage
+    if _temp_storage is None:
+        _temp_storage = TempStorage()
+    return _temp_storage
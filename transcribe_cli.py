@@ -0,0 +1,207 @@
+"""Transcribe whole directories of recordings from the command line.
+
+Examples:
+    python transcribe_cli.py recordings/
+    python transcribe_cli.py recordings/ --output-dir transcripts/ --workers 8
+    python transcribe_cli.py --manifest files.txt --prompt "Speakers: Alice, Bob"
+
+Each input gets a ``<name>.txt`` transcript, next to it or at the same relative
+path under ``--output-dir``. Transcripts newer than their input are skipped, so
+an interrupted run picks up where it stopped when started again.
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+MEDIA_EXTENSIONS = {'.mp3', '.mp4', '.mpeg', '.mpga', '.m4a', '.wav', '.webm', '.mkv', '.avi', '.mov', '.ogg', '.oga', '.flac'}
+
+# Each worker process keeps its own MediaProcessorService (and API client)
+_worker_processor = None
+
+
+def _init_worker():
+    global _worker_processor
+    from transcriber import get_media_processor
+    _worker_processor = get_media_processor()
+
+
+def _transcribe_file(input_path, output_path, prompt):
+    """Runs in a worker process; returns (input path, audio seconds, characters, elapsed seconds)"""
+    start = time.time()
+    duration = _worker_processor.get_audio_duration(input_path) or 0
+    response = _worker_processor.transcribe_audio(input_path, prompt)
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    # Write to a temporary name first so an interrupted run never leaves a transcript that looks complete
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(response.text)
+    os.replace(tmp_path, output_path)
+    return input_path, duration, len(response.text), time.time() - start
+
+
+def find_inputs(paths, manifest=None, extensions=MEDIA_EXTENSIONS):
+    """List (input path, path relative to its root) for every media file to consider"""
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in extensions:
+                        full_path = os.path.join(root, name)
+                        inputs.append((full_path, os.path.relpath(full_path, path)))
+        elif os.path.isfile(path):
+            inputs.append((path, os.path.basename(path)))
+        else:
+            print(f"Warning: {path} does not exist, skipping", file=sys.stderr)
+
+    if manifest:
+        # One path per line, relative paths are relative to the manifest; '#' starts a comment
+        base_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = line.split('#', 1)[0].strip()
+                if not entry:
+                    continue
+                if os.path.isabs(entry):
+                    inputs.append((entry, os.path.basename(entry)))
+                else:
+                    inputs.append((os.path.join(base_dir, entry), os.path.normpath(entry)))
+    return inputs
+
+
+def output_path_for(input_path, relative_path, output_dir=None):
+    base_name = os.path.splitext(relative_path)[0] + '.txt'
+    if output_dir:
+        return os.path.join(output_dir, base_name)
+    return os.path.splitext(input_path)[0] + '.txt'
+
+
+def is_up_to_date(input_path, output_path):
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    except OSError:
+        return False
+
+
+def plan_jobs(inputs, output_dir=None, force=False):
+    """Split inputs into (jobs to run, number skipped); jobs are (input path, output path)"""
+    jobs = []
+    skipped = 0
+    seen_outputs = {}
+    for input_path, relative_path in inputs:
+        if not os.path.exists(input_path):
+            print(f"Warning: {input_path} does not exist, skipping", file=sys.stderr)
+            continue
+        output_path = output_path_for(input_path, relative_path, output_dir)
+        if output_path in seen_outputs:
+            # talk.mp4 and talk.m4a side by side: keep the extension in the second name
+            output_path = output_path[:-len('.txt')] + os.path.splitext(input_path)[1] + '.txt'
+        seen_outputs[output_path] = input_path
+        if not force and is_up_to_date(input_path, output_path):
+            skipped += 1
+            continue
+        jobs.append((input_path, output_path))
+    return jobs, skipped
+
+
+def format_duration(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}h {minutes:02d}m {seconds:02d}s" if hours else f"{minutes}m {seconds:02d}s"
+
+
+def run(jobs, workers, prompt=None):
+    """Transcribe jobs across a process pool; returns (completed results, failures)"""
+    results = []
+    failures = []
+    if not jobs:
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {
+            executor.submit(_transcribe_file, input_path, output_path, prompt): input_path
+            for input_path, output_path in jobs
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            input_path = futures[future]
+            try:
+                result = future.result()
+                results.append(result)
+                _, duration, _, elapsed = result
+                print(f"[{done}/{len(jobs)}] Done: {input_path} "
+                      f"({format_duration(duration)} of audio in {format_duration(elapsed)})")
+            except Exception as e:
+                failures.append((input_path, str(e)))
+                print(f"[{done}/{len(jobs)}] Failed: {input_path}: {e}", file=sys.stderr)
+    return results, failures
+
+
+def print_summary(results, failures, skipped, elapsed):
+    audio_seconds = sum(duration for _, duration, _, _ in results)
+    characters = sum(chars for _, _, chars, _ in results)
+
+    print()
+    print("Summary")
+    print(f"  Transcribed:  {len(results)}")
+    print(f"  Up to date:   {skipped}")
+    print(f"  Failed:       {len(failures)}")
+    print(f"  Wall time:    {format_duration(elapsed)}")
+    if results:
+        hours = max(elapsed, 0.001) / 3600
+        print(f"  Audio:        {format_duration(audio_seconds)} ({characters} characters)")
+        print(f"  Throughput:   {len(results) / hours:.1f} files/hour, "
+              f"{audio_seconds / max(elapsed, 0.001):.1f}x realtime")
+    for input_path, error in failures:
+        print(f"  Failed: {input_path}: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcribe directories of audio and video files")
+    parser.add_argument('paths', nargs='*', help="Media files or directories to transcribe (searched recursively)")
+    parser.add_argument('--manifest', help="Text file listing media files, one per line")
+    parser.add_argument('--output-dir', help="Write transcripts into this tree instead of next to the inputs")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('CLI_WORKERS', '4')),
+                        help="Files transcribed in parallel (default: 4)")
+    parser.add_argument('--prompt', help="Prompt text, or a path to a file containing it (default: system_prompt.txt)")
+    parser.add_argument('--force', action='store_true', help="Transcribe again even if the transcript is up to date")
+    parser.add_argument('--dry-run', action='store_true', help="Only list the files that would be transcribed")
+    args = parser.parse_args(argv)
+
+    if not args.paths and not args.manifest:
+        parser.error("give at least one path or --manifest")
+
+    prompt = args.prompt
+    if prompt and os.path.isfile(prompt):
+        with open(prompt, 'r', encoding='utf-8') as f:
+            prompt = f.read().strip()
+
+    inputs = find_inputs(args.paths, args.manifest)
+    jobs, skipped = plan_jobs(inputs, args.output_dir, args.force)
+    print(f"Found {len(inputs)} files: {len(jobs)} to transcribe, {skipped} already up to date")
+
+    if args.dry_run:
+        for input_path, output_path in jobs:
+            print(f"{input_path} -> {output_path}")
+        return 0
+
+    start = time.time()
+    try:
+        results, failures = run(jobs, max(1, args.workers), prompt)
+    except KeyboardInterrupt:
+        print("\nInterrupted; finished transcripts are kept, run the same command again to resume", file=sys.stderr)
+        return 130
+    print_summary(results, failures, skipped, time.time() - start)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,13 +3,103 @@ import tempfile
 import time
 import math
 import re
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
 from pydub import AudioSegment
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
 from dotenv import load_dotenv
 
+from media_stream import probe_duration, PCM_SAMPLE_RATE, PCM_SAMPLE_WIDTH, PCM_CHANNELS, PCM_BYTES_PER_SECOND
+from concurrency_control import get_api_limiter, is_overload_error, API_CONCURRENCY_MAX
+from cancellation import JobCancelled
+from request_hedging import get_latency_tracker, get_hedge_budget, HEDGE_REQUESTS, HEDGE_PERCENTILE, MIN_HEDGE_DELAY_SECONDS
+from repetition_detector import find_repetition_loops
+
 # Load environment variables
 load_dotenv()
 
+# Long audio is transcribed in chunks, overlapping so sentences across a boundary survive. The chunk
+# length is planned per job (see _plan_chunks) within these bounds; 20 minutes of MP3 stay under the
+# 25MB API limit. Streams of unknown length use the default length.
+CHUNK_DURATION_MS = 10 * 60 * 1000  # 10 minutes
+MIN_CHUNK_DURATION_MS = 2 * 60 * 1000
+MAX_CHUNK_DURATION_MS = 20 * 60 * 1000
+CHUNK_OVERLAP_MS = 5 * 1000  # 5 seconds
+# More, shorter chunks must be predicted to finish this much sooner to be preferred over fewer requests
+CHUNK_PLAN_TOLERANCE = 0.1
+# Chunks of one job exported and in flight at once; the shared API limiter decides how many are sent
+CHUNK_PARALLELISM = int(os.getenv('CHUNK_PARALLELISM', '8'))
+# How often a job waiting for its chunks checks whether it was cancelled
+CANCEL_POLL_SECONDS = 0.5
+# Repair pass after the main pass: failed chunks are re-sent after a backoff that doubles per attempt,
+# chunks with suspiciously little text are re-sent as two halves
+REPAIR_ATTEMPTS = 2
+REPAIR_BACKOFF_SECONDS = 15
+# A repetition loop is re-sent with this much audio around it, without the prompt and at this temperature;
+# loops covering most of a chunk re-send the whole chunk
+REPETITION_PADDING_SECONDS = 15
+REPETITION_RETRY_TEMPERATURE = 0.4
+REPETITION_WHOLE_CHUNK_FRACTION = 0.75
+
+
+class RepairReport:
+    """What repairing one job's transcription cost, for the job summary"""
+
+    def __init__(self):
+        self.requests = 0
+        self.audio_seconds = 0.0
+        self.chunks_repaired = 0
+        self.repetition_loops = 0
+        self.repetition_loops_fixed = 0
+        self._lock = threading.Lock()
+
+    def record_request(self, audio_seconds):
+        """An API request sent again to repair part of the transcription"""
+        with self._lock:
+            self.requests += 1
+            self.audio_seconds += audio_seconds
+
+    def add(self, chunks_repaired=0, repetition_loops=0, repetition_loops_fixed=0):
+        with self._lock:
+            self.chunks_repaired += chunks_repaired
+            self.repetition_loops += repetition_loops
+            self.repetition_loops_fixed += repetition_loops_fixed
+
+    def summary(self):
+        """One line describing the repairs, or None if nothing had to be repaired"""
+        if not self.requests:
+            return None
+        minutes, seconds = divmod(int(self.audio_seconds), 60)
+        text = f"{self.requests} request(s), {minutes}m {seconds}s of audio re-sent"
+        details = []
+        if self.chunks_repaired:
+            details.append(f"{self.chunks_repaired} failed or short chunk(s) repaired")
+        if self.repetition_loops:
+            details.append(f"{self.repetition_loops_fixed}/{self.repetition_loops} repetition loop(s) fixed")
+        if details:
+            text += f" ({', '.join(details)})"
+        return text
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'audio_seconds': round(self.audio_seconds, 1),
+                'chunks_repaired': self.chunks_repaired,
+                'repetition_loops': self.repetition_loops,
+                'repetition_loops_fixed': self.repetition_loops_fixed,
+            }
+
+
+class TranscriptionResponse:
+    """Response-like object for transcriptions assembled from several API calls"""
+    def __init__(self, text, repairs=None):
+        self.text = text
+        # RepairReport of the requests re-sent for this transcription
+        self.repairs = repairs or RepairReport()
+
+
 class MediaProcessorService:
     def __init__(self):
         # Get API key from environment variables
@@ -18,10 +108,20 @@ class MediaProcessorService:
             raise ValueError("OpenAI API key not found. Please set OPENAI_API_KEY in .env file.")
         
         self.client = OpenAI(api_key=api_key)
+        self.api_limiter = get_api_limiter()
+        self.latency = get_latency_tracker()
+        self.hedge_budget = get_hedge_budget()
+        # Runs the requests of hedged chunks, so the chunk's thread can watch them race; room for a
+        # primary and a duplicate per API slot, so requests don't queue behind each other here
+        self._hedge_executor = ThreadPoolExecutor(max_workers=API_CONCURRENCY_MAX * 2, thread_name_prefix='hedge')
         self.supported_formats = ['.mp3', '.mp4', '.mpeg', '.mpga', '.m4a', '.wav', '.webm', '.mkv', '.avi', '.mov']
         
     def get_audio_duration(self, file_path):
-        """Get the duration of an audio file using pydub"""
+        """Get the duration of an audio file, from its header with ffprobe or by decoding it with pydub"""
+        duration = probe_duration(file_path)
+        if duration:
+            return duration
+        
         try:
             # Identify file extension
             _, file_ext = os.path.splitext(file_path)
@@ -298,20 +398,494 @@ class MediaProcessorService:
         
         return best_match
 
-    def transcribe_audio(self, audio_file, prompt=None):
-        """Transcribe audio from a file, with support for large files via chunking"""
-        max_api_size_mb = 25
-        file_size_mb = os.path.getsize(audio_file) / (1024 * 1024)
-        
-        print(f"Transcribing audio file: {audio_file} (Size: {file_size_mb:.2f}MB)")
-        
-        # Load system prompt for consistency instructions if no prompt provided
+    def _load_prompt(self, prompt):
+        """Load system prompt for consistency instructions if no prompt provided"""
         if prompt is None:
             system_prompt_path = "system_prompt.txt"
             if os.path.exists(system_prompt_path):
                 with open(system_prompt_path, "r") as f:
                     prompt = f.read().strip()
                 print(f"Using system prompt from {system_prompt_path}")
+        return prompt
+
+    @contextmanager
+    def _job_client(self, cancel_token):
+        """API client for one job; cancelling the job closes its connections, aborting requests in flight"""
+        if cancel_token is None:
+            yield self.client
+            return
+        cancel_token.raise_if_cancelled()
+        http_client = DefaultHttpxClient()
+        unregister = cancel_token.on_cancel(http_client.close)
+        try:
+            yield self.client.with_options(http_client=http_client)
+        finally:
+            unregister()
+            http_client.close()
+
+    def _create_transcription(self, f, prompt, audio_seconds, client=None, cancel_token=None, on_start=None,
+                              **options):
+        """One transcription API request, within the adaptive limit on requests in flight.
+
+        ``on_start`` is called once the request has its slot and is being sent.
+        Extra ``options`` (temperature, response_format) go to the API as they are.
+        """
+        try:
+            with self.api_limiter.slot():
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                if on_start:
+                    on_start()
+                started = time.monotonic()
+                response = (client or self.client).audio.transcriptions.create(
+                    model="whisper-1",
+                    file=f,
+                    prompt=prompt,
+                    **options
+                )
+                self.latency.record(audio_seconds, time.monotonic() - started)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            if cancel_token and cancel_token.is_cancelled:
+                # The request was aborted by closing its connection
+                raise JobCancelled() from e
+            # 429s and timeouts mean we send too much at once
+            overload = is_overload_error(e)
+            if overload:
+                self.api_limiter.record_failure(overload)
+            raise
+        self.api_limiter.record_success(audio_seconds)
+        return response
+
+    def _request_chunk(self, chunk_file, prompt, audio_seconds, client=None, cancel_token=None):
+        """Send one chunk request; with hedging enabled a straggler gets raced by a duplicate.
+
+        Once the request has taken longer than HEDGE_PERCENTILE of recent
+        requests for the same length of audio, and the hedge budget and the API
+        limit allow it, the same chunk is sent again and whichever response
+        arrives first wins. The other request is left to finish on its own;
+        the hedge reads from a handle opened here, so it still works once the
+        caller has removed the chunk file. The wait is timed from when the
+        request got its API slot, so time spent queueing for one doesn't make
+        it look like a straggler.
+        """
+        def send(started=None, f=None):
+            with f or open(chunk_file, "rb") as handle:
+                return self._create_transcription(handle, prompt, audio_seconds, client, cancel_token,
+                                                  on_start=started.set if started else None)
+
+        def send_hedge(f):
+            # The primary may have finished while the hedge waited for a worker
+            if primary.done() and primary.exception() is None:
+                f.close()
+                return primary.result()
+            return send(f=f)
+
+        self.hedge_budget.earn(audio_seconds)
+        threshold = self.latency.percentile(HEDGE_PERCENTILE, audio_seconds) if HEDGE_REQUESTS else None
+        if threshold is None:
+            return send()
+
+        started = threading.Event()
+        primary = self._hedge_executor.submit(send, started)
+        while not started.wait(CANCEL_POLL_SECONDS):
+            if primary.done():
+                return primary.result()
+        done, _ = wait([primary], timeout=max(threshold, MIN_HEDGE_DELAY_SECONDS))
+        if done or self.api_limiter.in_flight >= self.api_limiter.limit or not self.hedge_budget.try_spend(audio_seconds):
+            return primary.result()
+
+        print(f"Chunk request slower than p{HEDGE_PERCENTILE:g} ({threshold:.1f}s), sending a hedged duplicate")
+        hedge = self._hedge_executor.submit(send_hedge, open(chunk_file, "rb"))
+        racing = [primary, hedge]
+        error = None
+        while racing:
+            done, _ = wait(racing, return_when=FIRST_COMPLETED)
+            # The primary first, so a hedge that skipped itself isn't counted as a win
+            for future in sorted(done, key=lambda future: future is hedge):
+                racing.remove(future)
+                if future.exception() is None:
+                    if future is hedge:
+                        self.hedge_budget.record_win()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @staticmethod
+    def _is_suspiciously_short(chunk_text, chunk_duration):
+        # Rough estimate: 5 chars per second minimum, only for chunks > 10s
+        return chunk_duration > 10 and len(chunk_text) < chunk_duration * 5
+
+    def _transcribe_chunk(self, chunk_file, prompt, index, total_chunks, chunk_duration, max_retries=3,
+                          client=None, cancel_token=None, keep_for_repair=False, report=None):
+        """Transcribe one chunk file with retries; returns (text or None if every attempt failed, suspicious).
+
+        ``total_chunks`` may be None when the length of the audio isn't known yet.
+        Repetition loops in the text are fixed right away, recorded in ``report``.
+        The chunk file is removed afterwards, unless ``keep_for_repair`` is set
+        and the chunk failed or came back suspiciously short. Raises
+        JobCancelled instead of retrying once ``cancel_token`` is cancelled.
+        """
+        keep_file = False
+        # Add context about which part of the audio this is
+        chunk_prompt = prompt
+        if prompt:
+            if total_chunks:
+                position_info = f"This is part {index+1} of {total_chunks} of the full audio."
+            else:
+                position_info = f"This is part {index+1} of the full audio."
+            chunk_prompt = f"{prompt}\n\n{position_info}"
+        
+        try:
+            for attempts in range(1, max_retries + 1):
+                try:
+                    print(f"Attempt {attempts}/{max_retries} for chunk {index+1}")
+                    chunk_response = self._request_chunk(chunk_file, chunk_prompt, chunk_duration, client, cancel_token)
+                    chunk_text = chunk_response.text
+                    
+                    # Validate the transcription - check if it's suspiciously short
+                    suspicious = self._is_suspiciously_short(chunk_text, chunk_duration)
+                    if suspicious:
+                        print(f"Warning: Chunk {index+1} transcription suspiciously short: {len(chunk_text)} chars for {chunk_duration:.1f}s audio")
+                    else:
+                        print(f"Chunk {index+1} transcription successful: {len(chunk_text)} chars")
+                        chunk_text = self._fix_repetition_loops(
+                            chunk_text, lambda: AudioSegment.from_file(chunk_file), chunk_duration,
+                            f"chunk {index+1}", client, cancel_token, report)
+                    keep_file = keep_for_repair and suspicious
+                    return chunk_text, suspicious
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    print(f"Error transcribing chunk {index+1} (attempt {attempts}): {e}")
+            
+            print(f"Failed to transcribe chunk {index+1} after {max_retries} attempts")
+            keep_file = keep_for_repair
+            return None, False
+        finally:
+            # Clean up the temporary file; the repair pass removes the ones it keeps
+            if not keep_file and os.path.exists(chunk_file):
+                os.remove(chunk_file)
+
+    def _fix_repetition_loops(self, text, load_audio, duration, label, client=None, cancel_token=None, report=None):
+        """Re-transcribe the audio under each repetition loop in ``text`` and splice the result in.
+
+        ``load_audio`` returns the AudioSegment ``text`` was transcribed from,
+        and is only called if there is a loop. Where in the audio a loop is
+        comes from where it is in the text, padded by REPETITION_PADDING_SECONDS.
+        The window is sent without the prompt and at a higher temperature, which
+        usually breaks the loop; a result that loops again is discarded. The
+        padding is dropped again by the timestamps of the returned segments, and
+        what is left replaces the loop. When the windows would cover most of the
+        audio it is all sent again, and the result replaces the whole text.
+        """
+        loops = find_repetition_loops(text)
+        if not loops:
+            return text
+        report = report or RepairReport()
+        report.add(repetition_loops=len(loops))
+        windows = []  # (loop, window start, window end, loop start, loop end) in seconds
+        for loop in loops:
+            loop_start_s = duration * loop.start_char / len(text)
+            loop_end_s = duration * loop.end_char / len(text)
+            start_s = max(0.0, loop_start_s - REPETITION_PADDING_SECONDS)
+            end_s = min(duration, loop_end_s + REPETITION_PADDING_SECONDS)
+            windows.append((loop, start_s, end_s, loop_start_s, loop_end_s))
+        if sum(end_s - start_s for _, start_s, end_s, _, _ in windows) > duration * REPETITION_WHOLE_CHUNK_FRACTION:
+            windows = [(None, 0.0, duration, 0.0, duration)]
+
+        audio = load_audio()
+        # From the last loop back, so the character offsets of earlier ones stay valid
+        for loop, start_s, end_s, loop_start_s, loop_end_s in reversed(windows):
+            if loop:
+                print(f"Repetition loop in {label} ({loop.density:.0%} repeated, \"{loop.phrase}\"), "
+                      f"re-sending {start_s:.1f}s to {end_s:.1f}s")
+            else:
+                print(f"Repetition loops cover most of {label}, re-sending all of it")
+            window_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
+            window_file.close()
+            try:
+                audio[int(start_s * 1000):int(end_s * 1000)].export(window_file.name, format="mp3")
+                report.record_request(end_s - start_s)
+                with open(window_file.name, "rb") as f:
+                    response = self._create_transcription(f, None, end_s - start_s, client, cancel_token,
+                                                          temperature=REPETITION_RETRY_TEMPERATURE,
+                                                          response_format="verbose_json")
+            except JobCancelled:
+                raise
+            except Exception as e:
+                print(f"Warning: Could not re-transcribe the repetition loop in {label}: {e}")
+                continue
+            finally:
+                if os.path.exists(window_file.name):
+                    os.remove(window_file.name)
+            if find_repetition_loops(response.text):
+                print(f"Warning: Re-transcribed window of {label} still repeats itself, keeping the original")
+                continue
+            if not loop:
+                report.add(repetition_loops_fixed=len(loops))
+                return response.text.strip()
+            window_text = self._segments_between(response, loop_start_s - start_s, loop_end_s - start_s)
+            text = ' '.join(part.strip() for part in (text[:loop.start_char], window_text, text[loop.end_char:])
+                            if part.strip())
+            report.add(repetition_loops_fixed=1)
+        return text
+
+    @staticmethod
+    def _segments_between(response, start_s, end_s):
+        """Text of the segments of a verbose_json response centred between ``start_s`` and ``end_s``"""
+        segments = getattr(response, 'segments', None)
+        if not segments:
+            return response.text
+        texts = []
+        for segment in segments:
+            field = segment.get if isinstance(segment, dict) else lambda name: getattr(segment, name)
+            middle = (field('start') + field('end')) / 2
+            if start_s <= middle <= end_s:
+                texts.append(field('text').strip())
+        return ' '.join(texts)
+
+    def _retry_failed_chunk(self, repair, prompt, client, cancel_token, report):
+        """Re-send a chunk that failed in the main pass, backing off between attempts; returns (text, suspicious)"""
+        for attempt in range(REPAIR_ATTEMPTS):
+            delay = REPAIR_BACKOFF_SECONDS * 2 ** attempt
+            print(f"Repair: retrying chunk {repair['index']+1} in {delay}s")
+            if cancel_token:
+                if cancel_token.wait(delay):
+                    raise JobCancelled()
+            else:
+                time.sleep(delay)
+            report.record_request(repair['chunk_duration'])
+            chunk_text, suspicious = self._transcribe_chunk(
+                repair['chunk_file'], prompt, repair['index'], repair['total_chunks'], repair['chunk_duration'],
+                max_retries=1, client=client, cancel_token=cancel_token, keep_for_repair=True, report=report)
+            if chunk_text is not None:
+                return chunk_text, suspicious
+        return None, False
+
+    def _split_and_retry_chunk(self, repair, prompt, client, cancel_token, report):
+        """Re-send a chunk as two overlapping halves; returns their merged text, or None if a half failed"""
+        audio = AudioSegment.from_file(repair['chunk_file'])
+        middle = len(audio) // 2
+        halves = [(0, min(len(audio), middle + CHUNK_OVERLAP_MS // 2)),
+                  (max(0, middle - CHUNK_OVERLAP_MS // 2), len(audio))]
+        texts = []
+        for start_ms, end_ms in halves:
+            half_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
+            half_file.close()
+            audio[start_ms:end_ms].export(half_file.name, format="mp3")
+            print(f"Repair: re-sending {repair['start_time'] + start_ms/1000:.1f}s to "
+                  f"{repair['start_time'] + end_ms/1000:.1f}s of chunk {repair['index']+1}")
+            report.record_request((end_ms - start_ms) / 1000)
+            half_text, _ = self._transcribe_chunk(half_file.name, prompt, repair['index'], repair['total_chunks'],
+                                                  (end_ms - start_ms) / 1000, max_retries=1,
+                                                  client=client, cancel_token=cancel_token, report=report)
+            if half_text is None:
+                return None
+            texts.append(half_text)
+        return self.combine_transcription_segments(texts)
+
+    def _repair_chunk(self, repair, prompt, client, cancel_token, report):
+        """Repair one chunk kept from the main pass; returns the new text, or None to keep what it had"""
+        chunk_text = repair['text']
+        try:
+            if chunk_text is None:
+                chunk_text, suspicious = self._retry_failed_chunk(repair, prompt, client, cancel_token, report)
+                if chunk_text is None or not suspicious:
+                    return chunk_text
+            if repair['chunk_duration'] <= 20:
+                return chunk_text  # too short to split any further
+            halves_text = self._split_and_retry_chunk(repair, prompt, client, cancel_token, report)
+            if halves_text is not None and len(halves_text) > len(chunk_text):
+                print(f"Repair: chunk {repair['index']+1} went from {len(chunk_text)} to {len(halves_text)} chars")
+                return halves_text
+            return chunk_text
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(f"Warning: Repair of chunk {repair['index']+1} failed: {e}")
+            return chunk_text
+        finally:
+            if os.path.exists(repair['chunk_file']):
+                os.remove(repair['chunk_file'])
+
+    def _repair_chunks(self, repairs, transcription_segments, failed_chunks, prompt, client, cancel_token, parallelism,
+                       report):
+        """Deferred repair pass: re-send only the chunks that failed or came back suspiciously short.
+
+        Repaired text replaces the chunk's segment (or failure placeholder) in
+        place, before the segments are merged; chunks still failing keep their
+        placeholder and stay in ``failed_chunks``.
+        """
+        print(f"Repair pass for {len(repairs)} chunk(s): {[repair['index'] + 1 for repair in repairs]}")
+        executor = ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(repairs))))
+        try:
+            futures = [(executor.submit(self._repair_chunk, repair, prompt, client, cancel_token, report), repair)
+                       for repair in repairs]
+            for future, repair in futures:
+                chunk_text = self._wait_for_chunk(future, cancel_token)
+                if chunk_text is None or chunk_text == repair['text']:
+                    continue
+                transcription_segments[repair['position']] = chunk_text
+                report.add(chunks_repaired=1)
+                if repair['index'] + 1 in failed_chunks:
+                    failed_chunks.remove(repair['index'] + 1)
+        finally:
+            cancelled = bool(cancel_token and cancel_token.is_cancelled)
+            executor.shutdown(wait=not cancelled, cancel_futures=cancelled)
+
+    @staticmethod
+    def _wait_for_chunk(future, cancel_token):
+        """Result of a chunk future, raising JobCancelled as soon as the job is cancelled"""
+        while True:
+            try:
+                return future.result(timeout=CANCEL_POLL_SECONDS)
+            except FutureTimeoutError:
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+
+    def _combine_chunk_transcriptions(self, transcription_segments, failed_chunks, report=None):
+        """Merge per-chunk transcriptions into one response, failing if no chunk succeeded"""
+        # Check if we have any successful transcriptions
+        if not any(seg for seg in transcription_segments if not seg.startswith("[Transcription failed")):
+            error_msg = f"All {len(transcription_segments)} chunks failed to transcribe. Audio may be corrupted or unsupported."
+            print(error_msg)
+            raise ValueError(error_msg)
+        
+        # Combine the transcription segments
+        combined_text = self.combine_transcription_segments(transcription_segments)
+        
+        # Log the final transcription length and failed chunks
+        print(f"Final transcription complete: {len(combined_text)} characters")
+        if failed_chunks:
+            print(f"Warning: {len(failed_chunks)} chunks failed to transcribe: {failed_chunks}")
+        if report and report.summary():
+            print(f"Repairs: {report.summary()}")
+        
+        return TranscriptionResponse(combined_text, report)
+
+    def _plan_chunks(self, total_ms):
+        """Pick (number of chunks, chunk length in ms, parallelism) for ``total_ms`` of audio.
+
+        Predicts how long the job takes for every chunk count that keeps chunks
+        between MIN_CHUNK_DURATION_MS and MAX_CHUNK_DURATION_MS: the chunks are
+        sent in rounds of as many as there are free API slots, and each round
+        takes as long as one request, from the latency model learned from past
+        requests (fixed overhead plus time per second of audio). More chunks
+        only win if they finish CHUNK_PLAN_TOLERANCE sooner, so with few free
+        slots or a high per-request overhead the job sends fewer, larger chunks.
+        """
+        free_slots = self.api_limiter.limit - self.api_limiter.in_flight
+        slots = max(1, min(free_slots, CHUNK_PARALLELISM))
+        overhead, rate = self.latency.model()
+        fewest = max(1, math.ceil(total_ms / MAX_CHUNK_DURATION_MS))
+        most = max(fewest, total_ms // MIN_CHUNK_DURATION_MS)
+
+        best, best_time = None, None
+        for count in range(fewest, most + 1):
+            chunk_ms = math.ceil(total_ms / count) + (CHUNK_OVERLAP_MS if count > 1 else 0)
+            predicted = math.ceil(count / slots) * (overhead + rate * chunk_ms / 1000)
+            if best_time is None or predicted < best_time * (1 - CHUNK_PLAN_TOLERANCE):
+                best, best_time = (count, chunk_ms), predicted
+        count, chunk_ms = best
+        print(f"Planned {count} chunk(s) of {chunk_ms/1000:.0f}s for {total_ms/1000:.0f}s of audio "
+              f"({free_slots} free API slot(s), predicted {best_time:.0f}s)")
+        return count, chunk_ms, min(count, slots)
+
+    def _transcribe_chunks(self, chunks, prompt, client=None, cancel_token=None, parallelism=CHUNK_PARALLELISM):
+        """Transcribe chunks in parallel; returns (segments in order, failed chunk numbers, RepairReport).
+
+        ``chunks`` yields (chunk_file, index, total_chunks, chunk_duration,
+        start_time, end_time) and is consumed only while fewer than
+        ``parallelism`` chunks are in flight, so exports keep pace with the API.
+        Chunks that failed or came back suspiciously short are repaired in a
+        second pass once every chunk has been sent, see ``_repair_chunks``.
+        Once ``cancel_token`` is cancelled this raises JobCancelled right away,
+        removing the chunk files that haven't been sent yet.
+        """
+        transcription_segments = []
+        failed_chunks = []
+        pending = []  # (future, chunk_file, index, total_chunks, chunk_duration, start_time, end_time) in chunk order
+        repairs = []  # chunks kept for the repair pass, with their files
+        report = RepairReport()
+
+        def collect(future, chunk_file, index, total_chunks, chunk_duration, start_time, end_time):
+            chunk_text, suspicious = self._wait_for_chunk(future, cancel_token)
+            if chunk_text is None or suspicious:
+                repairs.append({
+                    'position': len(transcription_segments), 'text': chunk_text, 'chunk_file': chunk_file,
+                    'index': index, 'total_chunks': total_chunks, 'chunk_duration': chunk_duration,
+                    'start_time': start_time,
+                })
+            # If chunk failed after all retries, add a placeholder
+            if chunk_text is None:
+                failed_chunks.append(index + 1)
+                chunk_text = f"[Transcription failed for audio from {start_time:.1f}s to {end_time:.1f}s]"
+            transcription_segments.append(chunk_text)
+
+        executor = ThreadPoolExecutor(max_workers=parallelism)
+        cancelled = False
+        try:
+            for chunk_file, index, total_chunks, chunk_duration, start_time, end_time in chunks:
+                future = executor.submit(self._transcribe_chunk, chunk_file, prompt, index, total_chunks,
+                                         chunk_duration, client=client, cancel_token=cancel_token,
+                                         keep_for_repair=True, report=report)
+                pending.append((future, chunk_file, index, total_chunks, chunk_duration, start_time, end_time))
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                if len(pending) >= parallelism:
+                    collect(*pending.pop(0))
+            while pending:
+                collect(*pending.pop(0))
+            if repairs:
+                self._repair_chunks(repairs, transcription_segments, failed_chunks, prompt, client, cancel_token,
+                                    parallelism, report)
+        except Exception as e:
+            # Chunks that haven't started are dropped, whatever stopped the job
+            for future, *_ in pending:
+                future.cancel()
+            if not cancel_token or not cancel_token.is_cancelled:
+                raise
+            cancelled = True
+            if isinstance(e, JobCancelled):
+                raise
+            raise JobCancelled() from e  # e.g. the decoder was killed while reading
+        finally:
+            # Don't wait for requests that are being aborted
+            executor.shutdown(wait=not cancelled)
+            # Chunks never collected (the job failed or was cancelled) may still have their files, kept for
+            # the repair pass or never sent; remove them once their requests are done
+            for future, chunk_file, *_ in pending:
+                future.add_done_callback(lambda _, chunk_file=chunk_file: self._remove_chunk_file(chunk_file))
+            for repair in repairs:
+                if os.path.exists(repair['chunk_file']):
+                    os.remove(repair['chunk_file'])
+        return transcription_segments, failed_chunks, report
+
+    @staticmethod
+    def _remove_chunk_file(chunk_file):
+        try:
+            os.remove(chunk_file)
+        except FileNotFoundError:
+            pass
+
+    def transcribe_audio(self, audio_file, prompt=None, cancel_token=None):
+        """Transcribe audio from a file, with support for large files via chunking.
+
+        Cancelling ``cancel_token`` aborts the requests in flight, removes the
+        chunk files and raises ``cancellation.JobCancelled``.
+        """
+        with self._job_client(cancel_token) as client:
+            return self._transcribe_audio(audio_file, prompt, client, cancel_token)
+
+    def _transcribe_audio(self, audio_file, prompt, client, cancel_token):
+        max_api_size_mb = 25
+        file_size_mb = os.path.getsize(audio_file) / (1024 * 1024)
+        
+        print(f"Transcribing audio file: {audio_file} (Size: {file_size_mb:.2f}MB)")
+        
+        prompt = self._load_prompt(prompt)
         
         # Load the audio data
         try:
@@ -321,117 +895,48 @@ class MediaProcessorService:
             error_msg = f"Error loading audio file: {e}"
             print(error_msg)
             raise ValueError(error_msg)
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
         
-        # Initialize lists to store transcription segments and failed chunks
-        transcription_segments = []
-        failed_chunks = []
-        
-        # Check if we need to split the audio (over size limit or very long)
-        if file_size_mb > max_api_size_mb or len(audio) > 30 * 60 * 1000:  # > 30 minutes
-            print(f"Audio exceeds size limit for single API call. Splitting into chunks.")
+        # Split the audio when it's over the size limit, or when parallel chunks are predicted to finish sooner
+        planned_chunks, chunk_duration_ms, parallelism = self._plan_chunks(len(audio))
+        if file_size_mb > max_api_size_mb or planned_chunks > 1:
+            print(f"Splitting audio into chunks ({file_size_mb:.2f}MB, {len(audio)/1000:.0f}s).")
             
             # Add 5-second overlap between chunks to handle sentences that span chunk boundaries
-            chunk_duration_ms = 10 * 60 * 1000  # 10 minutes in milliseconds
-            overlap_ms = 5 * 1000  # 5 seconds overlap
+            overlap_ms = CHUNK_OVERLAP_MS
             
             total_audio_length = len(audio)
-            effective_chunk_length = chunk_duration_ms - overlap_ms
+            effective_chunk_length = chunk_duration_ms - overlap_ms if planned_chunks > 1 else chunk_duration_ms
             total_chunks = math.ceil(total_audio_length / effective_chunk_length)
             
             print(f"Splitting into {total_chunks} chunks with {overlap_ms/1000}s overlap")
             
-            # Process each chunk
-            for i in range(total_chunks):
-                start_time = i * effective_chunk_length
-                end_time = min(start_time + chunk_duration_ms, total_audio_length)
-                
-                # Special handling for the last chunk to ensure we reach the end
-                if i == total_chunks - 1:
-                    end_time = total_audio_length
-                
-                # Ensure we have the minimum overlap with the next chunk
-                if i < total_chunks - 1 and end_time > total_audio_length - overlap_ms:
-                    end_time = total_audio_length
-                
-                chunk_duration = (end_time - start_time) / 1000  # in seconds
-                print(f"Processing chunk {i+1}/{total_chunks}: {start_time/1000:.1f}s to {end_time/1000:.1f}s (duration: {chunk_duration:.1f}s)")
-                
-                # Extract the chunk
-                audio_chunk = audio[start_time:end_time]
-                
-                # Save the chunk temporarily
-                chunk_file = f"temp_chunk_{i}.mp3"
-                audio_chunk.export(chunk_file, format="mp3")
-                
-                # Try to transcribe the chunk (with retries)
-                success = False
-                max_retries = 3
-                attempts = 0
-                chunk_text = ""
-                
-                while not success and attempts < max_retries:
-                    attempts += 1
-                    try:
-                        # Add context about which part of the audio this is
-                        chunk_prompt = prompt
-                        if prompt:
-                            position_info = f"This is part {i+1} of {total_chunks} of the full audio."
-                            chunk_prompt = f"{prompt}\n\n{position_info}"
-                        
-                        print(f"Attempt {attempts}/{max_retries} for chunk {i+1}")
-                        chunk_response = self.client.audio.transcriptions.create(
-                            model="whisper-1",
-                            file=open(chunk_file, "rb"),
-                            prompt=chunk_prompt
-                        )
-                        chunk_text = chunk_response.text
-                        
-                        # Validate the transcription - check if it's suspiciously short
-                        expected_min_chars = chunk_duration * 5  # Rough estimate: 5 chars per second minimum
-                        if len(chunk_text) < expected_min_chars and chunk_duration > 10:  # Only warn for chunks > 10s
-                            print(f"Warning: Chunk {i+1} transcription suspiciously short: {len(chunk_text)} chars for {chunk_duration:.1f}s audio")
-                        else:
-                            print(f"Chunk {i+1} transcription successful: {len(chunk_text)} chars")
-                        
-                        # Store the transcription
-                        transcription_segments.append(chunk_text)
-                        success = True
-                        
-                    except Exception as e:
-                        print(f"Error transcribing chunk {i+1} (attempt {attempts}): {e}")
-                        if attempts >= max_retries:
-                            print(f"Failed to transcribe chunk {i+1} after {max_retries} attempts")
-                            failed_chunks.append(i+1)
+            def export_chunks():
+                for i in range(total_chunks):
+                    start_time = i * effective_chunk_length
+                    end_time = min(start_time + chunk_duration_ms, total_audio_length)
                     
-                    finally:
-                        # Clean up the temporary file
-                        if os.path.exists(chunk_file):
-                            os.remove(chunk_file)
-                
-                # If chunk failed after all retries, add an empty segment or placeholder
-                if not success:
-                    transcription_segments.append(f"[Transcription failed for audio from {start_time/1000:.1f}s to {end_time/1000:.1f}s]")
-            
-            # Check if we have any successful transcriptions
-            if not any(seg for seg in transcription_segments if not seg.startswith("[Transcription failed")):
-                error_msg = f"All {total_chunks} chunks failed to transcribe. Audio may be corrupted or unsupported."
-                print(error_msg)
-                raise ValueError(error_msg)
-            
-            # Combine the transcription segments
-            combined_text = self.combine_transcription_segments(transcription_segments)
-            
-            # Log the final transcription length and failed chunks
-            print(f"Final transcription complete: {len(combined_text)} characters")
-            if failed_chunks:
-                print(f"Warning: {len(failed_chunks)} chunks failed to transcribe: {failed_chunks}")
-            
-            # Create a response-like object
-            class TranscriptionResponse:
-                def __init__(self, text):
-                    self.text = text
+                    # Special handling for the last chunk to ensure we reach the end
+                    if i == total_chunks - 1:
+                        end_time = total_audio_length
+                    
+                    # Ensure we have the minimum overlap with the next chunk
+                    if i < total_chunks - 1 and end_time > total_audio_length - overlap_ms:
+                        end_time = total_audio_length
+                    
+                    chunk_duration = (end_time - start_time) / 1000  # in seconds
+                    print(f"Processing chunk {i+1}/{total_chunks}: {start_time/1000:.1f}s to {end_time/1000:.1f}s (duration: {chunk_duration:.1f}s)")
+                    
+                    # Save the chunk temporarily; its own name, as other jobs export chunks at the same time
+                    chunk_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
+                    chunk_file.close()
+                    audio[start_time:end_time].export(chunk_file.name, format="mp3")
+                    yield chunk_file.name, i, total_chunks, chunk_duration, start_time / 1000, end_time / 1000
             
-            return TranscriptionResponse(combined_text)
+            transcription_segments, failed_chunks, report = self._transcribe_chunks(export_chunks(), prompt, client,
+                                                                                    cancel_token, parallelism)
+            return self._combine_chunk_transcriptions(transcription_segments, failed_chunks, report)
         
         else:
             # For smaller files, check if we need to extract audio first
@@ -456,38 +961,125 @@ class MediaProcessorService:
                     print(f"Audio extracted to temporary file: {temp_audio_file.name}")
                     
                     # Transcribe the extracted audio
-                    response = self.client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=open(temp_audio_file.name, "rb"),
-                        prompt=prompt
-                    )
+                    response = self._create_transcription(open(temp_audio_file.name, "rb"), prompt, len(audio) / 1000,
+                                                          client, cancel_token)
                     print(f"Transcription complete: {len(response.text)} characters")
                     
                     # Clean up temp file
                     os.unlink(temp_audio_file.name)
-                    return response
+                    return self._single_call_response(response, audio, client, cancel_token)
                 except Exception as e:
                     # Clean up temp file in case of error
                     if os.path.exists(temp_audio_file.name):
                         os.unlink(temp_audio_file.name)
+                    if isinstance(e, JobCancelled):
+                        raise
                     error_msg = f"Error during transcription: {e}"
                     print(error_msg)
                     raise ValueError(error_msg)
             else:
                 # File is already in a supported format, send directly
                 try:
-                    response = self.client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=open(audio_file, "rb"),
-                        prompt=prompt
-                    )
+                    response = self._create_transcription(open(audio_file, "rb"), prompt, len(audio) / 1000,
+                                                          client, cancel_token)
                     print(f"Transcription complete: {len(response.text)} characters")
-                    return response
+                    return self._single_call_response(response, audio, client, cancel_token)
+                except JobCancelled:
+                    raise
                 except Exception as e:
                     error_msg = f"Error during transcription: {e}"
                     print(error_msg)
                     raise ValueError(error_msg)
 
+    def _single_call_response(self, response, audio, client, cancel_token):
+        """Response of a file transcribed in one call, with its repetition loops fixed"""
+        report = RepairReport()
+        text = self._fix_repetition_loops(response.text, lambda: audio, len(audio) / 1000, "the transcription",
+                                          client, cancel_token, report)
+        if report.summary():
+            print(f"Repairs: {report.summary()}")
+        return TranscriptionResponse(text, report)
+
+    def transcribe_pcm_stream(self, pcm_stream, prompt=None, cancel_token=None):
+        """Transcribe raw PCM as it is decoded, so chunks are sent while the media is still downloading.
+
+        ``pcm_stream`` is a ``media_stream.PcmStream``. Chunks overlap like in
+        ``transcribe_audio``; their length is planned the same way once the
+        downloader reports the duration, and is CHUNK_DURATION_MS until then.
+        Each chunk is transcribed as soon as enough audio has arrived, next to
+        the chunks still in flight.
+        Returns (response, duration_seconds). Cancelling ``cancel_token`` closes
+        the stream and aborts the requests in flight, see ``transcribe_audio``.
+        """
+        prompt = self._load_prompt(prompt)
+        
+        bytes_per_ms = PCM_BYTES_PER_SECOND // 1000
+        overlap_bytes = CHUNK_OVERLAP_MS * bytes_per_ms
+        
+        def export_chunks():
+            chunk_duration_ms = CHUNK_DURATION_MS
+            planned = False
+            tail = b''
+            start_byte = 0
+            i = 0
+            while True:
+                if not planned and pcm_stream.expected_duration:
+                    count, chunk_duration_ms, _ = self._plan_chunks(int(pcm_stream.expected_duration * 1000))
+                    if count == 1:
+                        # The reported duration may be a bit short; don't send the last seconds on their own
+                        chunk_duration_ms = MAX_CHUNK_DURATION_MS
+                    planned = True
+                wanted = chunk_duration_ms * bytes_per_ms - len(tail)
+                data = pcm_stream.read(wanted)
+                if not data and i > 0:
+                    break
+                
+                pcm = tail + data
+                if not pcm:
+                    raise ValueError("No audio could be decoded from the media")
+                
+                # The downloader may report the full duration once it has started
+                total_chunks = None
+                if pcm_stream.expected_duration:
+                    total_chunks = max(i + 1, math.ceil(pcm_stream.expected_duration * 1000 / (chunk_duration_ms - CHUNK_OVERLAP_MS)))
+                
+                start_time = start_byte / PCM_BYTES_PER_SECOND
+                chunk_duration = len(pcm) / PCM_BYTES_PER_SECOND
+                end_time = start_time + chunk_duration
+                print(f"Processing streamed chunk {i+1}: {start_time:.1f}s to {end_time:.1f}s (duration: {chunk_duration:.1f}s)")
+                
+                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
+                temp_file.close()
+                AudioSegment(
+                    data=pcm,
+                    sample_width=PCM_SAMPLE_WIDTH,
+                    frame_rate=PCM_SAMPLE_RATE,
+                    channels=PCM_CHANNELS
+                ).export(temp_file.name, format="mp3")
+                yield temp_file.name, i, total_chunks, chunk_duration, start_time, end_time
+                
+                if len(data) < wanted:
+                    break  # end of audio
+                
+                # The next chunk starts with the last seconds of this one
+                tail = pcm[-overlap_bytes:]
+                start_byte += len(pcm) - len(tail)
+                i += 1
+        
+        # Chunks are sent while later ones are still being decoded
+        with self._job_client(cancel_token) as client:
+            unregister = cancel_token.on_cancel(pcm_stream.close) if cancel_token else None
+            try:
+                transcription_segments, failed_chunks, report = self._transcribe_chunks(export_chunks(), prompt,
+                                                                                        client, cancel_token)
+            finally:
+                if unregister:
+                    unregister()
+        
+        duration = pcm_stream.position / PCM_BYTES_PER_SECOND
+        print(f"Streamed {duration:.1f}s of audio in {len(transcription_segments)} chunks")
+        return self._combine_chunk_transcriptions(transcription_segments, failed_chunks, report), duration
+
     def cleanup_temp_files(self, file_path):
         """Clean up temporary files and directories"""
         try:
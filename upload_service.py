@@ -0,0 +1,443 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import hmac
+import secrets
+import tempfile
+import threading
+import errno
+
+# Size of each uploaded part. Parts are also the unit of hashing, so the
+# content hash of a file only depends on its bytes and this constant.
+UPLOAD_PART_SIZE = 8 * 1024 * 1024  # 8MB
+STREAM_BUFFER_SIZE = 1024 * 1024  # 1MB reads from the request body
+# Proof of possession: bytes of the file a client must hash, and how long it has to answer
+PROOF_RANGE_SIZE = 1024 * 1024  # 1MB
+PROOF_CHALLENGE_SECONDS = 600
+
+
+class UploadError(Exception):
+    """Raised when an upload request is invalid; carries an HTTP status code"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ResumableUploadService:
+    """Resumable, chunked uploads: create a session, PUT byte ranges, finalize.
+
+    Every session lives in its own directory under ``<base_dir>/.uploads`` with a
+    preallocated data file and a ``session.json`` describing which parts have
+    arrived. Parts may arrive in any order and in parallel; each one is written
+    at its offset and hashed while it streams in, so finalizing never re-reads
+    the file.
+    """
+
+    def __init__(self, base_dir='temp_resources', part_size=UPLOAD_PART_SIZE):
+        self.base_dir = base_dir
+        self.sessions_dir = os.path.join(base_dir, '.uploads')
+        self.index_path = os.path.join(self.sessions_dir, 'index.json')
+        self.part_size = part_size
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._index_lock = threading.Lock()
+        os.makedirs(self.sessions_dir, exist_ok=True)
+
+    @staticmethod
+    def compute_content_hash(part_hashes):
+        """Combine ordered per-part SHA-256 digests into the file's content hash"""
+        combined = hashlib.sha256()
+        for part_hash in part_hashes:
+            combined.update(bytes.fromhex(part_hash))
+        return combined.hexdigest()
+
+    def _session_lock(self, upload_id):
+        with self._locks_guard:
+            if upload_id not in self._locks:
+                self._locks[upload_id] = threading.Lock()
+            return self._locks[upload_id]
+
+    def _session_dir(self, upload_id):
+        # Upload ids are generated by us, reject anything that is not a plain hex id
+        if not upload_id or not all(c in '0123456789abcdef' for c in upload_id):
+            raise UploadError('Invalid upload id', 404)
+        return os.path.join(self.sessions_dir, upload_id)
+
+    def _load_session(self, upload_id):
+        session_path = os.path.join(self._session_dir(upload_id), 'session.json')
+        try:
+            with open(session_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError('Upload session not found', 404)
+
+    def _save_session(self, session):
+        session_dir = self._session_dir(session['upload_id'])
+        session['updated'] = time.time()
+        tmp_path = os.path.join(session_dir, 'session.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        os.replace(tmp_path, os.path.join(session_dir, 'session.json'))
+
+    def _part_length(self, session, index):
+        start = index * session['part_size']
+        return min(session['part_size'], session['size'] - start)
+
+    def create_session(self, filename, size):
+        """Create an upload session and preallocate the destination file"""
+        if size is None or size <= 0:
+            raise UploadError('File size must be a positive number of bytes')
+
+        upload_id = uuid.uuid4().hex
+        session_dir = self._session_dir(upload_id)
+        os.makedirs(session_dir)
+
+        data_path = os.path.join(session_dir, 'data')
+        fd = os.open(data_path, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError:
+                    # Some filesystems (e.g. Docker Desktop mounts) don't support fallocate
+                    os.ftruncate(fd, size)
+            else:
+                os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+        session = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'part_size': self.part_size,
+            'total_parts': max(1, -(-size // self.part_size)),
+            'part_hashes': {},
+            'created': time.time(),
+        }
+        self._save_session(session)
+        print(f"Created upload session {upload_id} for {filename} ({size / (1024*1024):.2f} MB)")
+        return self.get_status(upload_id, session)
+
+    def get_status(self, upload_id, session=None):
+        """Return the public state of a session, used by clients to resume"""
+        if session is None:
+            session = self._load_session(upload_id)
+        received = sorted(int(index) for index in session['part_hashes'])
+        return {
+            'upload_id': session['upload_id'],
+            'filename': session['filename'],
+            'size': session['size'],
+            'part_size': session['part_size'],
+            'total_parts': session['total_parts'],
+            'received_parts': received,
+        }
+
+    @staticmethod
+    def parse_content_range(header):
+        """Parse a ``bytes start-end/total`` header into (start, end, total)"""
+        try:
+            unit, _, spec = header.strip().partition(' ')
+            byte_range, _, total = spec.partition('/')
+            start, _, end = byte_range.partition('-')
+            if unit != 'bytes':
+                raise ValueError(unit)
+            return int(start), int(end), int(total)
+        except (AttributeError, ValueError):
+            raise UploadError('Invalid or missing Content-Range header')
+
+    def write_range(self, upload_id, content_range, stream):
+        """Write one part received as a byte range into the preallocated file.
+
+        Ranges must start on a part boundary and cover exactly one part. The part
+        is hashed while it is written, and recorded only once fully on disk, so
+        a dropped connection simply leaves the part missing for the client to
+        retry.
+        """
+        start, end, total = self.parse_content_range(content_range)
+        session = self._load_session(upload_id)
+
+        if total != session['size']:
+            raise UploadError('Content-Range total does not match the upload size')
+        if start % session['part_size'] != 0:
+            raise UploadError('Byte ranges must start on a part boundary')
+        index = start // session['part_size']
+        expected_length = self._part_length(session, index)
+        if index >= session['total_parts'] or end - start + 1 != expected_length:
+            raise UploadError('Byte range does not match a part of this upload', 416)
+
+        data_path = os.path.join(self._session_dir(upload_id), 'data')
+        part_hash = hashlib.sha256()
+        written = 0
+        fd = os.open(data_path, os.O_WRONLY)
+        try:
+            while written < expected_length:
+                chunk = stream.read(min(STREAM_BUFFER_SIZE, expected_length - written))
+                if not chunk:
+                    break
+                view = memoryview(chunk)
+                while view:
+                    count = os.pwrite(fd, view, start + written)
+                    part_hash.update(view[:count])
+                    view = view[count:]
+                    written += count
+        finally:
+            os.close(fd)
+
+        if written != expected_length:
+            raise UploadError(f'Incomplete part {index}: received {written} of {expected_length} bytes')
+
+        with self._session_lock(upload_id):
+            session = self._load_session(upload_id)
+            session['part_hashes'][str(index)] = part_hash.hexdigest()
+            self._save_session(session)
+            return self.get_status(upload_id, session)
+
+    def finalize(self, upload_id, expected_hash=None):
+        """Check all parts arrived and move the file into its own job directory.
+
+        If the client computed the content hash itself it can pass it as
+        ``expected_hash``; a mismatch means corrupted parts and the session is
+        discarded. Returns (file_path, content_hash).
+        """
+        with self._session_lock(upload_id):
+            session = self._load_session(upload_id)
+            missing = [i for i in range(session['total_parts'])
+                       if str(i) not in session['part_hashes']]
+            if missing:
+                raise UploadError(f'Upload incomplete: {len(missing)} parts missing', 409)
+
+            content_hash = self.compute_content_hash(
+                session['part_hashes'][str(i)] for i in range(session['total_parts'])
+            )
+            if expected_hash and expected_hash != content_hash:
+                shutil.rmtree(self._session_dir(upload_id), ignore_errors=True)
+                raise UploadError('Uploaded data does not match the file hash, please upload again', 422)
+
+            session_dir = self._session_dir(upload_id)
+            job_dir = tempfile.mkdtemp(dir=self.base_dir)
+            file_path = os.path.join(job_dir, session['filename'])
+            os.replace(os.path.join(session_dir, 'data'), file_path)
+            shutil.rmtree(session_dir, ignore_errors=True)
+
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+
+        print(f"Upload {upload_id} finalized: {file_path} (sha256 tree hash {content_hash[:16]}...)")
+        return file_path, content_hash
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self, index):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def register_media(self, content_hash, file_path, size, duration=None):
+        """Remember an uploaded file by content hash so identical uploads can be skipped"""
+        with self._index_lock:
+            index = self._load_index()
+            entry = index.get(content_hash, {})
+            entry.update({
+                'file_path': file_path,
+                'size': size,
+                'duration': duration,
+                'updated': time.time(),
+            })
+            index[content_hash] = entry
+            self._save_index(index)
+
+    def register_transcription(self, file_path, transcription_path):
+        """Attach a saved transcription to the indexed media it was made from"""
+        file_path = os.path.normpath(file_path)
+        with self._index_lock:
+            index = self._load_index()
+            for entry in index.values():
+                if os.path.normpath(entry.get('file_path', '')) == file_path:
+                    entry['transcription_path'] = transcription_path
+                    entry['updated'] = time.time()
+                    self._save_index(index)
+                    return True
+        return False
+
+    def lookup(self, content_hash, size):
+        """Find media (or a transcription of it) already on the server with this content hash.
+
+        Returns a dict with ``file_path``, ``duration`` and ``transcription_path``
+        for whatever still exists on disk, or None if nothing does.
+        """
+        with self._index_lock:
+            index = self._load_index()
+            entry = index.get(content_hash)
+            if not entry or entry.get('size') != size:
+                return None
+
+            file_path = entry.get('file_path')
+            if file_path and not os.path.exists(file_path):
+                file_path = None
+            transcription_path = entry.get('transcription_path')
+            if transcription_path and not os.path.exists(transcription_path):
+                transcription_path = None
+
+            if not file_path and not transcription_path:
+                # Everything this entry pointed at has been cleaned up
+                del index[content_hash]
+                self._save_index(index)
+                return None
+
+            return {
+                'file_path': file_path,
+                'duration': entry.get('duration') if file_path else None,
+                'transcription_path': transcription_path,
+            }
+
+    @staticmethod
+    def make_challenge(content_hash, size):
+        """Pick a random byte range of a file and a nonce the client has to hash together.
+
+        A content hash can be learned without having the file, so anything
+        derived from the file's content is only handed out to clients that
+        answer this with ``verify_proof``.
+        """
+        length = min(size, PROOF_RANGE_SIZE)
+        return {
+            'content_hash': content_hash,
+            'size': size,
+            'offset': secrets.randbelow(size - length + 1),
+            'length': length,
+            'nonce': secrets.token_hex(16),
+            'expires': time.time() + PROOF_CHALLENGE_SECONDS,
+        }
+
+    @staticmethod
+    def compute_proof(file_path, challenge):
+        """SHA-256 over the challenge's nonce followed by its byte range of the file"""
+        digest = hashlib.sha256(bytes.fromhex(challenge['nonce']))
+        with open(file_path, 'rb') as f:
+            f.seek(challenge['offset'])
+            digest.update(f.read(challenge['length']))
+        return digest.hexdigest()
+
+    def verify_proof(self, challenge, proof):
+        """Check the answer to a ``make_challenge`` challenge against the server's copy of the file.
+
+        Returns what ``lookup`` returns for the file; raises UploadError if the
+        challenge has expired, the file is gone, or the proof doesn't match.
+        """
+        if not challenge or challenge['expires'] < time.time():
+            raise UploadError('The upload challenge has expired, look the file up again')
+        existing = self.lookup(challenge['content_hash'], challenge['size'])
+        if not existing or not existing['file_path']:
+            raise UploadError('The file is no longer on the server', 404)
+        expected = self.compute_proof(existing['file_path'], challenge)
+        if not isinstance(proof, str) or not hmac.compare_digest(proof.lower(), expected):
+            raise UploadError('The proof does not match the file', 403)
+        return existing
+
+    def adopt_spooled_file(self, spool_path, filename, spool_dir):
+        """Take over a request body that nginx already spooled to disk.
+
+        The spooled file is hardlinked into a fresh job directory, so the upload
+        costs no further disk writes; nginx deletes its own name for the file
+        when the request ends (``client_body_in_file_only clean``). Only files
+        inside ``spool_dir`` are accepted. Falls back to a copy when the spool
+        directory is on a different filesystem.
+        """
+        if not spool_dir or not spool_path:
+            raise UploadError('Spooled uploads are not configured')
+
+        spool_root = os.path.realpath(spool_dir)
+        source = os.path.realpath(spool_path)
+        if not source.startswith(spool_root + os.sep):
+            raise UploadError('Spooled file is outside the upload spool directory', 403)
+        if not os.path.isfile(source):
+            raise UploadError('Spooled file not found', 404)
+
+        job_dir = tempfile.mkdtemp(dir=self.base_dir)
+        file_path = os.path.join(job_dir, filename)
+        try:
+            os.link(source, file_path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            print(f"Could not hardlink spooled upload ({e}), copying instead")
+            shutil.copyfile(source, file_path)
+
+        print(f"Adopted spooled upload {source} as {file_path} ({os.path.getsize(file_path) / (1024*1024):.2f} MB)")
+        return file_path
+
+    def receive_stream(self, stream, filename, content_length):
+        """Write a raw request body straight into a job directory.
+
+        Used when no proxy spooled the body for us. The body is written once,
+        without multipart parsing, and the content hash is computed on the fly
+        with the same per-part scheme as resumable uploads.
+        Returns (file_path, content_hash).
+        """
+        if not content_length:
+            raise UploadError('Content-Length is required', 411)
+
+        job_dir = tempfile.mkdtemp(dir=self.base_dir)
+        file_path = os.path.join(job_dir, filename)
+        part_hashes = []
+        part_hash = hashlib.sha256()
+        part_filled = 0
+        received = 0
+
+        with open(file_path, 'wb') as f:
+            while received < content_length:
+                chunk = stream.read(min(STREAM_BUFFER_SIZE, content_length - received))
+                if not chunk:
+                    break
+                f.write(chunk)
+                received += len(chunk)
+
+                # Feed the per-part hashes, splitting reads that straddle a part boundary
+                view = memoryview(chunk)
+                while view:
+                    take = min(len(view), self.part_size - part_filled)
+                    part_hash.update(view[:take])
+                    part_filled += take
+                    view = view[take:]
+                    if part_filled == self.part_size:
+                        part_hashes.append(part_hash.hexdigest())
+                        part_hash = hashlib.sha256()
+                        part_filled = 0
+
+        if received != content_length:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise UploadError(f'Incomplete upload: received {received} of {content_length} bytes')
+
+        if part_filled or not part_hashes:
+            part_hashes.append(part_hash.hexdigest())
+
+        return file_path, self.compute_content_hash(part_hashes)
+
+    def abort(self, upload_id):
+        """Discard an upload session and its partial data"""
+        session_dir = self._session_dir(upload_id)
+        with self._session_lock(upload_id):
+            shutil.rmtree(session_dir, ignore_errors=True)
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+
+
+# Singleton instance
+_upload_service = None
+
+def get_upload_service():
+    """Get singleton instance of ResumableUploadService"""
+    global _upload_service
+    if _upload_service is None:
+        _upload_service = ResumableUploadService()
+    return _upload_service
@@ -1,8 +1,25 @@
 import os
+import re
+import json
 import tempfile
 from urllib.parse import urlparse, parse_qs
 import yt_dlp
 
+from download_policy import get_audio_download_policy
+
+
+# Transcript sources a user can ask for
+TRANSCRIPT_SOURCE_AUTO = 'auto'          # captions when available, otherwise transcribe audio
+TRANSCRIPT_SOURCE_CAPTIONS = 'captions'  # captions only, fail if there are none
+TRANSCRIPT_SOURCE_AUDIO = 'audio'        # always download and transcribe the audio
+TRANSCRIPT_SOURCES = (TRANSCRIPT_SOURCE_AUTO, TRANSCRIPT_SOURCE_CAPTIONS, TRANSCRIPT_SOURCE_AUDIO)
+
+# Caption formats we can convert, in order of preference
+CAPTION_FORMATS = ['json3', 'vtt']
+
+# Playlists and channels are expanded to at most this many videos
+MAX_PLAYLIST_ITEMS = int(os.getenv('MAX_PLAYLIST_ITEMS', '50'))
+
 
 class YouTubeService:
     @staticmethod
@@ -31,6 +48,9 @@ class YouTubeService:
                 elif '/v/' in parsed.path:
                     # https://www.youtube.com/v/VIDEO_ID
                     return parsed.path.split('/v/')[1]
+                elif '/shorts/' in parsed.path or '/live/' in parsed.path:
+                    # https://www.youtube.com/shorts/VIDEO_ID, https://www.youtube.com/live/VIDEO_ID
+                    return parsed.path.rstrip('/').split('/')[-1]
             elif parsed.netloc in ['youtu.be', 'yt.be']:
                 # https://youtu.be/VIDEO_ID
                 return parsed.path[1:]
@@ -40,29 +60,77 @@ class YouTubeService:
             return None
 
     @staticmethod
-    def download_video(url, cookies_path=None):
-        """Download YouTube video using yt-dlp and return path to downloaded file"""
+    def is_playlist_url(url):
+        """Check if a YouTube URL points to a playlist or a channel rather than a single video"""
+        if not YouTubeService.is_youtube_url(url):
+            return False
+        parsed = urlparse(url)
+        query = parse_qs(parsed.query)
+        if parsed.path == '/playlist' and 'list' in query:
+            return True
+        return parsed.path.startswith(('/@', '/channel/', '/c/', '/user/'))
+
+    @staticmethod
+    def expand_playlist(url, cookies_path=None, limit=MAX_PLAYLIST_ITEMS):
+        """List the videos of a playlist or channel without downloading anything.
+
+        Returns a dict with 'title' and 'entries', a list of dicts with 'url',
+        'title' and 'duration' (None when YouTube doesn't list it).
+        """
+        parsed = urlparse(url)
+        parts = [part for part in parsed.path.split('/') if part]
+        if parts and (parts[0].startswith('@') and len(parts) == 1 or
+                      parts[0] in ('channel', 'c', 'user') and len(parts) == 2):
+            # A channel's home page lists tabs, not videos
+            url = parsed._replace(path=parsed.path.rstrip('/') + '/videos').geturl()
+
+        ydl_opts = {
+            'extract_flat': 'in_playlist',
+            'playlistend': limit,
+            'quiet': True,
+            'no_warnings': True,
+        }
+        if cookies_path and os.path.exists(cookies_path):
+            ydl_opts['cookiefile'] = cookies_path
+
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+        except Exception as e:
+            print(f"Error expanding playlist: {e}")
+            raise ValueError(f"Failed to read YouTube playlist: {str(e)}")
+
+        entries = []
+        for entry in info.get('entries') or []:
+            if not entry or not entry.get('id') or entry.get('ie_key') not in (None, 'Youtube'):
+                continue  # nested playlists, deleted or private videos
+            entries.append({
+                'url': f"https://www.youtube.com/watch?v={entry['id']}",
+                'title': entry.get('title') or entry['id'],
+                'duration': entry.get('duration'),
+            })
+            if len(entries) >= limit:
+                break
+
+        print(f"Playlist '{info.get('title')}' has {len(entries)} videos")
+        return {'title': info.get('title') or 'YouTube playlist', 'entries': entries}
+
+    @staticmethod
+    def download_video(url, cookies_path=None, output_dir=None, progress_hooks=None):
+        """Download YouTube audio using yt-dlp and return path to downloaded file"""
         print("Downloading YouTube video...")
         if cookies_path:
             print(f"Using cookies for authentication")
         
-        temp_dir = tempfile.mkdtemp(dir='temp_resources')
+        temp_dir = output_dir or tempfile.mkdtemp(dir='temp_resources')
         output_template = os.path.join(temp_dir, '%(title)s.%(ext)s')
         
         try:
-            # Download video using yt-dlp
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': output_template,
-                'quiet': False,
-                'no_warnings': False,
-                'progress': True,
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-            }
+            # Download the smallest acceptable audio-only stream, keeping its native codec
+            policy = get_audio_download_policy()
+            ydl_opts = policy.ydl_options(output_template)
+            if progress_hooks:
+                ydl_opts['progress_hooks'] = progress_hooks
             
             # Add cookies if provided
             if cookies_path and os.path.exists(cookies_path):
@@ -70,16 +138,149 @@ class YouTubeService:
                 print(f"Added cookies file to yt-dlp options")
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+                info = ydl.extract_info(url, download=True)
+                file_path = policy.downloaded_path(ydl, info)
             
-            # Find the downloaded file
-            for root, _, files in os.walk(temp_dir):
-                for file in files:
-                    return os.path.join(root, file)
-            
-            raise Exception("No file downloaded")
+            print(f"Downloaded {info.get('format_id')} ({info.get('ext')}, {info.get('abr') or '?'} kbps)")
+            return file_path
         except Exception as e:
             print(f"Error downloading video: {e}")
             if 'Sign in to confirm' in str(e) or 'age-restricted' in str(e):
-                raise ValueError(f"This video requires authentication. Please provide a cookies.txt file exported from your browser.")
-            raise ValueError(f"Failed to download YouTube video: {str(e)}") 
\ No newline at end of file
+                raise ValueError("This video requires authentication. Please provide a cookies.txt file exported from your browser.")
+            raise ValueError(f"Failed to download YouTube video: {str(e)}")
+
+    @staticmethod
+    def probe(url, cookies_path=None):
+        """Metadata of the audio download_video would fetch, without downloading it"""
+        overrides = {}
+        if cookies_path and os.path.exists(cookies_path):
+            overrides['cookiefile'] = cookies_path
+        try:
+            return get_audio_download_policy().probe(url, **overrides)
+        except Exception as e:
+            if 'Sign in to confirm' in str(e) or 'age-restricted' in str(e):
+                raise ValueError("This video requires authentication. Please provide a cookies.txt file exported from your browser.")
+            raise ValueError(f"Failed to look up YouTube video: {str(e)}")
+
+    @staticmethod
+    def _pick_caption_track(info, languages=None, any_language=False):
+        """Choose the best caption track from yt-dlp metadata.
+
+        Creator-uploaded subtitles are preferred over automatic captions, but only
+        in the video's original language or one of ``languages``: a track in
+        another language is a translation, not a transcript. With
+        ``any_language`` (captions were asked for explicitly) any uploaded track
+        is accepted when none of those match. Automatic captions are only
+        accepted in the original language, because the other languages YouTube
+        offers are machine translations of them.
+        Returns (language, track_formats, is_automatic) or None.
+        """
+        original_language = info.get('language')
+        preferred = [lang for lang in (languages or []) if lang]
+        if original_language:
+            preferred.append(original_language)
+
+        def match(tracks, candidates):
+            for lang in candidates:
+                for key in tracks:
+                    if key == lang or key.split('-')[0] == lang.split('-')[0]:
+                        return key
+            return None
+
+        manual = {k: v for k, v in (info.get('subtitles') or {}).items() if k != 'live_chat' and v}
+        key = match(manual, preferred)
+        if not key and any_language and manual:
+            key = next(iter(manual))
+        if key:
+            return key, manual[key], False
+
+        automatic = info.get('automatic_captions') or {}
+        for key, formats in automatic.items():
+            if key.endswith('-orig') and formats:
+                return key, formats, True
+        if original_language:
+            key = match(automatic, [original_language])
+            if key and automatic[key]:
+                return key, automatic[key], True
+
+        return None
+
+    @staticmethod
+    def _captions_to_text(data, ext):
+        """Convert a json3 or WebVTT caption file into plain transcript text"""
+        if ext == 'json3':
+            events = json.loads(data).get('events') or []
+            pieces = []
+            for event in events:
+                for seg in event.get('segs') or []:
+                    pieces.append(seg.get('utf8', ''))
+            text = ''.join(pieces)
+        else:
+            lines = []
+            for line in data.splitlines():
+                line = line.strip()
+                if (not line or line == 'WEBVTT' or '-->' in line or line.isdigit()
+                        or line.startswith(('Kind:', 'Language:', 'NOTE', 'STYLE'))):
+                    continue
+                line = re.sub(r'<[^>]+>', '', line).strip()
+                # Automatic captions repeat each line while it scrolls, keep only new lines
+                if line and (not lines or lines[-1] != line):
+                    lines.append(line)
+            text = ' '.join(lines)
+
+        return re.sub(r'\s+', ' ', text).strip()
+
+    @staticmethod
+    def fetch_captions(url, cookies_path=None, languages=None, any_language=False):
+        """Fetch an existing caption track and convert it to transcript text.
+
+        Only metadata and the caption file are downloaded, never the media.
+        ``any_language`` accepts uploaded subtitles in any language, see
+        ``_pick_caption_track``.
+        Returns a dict with 'text', 'language', 'is_automatic', 'title' and
+        'duration', or None when the video has no acceptable track.
+        """
+        print("Checking YouTube captions...")
+        ydl_opts = {
+            'skip_download': True,
+            'quiet': True,
+            'no_warnings': True,
+        }
+        if cookies_path and os.path.exists(cookies_path):
+            ydl_opts['cookiefile'] = cookies_path
+
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+                track = YouTubeService._pick_caption_track(info, languages, any_language)
+                if not track:
+                    print("No acceptable caption track found")
+                    return None
+
+                language, formats, is_automatic = track
+                by_ext = {f.get('ext'): f for f in formats if f.get('url')}
+                ext = next((e for e in CAPTION_FORMATS if e in by_ext), None)
+                if not ext:
+                    print(f"No supported caption format for {language}: {list(by_ext)}")
+                    return None
+
+                data = ydl.urlopen(by_ext[ext]['url']).read().decode('utf-8')
+
+            text = YouTubeService._captions_to_text(data, ext)
+            if not text:
+                return None
+
+            print(f"Using {'automatic' if is_automatic else 'uploaded'} captions ({language}, {ext}): {len(text)} characters")
+            return {
+                'text': text,
+                'language': language,
+                'is_automatic': is_automatic,
+                'title': info.get('title'),
+                'duration': info.get('duration'),
+            }
+        except Exception as e:
+            # Captions are only a shortcut; any failure falls back to transcribing audio
+            print(f"Could not fetch captions: {e}")
+            if 'Sign in to confirm' in str(e) or 'age-restricted' in str(e):
+                raise ValueError("This video requires authentication. Please provide a cookies.txt file exported from your browser.")
+            return None